@@ -0,0 +1,268 @@
+# ai_assistant/admission.py
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+import metrics
+from config import (
+    GEMINI_MAX_CONCURRENT, GEMINI_RATE_PER_SECOND, GEMINI_BURST, GEMINI_QUEUE_DEADLINE_SECONDS,
+    GEMINI_EMERGENCY_RESERVE,
+)
+
+# Priority classes, most urgent first.
+EMERGENCY = 0     # messages the emergency classifier flagged
+INTERACTIVE = 1   # a patient waiting on a triage reply
+BACKGROUND = 2    # summaries, titles and context folds
+PRIORITY_NAMES = ("emergency", "interactive", "background")
+
+# Assumed duration of a Gemini call until real ones have been measured.
+INITIAL_CALL_SECONDS = 2.0
+
+class Overloaded(Exception):
+    """Raised when a call would wait longer than the queue deadline. Sent to the client as 429."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Model calls are over capacity; retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+class Ticket:
+    """Permission to make one model call. Release it when the call is done; releasing twice is harmless."""
+
+    __slots__ = ("_controller", "_started", "_released")
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self._started = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._observe_call(time.monotonic() - self._started)
+            self._controller._release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+class AdmissionController:
+    """
+    Gatekeeper in front of every Gemini call.
+
+    At most `max_concurrent` calls run at once, and calls start no faster than a token
+    bucket of `rate` per second (bursts up to `burst`) allows. The last `reserve` slots
+    are kept for emergencies, so one never waits behind a full house of routine calls.
+    Waiting calls are served by priority class, and within a class round-robin by user,
+    so one user's burst of requests cannot starve everyone else's.
+
+    Interactive calls are turned away with Overloaded when their expected wait is over
+    `deadline` seconds, or when they have waited that long. Emergency and background
+    calls are never turned away: the former must not be, and the latter have no one
+    waiting on them.
+    """
+
+    def __init__(self, max_concurrent: int = GEMINI_MAX_CONCURRENT, rate: float = GEMINI_RATE_PER_SECOND,
+                 burst: int = GEMINI_BURST, deadline: float = GEMINI_QUEUE_DEADLINE_SECONDS,
+                 reserve: int = GEMINI_EMERGENCY_RESERVE):
+        self.max_concurrent = max_concurrent
+        self.reserve = reserve
+        self.rate = rate
+        self.burst = burst
+        self.deadline = deadline
+        self._in_flight = 0
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        # One queue per priority: user_id -> deque of waiting futures, in round-robin order.
+        self._queues: list[OrderedDict[str, deque]] = [OrderedDict() for _ in PRIORITY_NAMES]
+        self._waiting = [0] * len(PRIORITY_NAMES)
+        self._wakeup: asyncio.TimerHandle | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._call_seconds = INITIAL_CALL_SECONDS
+        self.admitted = [0] * len(PRIORITY_NAMES)
+        self.rejected = 0
+        self.timed_out = 0
+        self._wait_seconds = [0.0] * len(PRIORITY_NAMES)
+        self._max_wait_seconds = 0.0
+
+    async def acquire(self, user_id: str, priority: int = INTERACTIVE) -> Ticket:
+        """Waits for a call slot. Raises Overloaded if an interactive call would wait too long."""
+        self._bind_loop()
+        if priority == INTERACTIVE:
+            expected = self.expected_wait(user_id, priority)
+            if expected > self.deadline:
+                self.rejected += 1
+                raise Overloaded(expected)
+
+        started = time.monotonic()
+        if not self._can_start(priority) or any(self._waiting[:priority + 1]):
+            future = asyncio.get_running_loop().create_future()
+            self._queues[priority].setdefault(user_id, deque()).append(future)
+            self._waiting[priority] += 1
+            self._dispatch()
+            try:
+                if priority == INTERACTIVE:
+                    await asyncio.wait_for(asyncio.shield(future), self.deadline)
+                else:
+                    await future
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if future.done() and not future.cancelled():
+                    # The slot was granted just as we gave up; hand it on.
+                    self._release()
+                else:
+                    future.cancel()
+                    self._forget(priority, user_id, future)
+                if isinstance(e, asyncio.TimeoutError):
+                    self.timed_out += 1
+                    raise Overloaded(self.expected_wait(user_id, priority)) from None
+                raise
+        else:
+            self._start()
+
+        waited = time.monotonic() - started
+        self.admitted[priority] += 1
+        self._wait_seconds[priority] += waited
+        self._max_wait_seconds = max(self._max_wait_seconds, waited)
+        metrics.observe_stage("admission_wait", waited)
+        return Ticket(self)
+
+    def slot(self, user_id: str, priority: int = INTERACTIVE):
+        """`async with admission.slot(user_id, priority):` around a model call."""
+        return _SlotContext(self, user_id, priority)
+
+    def expected_wait(self, user_id: str, priority: int) -> float:
+        """
+        Rough seconds until a new call from this user would start. Round-robin puts it
+        behind every more urgent call, this user's own queued calls, and at most one more
+        call per queued call of theirs from each other user.
+        """
+        queue = self._queues[priority]
+        mine = len(queue.get(user_id, ()))
+        ahead = sum(self._waiting[:priority]) + mine + sum(
+            min(len(waiters), mine + 1) for other, waiters in queue.items() if other != user_id
+        )
+        if ahead == 0 and self._can_start(priority):
+            return 0.0
+        throughput = self._limit(priority) / self._call_seconds
+        if self.rate:
+            throughput = min(throughput, self.rate)
+        return (ahead + 1) / throughput
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # A new event loop (tests, benchmarks): nothing from the old one can still be waiting.
+            self._loop = loop
+            self._in_flight = 0
+            self._queues = [OrderedDict() for _ in PRIORITY_NAMES]
+            self._waiting = [0] * len(PRIORITY_NAMES)
+            self._wakeup = None
+
+    def _limit(self, priority: int) -> int:
+        return self.max_concurrent if priority == EMERGENCY else max(1, self.max_concurrent - self.reserve)
+
+    def _can_start(self, priority: int) -> bool:
+        if self._in_flight >= self._limit(priority):
+            return False
+        self._refill()
+        return not self.rate or self._tokens >= 1
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _start(self):
+        self._in_flight += 1
+        if self.rate:
+            self._tokens -= 1
+
+    def _release(self):
+        self._in_flight -= 1
+        self._dispatch()
+
+    def _next_waiter(self) -> asyncio.Future | None:
+        """The next call allowed to start: most urgent class first, round-robin by user within it."""
+        for priority, queue in enumerate(self._queues):
+            # Limits only tighten for less urgent classes, so if this one can't start, none can.
+            if not queue or not self._can_start(priority):
+                if queue:
+                    return None
+                continue
+            while queue:
+                user_id, waiters = next(iter(queue.items()))
+                future = waiters.popleft()
+                self._waiting[priority] -= 1
+                if waiters:
+                    # This user goes to the back of the line for their next call.
+                    queue.move_to_end(user_id)
+                else:
+                    del queue[user_id]
+                if not future.done():
+                    return future
+        return None
+
+    def _dispatch(self):
+        while (future := self._next_waiter()) is not None:
+            self._start()
+            future.set_result(None)
+        if self.rate and any(self._waiting) and self._in_flight < self.max_concurrent and self._wakeup is None:
+            # Out of rate tokens: look again when the next one is due.
+            delay = (1 - self._tokens) / self.rate
+            self._wakeup = self._loop.call_later(delay, self._on_wakeup)
+
+    def _on_wakeup(self):
+        self._wakeup = None
+        self._dispatch()
+
+    def _forget(self, priority: int, user_id: str, future: asyncio.Future):
+        waiters = self._queues[priority].get(user_id)
+        if waiters and future in waiters:
+            waiters.remove(future)
+            self._waiting[priority] -= 1
+            if not waiters:
+                del self._queues[priority][user_id]
+
+    def _observe_call(self, seconds: float):
+        # Moving average of call duration, for expected_wait.
+        self._call_seconds += 0.1 * (seconds - self._call_seconds)
+
+    def stats(self) -> dict:
+        admitted = sum(self.admitted)
+        return {
+            "in_flight": self._in_flight,
+            "max_concurrent": self.max_concurrent,
+            "emergency_reserve": self.reserve,
+            "rate_per_second": self.rate,
+            "queued": {name: self._waiting[i] for i, name in enumerate(PRIORITY_NAMES)},
+            "admitted": {name: self.admitted[i] for i, name in enumerate(PRIORITY_NAMES)},
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait_ms": {
+                name: round(self._wait_seconds[i] / self.admitted[i] * 1000, 1) if self.admitted[i] else 0.0
+                for i, name in enumerate(PRIORITY_NAMES)
+            },
+            "max_wait_ms": round(self._max_wait_seconds * 1000, 1),
+            "avg_call_ms": round(self._call_seconds * 1000, 1) if admitted else None,
+        }
+
+class _SlotContext:
+    __slots__ = ("_controller", "_user_id", "_priority", "_ticket")
+
+    def __init__(self, controller: AdmissionController, user_id: str, priority: int):
+        self._controller = controller
+        self._user_id = user_id
+        self._priority = priority
+        self._ticket = None
+
+    async def __aenter__(self):
+        self._ticket = await self._controller.acquire(self._user_id, self._priority)
+        return self._ticket
+
+    async def __aexit__(self, *exc_info):
+        self._ticket.release()
+
+admission = AdmissionController()
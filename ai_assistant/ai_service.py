@@ -1,162 +1,829 @@
 # ai_assistant/ai_service.py
 
-import google.generativeai as genai
+import asyncio
+import base64
 import re
-import io
+import time
 import json
-from PIL import Image
+from datetime import datetime, timezone
+from typing import Callable
 
 import config
 import database_service as db
-from prompts import TRIAGE_SYSTEM_PROMPT, SUMMARY_PROMPT, INITIAL_GREETING, TITLE_GENERATION_PROMPT
+import metrics
+import resilience
+from admission import admission, EMERGENCY, INTERACTIVE, BACKGROUND
+from analytics import triage_analytics
+from image_pipeline import image_pipeline
+from pdf_cache import pdf_cache
+from model_registry import get_model, model_for
+from llm_usage import SessionUsage
+from job_queue import background_jobs
+from message_buffer import message_log
+from session_store import VersionConflict, session_store
+from timing import StageTimer, turn_stats
+from context_window import fold_point, format_transcript, summary_entries
+from emergency_classifier import EmergencyMatch, classify_emergency, fast_path_stats
+from structured_log import get_logger
+from prompts import (TRIAGE_SYSTEM_PROMPT, SUMMARY_AND_TITLE_PROMPT, INITIAL_GREETING, TITLE_GENERATION_PROMPT,
+                     CONTEXT_SUMMARY_PROMPT, EMERGENCY_HANDOVER_MESSAGE, CRISIS_SUPPORT_MESSAGE)
 
-try:
-    genai.configure(api_key=config.GEMINI_API_KEY)
-    print("Gemini API configured successfully.")
-except Exception as e:
-    print(f"Error configuring Gemini API: {e}")
+log = get_logger(__name__)
+
+# What the patient sees when a turn fails; never remembered as a request's result.
+ERROR_REPLY = "Sorry, I encountered an error. Please try again."
+
+# Approximate fixed cost of an AIService and its ids, excluding history.
+SESSION_BASE_BYTES = 512
+
+# Roles used in the stored history, matching the Gemini API.
+USER_ROLE = "user"
+MODEL_ROLE = "model"
+
+ESI_TAG_PATTERN = re.compile(r"^Final ESI Level:\s*(\d+)", re.IGNORECASE)
+
+# Keeps streaming producer tasks alive until they finish, even if the client has gone away.
+_stream_tasks: set[asyncio.Task] = set()
+
+# Called as listener(session_id, event) for what a session's client may want pushed to it
+# as it happens: a new ESI level, the summary being ready, a revised reply.
+_event_listeners: list[Callable[[str, dict], None]] = []
+
+def on_session_event(listener: Callable[[str, dict], None]):
+    """Registers a listener for session events; main.py sends them to the session's WebSocket."""
+    _event_listeners.append(listener)
+
+def _publish(session_id: str, event: dict):
+    for listener in _event_listeners:
+        listener(session_id, event)
+
+class EsiTagDetector:
+    """
+    Detects the `Final ESI Level:` tag incrementally while a reply streams in.
+    Each line is checked once, when it is complete, instead of re-scanning the
+    whole text after every chunk.
+    """
+
+    def __init__(self):
+        self._line = ""
+        self.esi_level: int | None = None
+
+    def feed(self, chunk: str):
+        lines = (self._line + chunk).split("\n")
+        self._line = lines.pop()
+        for line in lines:
+            self._check(line)
+
+    def finish(self) -> int | None:
+        """Checks the trailing line (replies usually end on the tag) and returns the level found."""
+        self._check(self._line)
+        self._line = ""
+        return self.esi_level
+
+    def _check(self, line: str):
+        match = ESI_TAG_PATTERN.match(line.strip())
+        if match:
+            # A reply may revise its level; like the old regex, the first tag wins.
+            if self.esi_level is None:
+                self.esi_level = int(match.group(1))
+
+def parse_esi_level(text: str) -> int | None:
+    """Returns the ESI level from a complete reply, or None if it has no tag."""
+    detector = EsiTagDetector()
+    detector.feed(text)
+    return detector.finish()
 
 class AIService:
-    """Manages a single user's conversation with the AI."""
+    """
+    Manages a single user's conversation with the AI.
+
+    Only the ids and a compact history are kept per session. Each history entry is
+    a `(role, text, image)` tuple, where `image` is a Gemini blob dict or None. Each
+    call uses the shared model `model_registry` routes its task to, and is counted in
+    `usage`.
+
+    Once the history outgrows the context window, its older turns are folded into
+    `context_summary` in the background and dropped. `summarized_turns` counts the
+    stored messages the summary stands in for, so a restore can skip them. Once the
+    session has used its token budget, the window shrinks to the CONTEXT_BUDGET_* limits.
+
+    After every turn the state is saved to the shared `session_store`, so the next
+    turn can be served by any worker (with memory://, the session cache is the store). `version` is the stored version this object
+    last loaded or saved, and `_saved_len` how much of `history` that version holds.
+    `_saved_esi_level` is the ESI level last written to the database and counted in the analytics,
+    and `_triage_timed` whether the session's time to triage has been counted, which a
+    reopened triage keeps.
+    """
 
-    def __init__(self, user_id: str):
-        """Initializes a new AI service instance for a user."""
+    __slots__ = ("user_id", "session_id", "history", "context_summary", "summarized_turns", "esi_level",
+                 "created_at", "usage", "version", "_saved_len", "_saved_esi_level", "_triage_timed", "_persist_lock", "_turn_lock")
+
+    def __init__(self, user_id: str, session_id: str | None = None, history: list[tuple] | None = None,
+                 context_summary: str | None = None, summarized_turns: int = 0, esi_level: int | None = None,
+                 created_at: str | None = None, usage: SessionUsage | None = None):
+        """Initializes a new AI service instance for a user. Use `create` to also open a DB session."""
         self.user_id = user_id
-        self.model = genai.GenerativeModel("gemini-2.5-flash", system_instruction=TRIAGE_SYSTEM_PROMPT)
-        self.chat = self.model.start_chat(history=[])
-        self.session_id = db.create_session(self.user_id)
+        self.session_id = session_id
+        self.history = history if history is not None else []
+        self.context_summary = context_summary
+        self.summarized_turns = summarized_turns
+        self.esi_level = esi_level
+        # When the session started (ISO 8601), for time-to-triage; None if unknown.
+        self.created_at = created_at
+        self.usage = usage or SessionUsage()
+        self.version = 0
+        # Whatever history was passed in is already in the database, so it counts as saved.
+        self._saved_len = len(self.history)
+        self._saved_esi_level = esi_level
+        self._triage_timed = esi_level is not None
+        self._persist_lock = asyncio.Lock()
+        # Turns of one chat run one at a time, in arrival order (asyncio.Lock wakes waiters FIFO).
+        self._turn_lock = asyncio.Lock()
+
+    @classmethod
+    async def create(cls, user_id: str):
+        """Creates a new AI service with a fresh session in the database."""
+        instance = cls(user_id, created_at=datetime.now(timezone.utc).isoformat())
+        instance.session_id = await db.create_session_async(user_id)
 
         # If the session was created successfully, log the initial greeting from the bot
-        if self.session_id:
-            db.log_message(self.session_id, 'bot', INITIAL_GREETING)
-            
-        print(f"New AI Service initialized for user {self.user_id} with session {self.session_id}")
+        if instance.session_id:
+            triage_analytics.record_session(instance.created_at)
+            message_log.add(instance.session_id, 'bot', INITIAL_GREETING)
+            # The greeting is stored but never sent to Gemini, so a restore should skip it too.
+            instance.summarized_turns = 1
+            await instance.persist()
+
+        log.info("New AI Service initialized", extra={"user_id": instance.user_id, "session_id": instance.session_id})
+        return instance
+
+    def _start_chat(self, history: list[tuple] | None = None):
+        """
+        Starts a ChatSession on the shared triage model, seeded with the rolling summary
+        and `history` (this session's recent history by default).
+        """
+        if history is None:
+            history = self.history
+        gemini_history = [
+            {'role': turn[0], 'parts': _turn_content(turn)}
+            for turn in summary_entries(self.context_summary) + history
+        ]
+        return get_model(model_for("triage"), TRIAGE_SYSTEM_PROMPT).start_chat(history=gemini_history)
+
+    async def _prepare_turn(self, user_message: str, image_bytes: bytes | None, image_content_type: str | None,
+                            timer: StageTimer) -> tuple:
+        """
+        Preprocesses the image (Gemini needs the result), then starts its upload in the
+        background and queues the user's message for logging. Returns the user's history entry.
+
+        Neither the upload nor the message insert is awaited here, so both overlap with
+        the Gemini call. The message row holds the upload task and is written once the
+        upload finishes; if the upload fails, the row is written with no image URL.
+        """
+        image, image_url = None, None
+        if image_bytes:
+            with timer.stage("image"):
+                processed = await image_pipeline.process(image_bytes) if image_content_type else None
+            if processed:
+                image = {'mime_type': processed.content_type, 'data': processed.data}
+                image_url = asyncio.ensure_future(
+                    db.upload_image_async(processed.data, processed.content_type, processed.storage_key)
+                )
+            else:
+                # Not a readable image: keep the original upload, but don't send it to Gemini.
+                image_url = asyncio.ensure_future(db.upload_image_async(image_bytes, image_content_type))
+        message_log.add(self.session_id, 'user', user_message, image_url)
+
+        return (USER_ROLE, user_message, image)
+
+    def _check_emergency(self, user_message: str, timer: StageTimer) -> EmergencyMatch | None:
+        """
+        Runs the local emergency classifier. A match is answered by the fast path when it
+        is enabled; either way it puts the message at the front of the Gemini queue.
+        """
+        if not user_message:
+            return None
+        with timer.stage("emergency_check"):
+            return classify_emergency(user_message)
 
-    async def get_non_streamed_response(self, user_message: str, image_bytes: bytes | None = None, image_content_type: str | None = None) -> dict:
+    async def _admit_turn(self, emergency: EmergencyMatch | None, timer: StageTimer):
+        """
+        Waits for a Gemini slot for this turn. Raises Overloaded (429) if the queue is too
+        long, or CircuitOpen (503) if Gemini is failing and the turn would only fail too.
+        """
+        resilience.gemini.breaker.raise_if_open()
+        with timer.stage("queue"):
+            return await admission.acquire(self.user_id, EMERGENCY if emergency else INTERACTIVE)
+
+    def _emergency_turn(self, user_message: str, image_bytes: bytes | None, image_content_type: str | None,
+                        match: EmergencyMatch) -> dict:
+        """
+        Answers a message the local classifier matched as an emergency without waiting for
+        Gemini: the handover is returned and ESI 1 recorded straight away, and Gemini reviews
+        the same message in the background. Any photo is stored as uploaded, not preprocessed,
+        so nothing on this path waits for the image pipeline.
+        """
+        image_url = asyncio.ensure_future(db.upload_image_async(image_bytes, image_content_type)) if image_bytes else None
+        message_log.add(self.session_id, 'user', user_message, image_url)
+
+        reply = CRISIS_SUPPORT_MESSAGE if match.category == "self_harm" else EMERGENCY_HANDOVER_MESSAGE
+        prior_history = list(self.history)
+        user_turn = (USER_ROLE, user_message, None)
+        self.history += [user_turn, (MODEL_ROLE, reply, None)]
+        fast_path_stats.record_match(match)
+        log.warning("Emergency fast path matched", extra={
+            "session_id": self.session_id, "category": match.category, "phrase": match.phrase,
+        })
+
+        background_jobs.enqueue(
+            f"confirm:{self.session_id}:{len(self.history)}",
+            lambda: self.confirm_emergency(prior_history, user_turn, match),
+        )
+        return self._finish_turn(reply, 1)
+
+    async def confirm_emergency(self, prior_history: list[tuple], user_turn: tuple, match: EmergencyMatch):
+        """
+        Sends a fast-path message to Gemini as a normal turn and records whether it also
+        assessed ESI Level 1. If it did not, Gemini's answer replaces the fast path's (see
+        `_revise_fast_path`), and the match is logged for tuning the phrase lists.
+        Raises on Gemini errors so the job queue can retry.
+
+        The patient already has the handover, so this waits like a normal turn rather
+        than taking the slots kept for live emergency messages.
+        """
+        async with admission.slot(self.user_id, INTERACTIVE):
+            response = await _send(
+                lambda: self._start_chat(prior_history), _turn_content(user_turn), "confirm", self._account
+            )
+        esi_level = parse_esi_level(response.text)
+        if esi_level == 1:
+            fast_path_stats.confirmed += 1
+            return
+        fast_path_stats.disputed += 1
+        log.warning("Gemini disputed an emergency fast-path match", extra={
+            "session_id": self.session_id, "esi_level": esi_level, "category": match.category, "phrase": match.phrase,
+        })
+        await self._revise_fast_path(user_turn, response.text, esi_level)
+
+    async def _revise_fast_path(self, user_turn: tuple, reply: str, esi_level: int | None):
+        """
+        Replaces a disputed fast-path answer with Gemini's. Gemini's reply takes the
+        handover's place in the history and is stored after it, and the session takes
+        Gemini's ESI level, or is reopened (no level, no summary) if Gemini wants to
+        keep asking. The patient's client is told over its WebSocket, if it has one.
+        Nothing changes if the session's level has moved on from the fast path's ESI 1.
+        """
+        if self.esi_level != 1:
+            return
+        for index, entry in enumerate(self.history[:-1]):
+            if entry is user_turn:
+                self.history[index + 1] = (MODEL_ROLE, reply, None)
+                break
+        message_log.add(self.session_id, 'bot', reply)
+        if esi_level is not None:
+            self.record_esi_level(esi_level)
+        else:
+            self._reopen_triage()
+        fast_path_stats.revised += 1
+        _publish(self.session_id, {
+            "type": "revised", "response_text": reply, "is_complete": esi_level is not None, "esi_level": esi_level,
+        })
+        await self.persist()
+
+    def _reopen_triage(self):
+        """Clears the session's ESI level and summary, so the triage carries on as if never assessed."""
+        log.info("Reopening triage", extra={"session_id": self.session_id, "esi_level": self.esi_level})
+        self.esi_level = None
+        background_jobs.enqueue(f"esi:{self.session_id}", self._save_esi_level)
+
+    def _finish_turn(self, full_response_text: str, esi_level: int | None) -> dict:
+        """Queues the ESI level (if any) and the bot's reply for saving and builds the result."""
+        if esi_level is not None:
+            self.record_esi_level(esi_level)
+
+        message_log.add(self.session_id, 'bot', full_response_text)
+
+        return {
+            "response_text": full_response_text,
+            "is_complete": esi_level is not None,
+            "esi_level": esi_level
+        }
+
+    async def get_non_streamed_response(self, user_message: str, image_bytes: bytes | None = None, image_content_type: str | None = None,
+                                        timer: StageTimer | None = None) -> dict:
         """
         Generates a complete AI response without streaming. Returns a dictionary
-        with the response text and triage completion status.
+        with the response text and triage completion status. Stage timings are
+        recorded on `timer` if one is given. Clear-cut emergencies are answered by
+        the local fast path without waiting for Gemini. Raises Overloaded when the
+        Gemini queue is too long to take the message. A turn waits for the session's
+        previous turn to finish first.
         """
         if not self.session_id:
             return {"response_text": "Error: Session not found.", "is_complete": True, "esi_level": None}
 
-        pil_image = None
-        if image_bytes and image_content_type:
+        timer = timer or StageTimer()
+        with timer.stage("session_queue"):
+            await self._turn_lock.acquire()
+        try:
+            return await self._non_streamed_turn(user_message, image_bytes, image_content_type, timer)
+        finally:
+            self._turn_lock.release()
+
+    async def _non_streamed_turn(self, user_message: str, image_bytes: bytes | None, image_content_type: str | None,
+                                 timer: StageTimer) -> dict:
+        emergency = self._check_emergency(user_message, timer)
+        if emergency and config.EMERGENCY_FAST_PATH:
+            result = self._emergency_turn(user_message, image_bytes, image_content_type, emergency)
+            await self.persist()
+            timer.finish()
+            turn_stats.observe(timer)
+            return result
+
+        # Admitted before anything is logged, so a 429 leaves no trace of the message.
+        ticket = await self._admit_turn(emergency, timer)
+        async with ticket:
+            user_turn = await self._prepare_turn(user_message, image_bytes, image_content_type, timer)
+
             try:
-                pil_image = Image.open(io.BytesIO(image_bytes))
+                # Use await for the network call to the Gemini API
+                with timer.stage("llm"):
+                    full_response = await _send(
+                        self._start_chat, _turn_content(user_turn), "triage", self._account, hedge=True
+                    )
+                full_response_text = full_response.text
+                timer.prompt_tokens = _prompt_tokens(full_response)
+                self.history += [user_turn, (MODEL_ROLE, full_response_text, None)]
+                self._schedule_context_fold()
+                result = self._finish_turn(full_response_text, parse_esi_level(full_response_text))
+                await self.persist()
+                return result
+
             except Exception as e:
-                print(f"ERROR: Could not process image file: {e}")
+                log.error("Could not get response from Gemini API", extra={"session_id": self.session_id, "error": str(e)})
+                return {"response_text": ERROR_REPLY, "is_complete": True, "esi_level": None}
+            finally:
+                timer.finish()
+                turn_stats.observe(timer)
+
+    async def stream_response(self, user_message: str, image_bytes: bytes | None = None, image_content_type: str | None = None):
+        """
+        Streams the AI response as it is generated. Yields `token` events with text
+        chunks, then one final `done` event carrying the full text, ESI level and
+        completion status (or an `error` event).
 
-        image_url = db.upload_image(image_bytes, image_content_type) if image_bytes else None
-        db.log_message(self.session_id, 'user', user_message, image_url)
+        The Gemini stream is consumed by a separate task, so if the client disconnects
+        mid-reply the turn still completes and is saved. Raises Overloaded before the
+        first event when the Gemini queue is too long to take the message. Like
+        non-streamed turns, it waits for the session's previous turn to finish first.
+        """
+        if not self.session_id:
+            yield {"type": "error", "response_text": "Error: Session not found.", "is_complete": True, "esi_level": None}
+            return
 
+        timer = StageTimer()
+        with timer.stage("session_queue"):
+            await self._turn_lock.acquire()
+        handed_off = False
         try:
-            chat_input = [user_message]
-            if pil_image:
-                chat_input.append(pil_image)
+            emergency = self._check_emergency(user_message, timer)
+            if emergency and config.EMERGENCY_FAST_PATH:
+                result = self._emergency_turn(user_message, image_bytes, image_content_type, emergency)
+                await self.persist()
+                timer.finish()
+                turn_stats.observe(timer)
+                yield {"type": "token", "text": result["response_text"]}
+                yield {"type": "done", **result, "timings_ms": timer.as_dict(), "prompt_tokens": None}
+                return
 
-            # Use await for the network call to the Gemini API
-            full_response = await self.chat.send_message_async(chat_input)
-            full_response_text = full_response.text
+            ticket = await self._admit_turn(emergency, timer)
+            try:
+                user_turn = await self._prepare_turn(user_message, image_bytes, image_content_type, timer)
+            except BaseException:
+                ticket.release()
+                raise
 
-            esi_level = self.parse_and_log_esi_level(full_response_text)
+            events: asyncio.Queue = asyncio.Queue()
+            # The producer releases the ticket and the session's turn lock once the reply is complete.
+            producer = asyncio.create_task(self._produce_stream(user_turn, events, timer, ticket))
+            handed_off = True
+            _stream_tasks.add(producer)
+            producer.add_done_callback(_stream_tasks.discard)
+        finally:
+            if not handed_off:
+                self._turn_lock.release()
 
-            db.log_message(self.session_id, 'bot', full_response_text)
+        while True:
+            event = await events.get()
+            yield event
+            if event["type"] != "token":
+                return
 
-            if esi_level is not None:
-                return {
-                    "response_text": full_response_text,
-                    "is_complete": True,
-                    "esi_level": esi_level
-                }
-            else:
-                return {
-                    "response_text": full_response_text,
-                    "is_complete": False,
-                    "esi_level": None
-                }
+    async def _produce_stream(self, user_turn: tuple, events: asyncio.Queue, timer: StageTimer, ticket):
+        detector = EsiTagDetector()
+        chunks = []
+        try:
+            llm_started = time.perf_counter()
+            response, stream = await _open_stream(self._start_chat, _turn_content(user_turn))
+            async for chunk in stream:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks without text parts (e.g. the final finish-reason chunk) carry nothing to forward.
+                    continue
+                if text:
+                    if not chunks:
+                        timer.stages["first_token"] = (time.perf_counter() - llm_started) * 1000
+                    chunks.append(text)
+                    detector.feed(text)
+                    events.put_nowait({"type": "token", "text": text})
+
+            timer.stages["llm"] = (time.perf_counter() - llm_started) * 1000
+            metrics.observe_stage("gemini_call", timer.stages["llm"] / 1000)
+            metrics.record_usage(response, "triage")
+            self._account("triage", response, timer.stages["llm"] / 1000)
+            full_response_text = "".join(chunks)
+            timer.prompt_tokens = _prompt_tokens(response)
+            self.history += [user_turn, (MODEL_ROLE, full_response_text, None)]
+            self._schedule_context_fold()
+            result = self._finish_turn(full_response_text, detector.finish())
+            # Saved before `done`, so the client's next turn finds this one on any worker.
+            await self.persist()
+            timer.finish()
+            turn_stats.observe(timer)
+            events.put_nowait({"type": "done", **result, "timings_ms": timer.as_dict(), "prompt_tokens": timer.prompt_tokens})
 
         except Exception as e:
-            print(f"ERROR: Could not get response from Gemini API: {e}")
-            return {"response_text": "Sorry, I encountered an error. Please try again.", "is_complete": True, "esi_level": None}
+            log.error("Could not stream response from Gemini API", extra={"session_id": self.session_id, "error": str(e)})
+            events.put_nowait({"type": "error", "response_text": ERROR_REPLY, "is_complete": True, "esi_level": None})
+        finally:
+            ticket.release()
+            self._turn_lock.release()
 
+    def record_esi_level(self, esi_level: int):
+        """Queues saving the ESI level and generating the summary and title."""
+        log.info("ESI level detected", extra={"session_id": self.session_id, "esi_level": esi_level})
+        metrics.ESI_LEVELS.labels(str(esi_level)).inc()
+        self.esi_level = esi_level
+        _publish(self.session_id, {"type": "esi", "esi_level": esi_level})
 
-    def parse_and_log_esi_level(self, text: str) -> int | None:
-        """Uses a robust regex to find the ESI level tag. If found, it triggers summary generation."""
-        match = re.search(r"^Final ESI Level:\s*(\d+)", text, re.IGNORECASE | re.MULTILINE)
-        
-        if match:
-            esi_level = int(match.group(1))
-            print(f"ESI Level {esi_level} detected. Logging to DB.")
-            db.update_session_esi_level(self.session_id, esi_level)
-            
-            self.generate_and_save_summary()
-            self.generate_and_save_title()
-            return esi_level
-        return None
+        # None of this is needed for the reply itself, so don't make the patient wait for it.
+        background_jobs.enqueue(f"esi:{self.session_id}", self._save_esi_level)
+        background_jobs.enqueue(
+            f"summary:{self.session_id}",
+            self.generate_and_save_summary_and_title,
+            on_give_up=self.save_summary_fallback,
+        )
+
+    async def _save_esi_level(self):
+        """
+        Saves the session's current ESI level, or clears its triage if it was reopened,
+        and moves it in the analytics. There is one job per session, which reads the
+        level when it runs, so a level that changes while a save is queued or running
+        is saved after it instead of racing it. Raises on failure so the job queue retries.
+        """
+        esi_level, previous_level = self.esi_level, self._saved_esi_level
+        if esi_level == previous_level:
+            return
+        if esi_level is None:
+            saved = await db.reopen_session_triage_async(self.session_id)
+        else:
+            saved = await db.update_session_esi_level_async(self.session_id, esi_level)
+        if not saved:
+            raise RuntimeError("Could not save the ESI level")
+        self._saved_esi_level = esi_level
+        if esi_level is None:
+            triage_analytics.withdraw_triage(self.created_at, previous_level)
+        else:
+            triage_analytics.record_triage(self.created_at, esi_level, previous_level, timed=self._triage_timed)
+            self._triage_timed = True
+
+    def _account(self, task: str, response, seconds: float):
+        """Counts a Gemini call in this session's usage and queues saving the usage."""
+        if self.usage.record(task, response, seconds):
+            log.info("Session reached its token budget; tightening its context window", extra={
+                "session_id": self.session_id, "total_tokens": self.usage.total_tokens,
+                "token_budget": config.SESSION_TOKEN_BUDGET,
+            })
+        if self.session_id:
+            background_jobs.enqueue(f"usage:{self.session_id}", self._save_usage)
+
+    async def _save_usage(self):
+        """Saves the usage totals; raises on failure so the job queue retries the save."""
+        if not await db.update_session_usage_async(self.session_id, self.usage.to_dict()):
+            raise RuntimeError("Could not save session usage")
+
+    def _fold_point(self) -> int:
+        """Where to fold the history: in the configured context window, or the tight one once over the token budget."""
+        if self.usage.over_budget:
+            return fold_point(self.history, config.CONTEXT_BUDGET_RECENT_TURNS, config.CONTEXT_BUDGET_MAX_CHARS)
+        return fold_point(self.history)
+
+    def _schedule_context_fold(self):
+        """Queues folding the oldest turns into the rolling summary once the history is over budget."""
+        if self._fold_point():
+            background_jobs.enqueue(f"context:{self.session_id}", self.fold_context)
+
+    async def fold_context(self):
+        """
+        Folds the turns that no longer fit the context window into `context_summary`
+        with one Gemini call, drops them from the history and saves the summary.
+        Raises on Gemini errors so the job queue can retry.
+
+        Turns only ever get appended while this runs, and the job key allows one fold
+        per session at a time, so the folded entries are still the history's prefix.
+        """
+        point = self._fold_point()
+        if not point:
+            return
+
+        folded = self.history[:point]
+        prompt = CONTEXT_SUMMARY_PROMPT.format(
+            summary=self.context_summary or "(none yet)", history=format_transcript(folded)
+        )
+        async with admission.slot(self.user_id, BACKGROUND):
+            response = await _generate(get_model(model_for("context")), prompt, "context", self._account)
+
+        if self.history[:point] != folded:
+            # Another worker's state was merged in meanwhile; fold again from that.
+            raise VersionConflict(self.session_id)
+
+        self.context_summary = response.text.strip()
+        del self.history[:point]
+        self._saved_len = max(0, self._saved_len - point)
+        # Image-only turns have no stored text and are skipped on restore, so don't count them.
+        self.summarized_turns += sum(1 for _, text, _ in folded if text)
+        if not await self.persist():
+            # The fold was lost to a newer state from another worker (or not saved); the job retries.
+            raise VersionConflict(self.session_id)
+        log.info("Folded history into the context summary", extra={"session_id": self.session_id, "entries": point})
+        await db.update_session_context_async(self.session_id, self.context_summary, self.summarized_turns)
+
+    def to_state(self) -> dict:
+        """This session as a JSON-serializable dict, for the session store."""
+        return {
+            "user_id": self.user_id,
+            "session_id": self.session_id,
+            "history": [[role, text, _encode_image(image)] for role, text, image in self.history],
+            "context_summary": self.context_summary,
+            "summarized_turns": self.summarized_turns,
+            "esi_level": self.esi_level,
+            "created_at": self.created_at,
+            "triage_timed": self._triage_timed,
+            "usage": self.usage.tasks,
+        }
+
+    def _apply_state(self, state: dict):
+        self.history = [(role, text, _decode_image(image)) for role, text, image in state["history"]]
+        self.context_summary = state["context_summary"]
+        self.summarized_turns = state["summarized_turns"]
+        self.esi_level = state["esi_level"]
+        self.created_at = state.get("created_at")
+        self._triage_timed = self._triage_timed or state.get("triage_timed", self.esi_level is not None)
+        self.usage.rebase(state.get("usage"))
+        self._saved_len = len(self.history)
+
+    @classmethod
+    def from_state(cls, version: int, state: dict):
+        """Rebuilds a session from its stored state. Unlike a database restore, no query is needed."""
+        instance = cls(state["user_id"], state["session_id"])
+        instance._apply_state(state)
+        instance._saved_esi_level = instance.esi_level
+        instance.version = version
+        instance._schedule_context_fold()
+        return instance
+
+    async def persist(self) -> bool:
+        """
+        Saves this session's state to the session store. If another worker saved a newer
+        version first, that state is taken and this object's unsaved turns are appended to
+        it before saving again. Returns True if the state was saved as it was.
+
+        Store errors are logged, not raised: the turn has already been answered and every
+        message still reaches the database, which the next restore can fall back on.
+
+        With a store that isn't shared (memory://), this object in the session cache is
+        the only copy, so nothing is serialized and there is never anything to merge.
+        """
+        if not self.session_id:
+            return True
+        if not session_store.shared:
+            self._saved_len = len(self.history)
+            self.usage.mark_saved(len(self.usage.unsaved))
+            return True
+        async with self._persist_lock:
+            merged = False
+            try:
+                for _ in range(config.SESSION_STORE_MAX_CONFLICT_RETRIES):
+                    try:
+                        saved_calls = len(self.usage.unsaved)
+                        self.version = await session_store.save(self.session_id, self.to_state(), self.version)
+                        self._saved_len = len(self.history)
+                        self.usage.mark_saved(saved_calls)
+                        return not merged
+                    except VersionConflict:
+                        merged = True
+                        self._rebase(await session_store.load(self.session_id))
+                log.warning("Gave up saving session state after repeated conflicts", extra={"session_id": self.session_id})
+            except Exception as e:
+                log.error("Could not save session state", extra={"session_id": self.session_id, "error": str(e)})
+            return False
+
+    def _rebase(self, stored: tuple[int, dict] | None):
+        """Takes the stored state as the base and re-applies this object's unsaved turns and usage on top."""
+        if stored is None:
+            # The stored copy expired or was removed; this object's state becomes the stored one again.
+            self.version = 0
+            return
+        unsaved = self.history[self._saved_len:]
+        esi_level = self.esi_level
+        self.version, state = stored
+        self._apply_state(state)
+        self.history += unsaved
+        if esi_level is not None:
+            self.esi_level = esi_level
+        log.info("Merged a newer stored session state", extra={
+            "session_id": self.session_id, "version": self.version, "unsaved_entries": len(unsaved),
+        })
+
+    def approximate_size(self) -> int:
+        """Rough memory footprint of this session in bytes: its history text and images plus fixed overhead."""
+        size = SESSION_BASE_BYTES + len(self.context_summary or "")
+        for _, text, image in self.history:
+            size += len(text) + (len(image['data']) if image else 0)
+        return size
+
+    def _history_as_text(self, limit: int | None = None) -> str:
+        transcript = format_transcript(self.history[:limit])
+        if self.context_summary:
+            return f"Summary of the earlier conversation: {self.context_summary}\n{transcript}"
+        return transcript
 
-    def generate_and_save_summary(self):
-        """Generates the final summary for the entire conversation and updates the database."""
+    @metrics.timed("summary_generation")
+    async def generate_and_save_summary_and_title(self):
+        """
+        Generates the clinical summary and the sidebar title with a single structured
+        Gemini call and saves both. Raises on Gemini errors so the job queue can retry.
+        """
         if not self.session_id:
-            print("Cannot summarize, session not found.")
+            log.warning("Cannot summarize, session not found.")
             return
 
-        print(f"Summarizing full conversation for session {self.session_id}...")
-        
-        history_text = ""
-        for message in self.chat.history:
-            content = message.parts[0].text if message.parts else ""
-            role = "Patient" if message.role == "user" else "Nurse"
-            history_text += f"{role}: {content}\n"
+        log.info("Summarizing full conversation", extra={"session_id": self.session_id})
+
+        summary_model = get_model(model_for("summary"))
+        prompt = SUMMARY_AND_TITLE_PROMPT.format(history=self._history_as_text())
+        async with admission.slot(self.user_id, BACKGROUND):
+            response = await _generate(
+                summary_model, prompt, "summary", self._account,
+                generation_config={"response_mime_type": "application/json"},
+            )
 
         try:
-            summary_model = genai.GenerativeModel("gemini-2.5-flash")
-            prompt = SUMMARY_PROMPT.format(history=history_text)
-            summary_response = summary_model.generate_content(prompt)
-            summary_text = summary_response.text
-        except Exception as e:
-            print(f"Error generating summary from Gemini: {e}")
-            summary_text = "Could not automatically generate summary due to a connection error."
+            result = json.loads(response.text)
+            summary_text = str(result["summary"]).strip()
+            title = str(result.get("title", "")).strip().replace('"', '')
+        except (ValueError, KeyError, TypeError):
+            # The model ignored the JSON format; the raw text is still a usable summary.
+            summary_text, title = response.text.strip(), ""
 
-        db.update_session_summary(self.session_id, summary_text)
-        print("Session summary saved to database.")
+        if self.esi_level is None:
+            # The triage was reopened while this summary was being written.
+            return
+        if not await db.update_session_summary_async(self.session_id, summary_text):
+            if self.esi_level is None:
+                # Reopened while saving; the update found the level already cleared.
+                return
+            # Not saved, or the ESI level isn't in the database yet: try again.
+            raise RuntimeError("Could not save the session summary")
+        if title:
+            await db.update_session_title_async(self.session_id, title)
+        log.info("Session summary and title saved to database", extra={"session_id": self.session_id})
+        _publish(self.session_id, {"type": "summary_ready", "title": title or None})
+
+        # Render the PDF now so the patient's first download is served from the cache.
+        session_id, user_id = self.session_id, self.user_id
+        background_jobs.enqueue(
+            f"pdf:{session_id}",
+            lambda: pdf_cache.prerender(session_id, user_id, summary_text),
+        )
+
+    async def save_summary_fallback(self):
+        """Marks the summary as unavailable once every retry has failed."""
+        await db.update_session_summary_async(
+            self.session_id, "Could not automatically generate summary due to a connection error."
+        )
 
-    def generate_and_save_title(self):
+    @metrics.timed("title_generation")
+    async def generate_and_save_title(self):
         """Generates a concise title for the conversation and saves it."""
-        if not self.session_id or len(self.chat.history) < 2:
+        if not self.session_id or len(self.history) < 2:
             return
 
-        print(f"Generating title for session {self.session_id}...")
+        log.info("Generating title", extra={"session_id": self.session_id})
+
+        title_model = get_model(model_for("title"))
+        prompt = TITLE_GENERATION_PROMPT.format(history=self._history_as_text(limit=4))
+        async with admission.slot(self.user_id, BACKGROUND):
+            title_response = await _generate(title_model, prompt, "title", self._account)
+        clean_title = title_response.text.strip().replace('"', '')
+        await db.update_session_title_async(self.session_id, clean_title)
+
+    @classmethod
+    def from_existing_session(cls, user_id: str, session_id: str, history: list[dict],
+                              context_summary: str | None = None, summarized_turns: int = 0,
+                              esi_level: int | None = None, created_at: str | None = None,
+                              llm_usage: dict | None = None):
+        """
+        Creates an AIService instance by loading existing chat history. Messages already
+        covered by the saved context summary are left out, so a restored chat gets the
+        same compact context it had before it was evicted.
+        """
+        entries = [
+            (USER_ROLE if message.get('type') == 'user' else MODEL_ROLE, message['text'], None)
+            for message in history if message.get('text')
+        ]
+        instance = cls(user_id, session_id, entries[summarized_turns:], context_summary, summarized_turns, esi_level,
+                       created_at, SessionUsage.from_dict(llm_usage))
+        # A reopened triage was timed when it was first given, as the analytics rebuild sees it.
+        instance._triage_timed = esi_level is not None or any(
+            message.get('type') != 'user' and _gives_triage(message.get('text') or '') for message in history
+        )
+        # Chats from before the context window, or with a summary that fell behind, catch up in the background.
+        instance._schedule_context_fold()
+
+        log.info("Restored AI Service", extra={"user_id": instance.user_id, "session_id": instance.session_id})
+        return instance
+
+async def _send(new_chat, content: list, purpose: str, account, hedge: bool = False):
+    """
+    One non-streamed chat turn, timed and with its token usage counted, also by
+    `account(purpose, response, seconds)`. `new_chat()` is called for every attempt,
+    since a retry or hedge must not share a ChatSession.
+    """
+    started = time.perf_counter()
+    with metrics.stage("gemini_call"):
+        response = await resilience.gemini.call(lambda: new_chat().send_message_async(content), hedge=hedge)
+    metrics.record_usage(response, purpose)
+    account(purpose, response, time.perf_counter() - started)
+    return response
 
-        history_text = "\n".join([f"{'Patient' if m.role == 'user' else 'Nurse'}: {m.parts[0].text}" for m in self.chat.history[:4]])
+async def _generate(model, prompt: str, purpose: str, account, **kwargs):
+    """One single-shot Gemini call, timed and with its token usage counted, also by `account` as in `_send`."""
+    started = time.perf_counter()
+    with metrics.stage("gemini_call"):
+        response = await resilience.gemini.call(lambda: model.generate_content_async(prompt, **kwargs))
+    metrics.record_usage(response, purpose)
+    account(purpose, response, time.perf_counter() - started)
+    return response
 
+async def _open_stream(new_chat, content: list):
+    """
+    Starts a streamed chat turn. An attempt lasts until the first chunk arrives, so one
+    that fails or stalls before the patient has seen any text is retried; after that,
+    each chunk must arrive within the Gemini timeout. Returns the response and an async
+    iterator over its chunks.
+    """
+    async def attempt():
+        response = await new_chat().send_message_async(content, stream=True)
+        chunks = aiter(response)
+        return response, chunks, await anext(chunks, None)
+
+    response, chunks, first = await resilience.gemini.call(attempt)
+
+    async def stream():
+        if first is None:
+            return
+        yield first
         try:
-            title_model = genai.GenerativeModel("gemini-2.5-flash")
-            prompt = TITLE_GENERATION_PROMPT.format(history=history_text)
-            title_response = title_model.generate_content(prompt)
-            clean_title = title_response.text.strip().replace('"', '')
-            db.update_session_title(self.session_id, clean_title)
+            async for chunk in resilience.with_idle_timeout(chunks, resilience.gemini.timeout):
+                yield chunk
         except Exception as e:
-            print(f"Error generating title: {e}")
+            resilience.gemini.note_failure(e)
+            raise
 
-    @classmethod
-    def from_existing_session(cls, user_id: str, session_id: str, history: list[dict]):
-        """Creates an AIService instance by loading existing chat history."""
-        instance = cls.__new__(cls)
-        instance.user_id = user_id
-        instance.session_id = session_id
-        
-        gemini_history = []
-        for message in history:
-            role = "user" if message.get('type') == 'user' else "model"
-            if message.get('text'):
-                gemini_history.append({'role': role, 'parts': [{'text': message['text']}]})
-        
-        instance.model = genai.GenerativeModel(
-            "gemini-2.5-flash",
-            system_instruction=TRIAGE_SYSTEM_PROMPT
-        )
-        instance.chat = instance.model.start_chat(history=gemini_history)
-        
-        print(f"Restored AI Service for user {instance.user_id} from session {instance.session_id}")
-        return instance
\ No newline at end of file
+    return response, stream()
+
+def _gives_triage(text: str) -> bool:
+    """Whether a bot message triaged the session: an ESI tag or the emergency handover."""
+    return text in (EMERGENCY_HANDOVER_MESSAGE, CRISIS_SUPPORT_MESSAGE) or parse_esi_level(text) is not None
+
+def _prompt_tokens(response) -> int | None:
+    """Prompt tokens Gemini billed for a reply, if it reported usage."""
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "prompt_token_count", None) if usage else None
+
+def _encode_image(image: dict | None) -> dict | None:
+    if image is None:
+        return None
+    return {'mime_type': image['mime_type'], 'data': base64.b64encode(image['data']).decode('ascii')}
+
+def _decode_image(image: dict | None) -> dict | None:
+    if image is None:
+        return None
+    return {'mime_type': image['mime_type'], 'data': base64.b64decode(image['data'])}
+
+def _turn_content(turn: tuple) -> list:
+    """The Gemini message parts for one history entry."""
+    _, text, image = turn
+    return [text, image] if image else [text]
@@ -0,0 +1,339 @@
+# ai_assistant/analytics.py
+
+import asyncio
+from datetime import date, datetime, timezone
+from typing import Iterable
+
+import database_service as db
+from config import ANALYTICS_FLUSH_SECONDS
+from prompts import EMERGENCY_HANDOVER_MESSAGE, CRISIS_SUPPORT_MESSAGE
+from structured_log import get_logger
+
+log = get_logger(__name__)
+
+ESI_LEVELS = 5
+# Upper bounds of the time-to-triage histogram buckets, in seconds; one more bucket holds the rest.
+TRIAGE_BUCKETS = (60, 120, 300, 600, 900, 1800, 3600)
+# Tries per flush at writing a day's row when other workers keep changing it.
+MAX_SAVE_ATTEMPTS = 5
+# Rows per page when rebuilding, and sessions per bot-message query.
+REBUILD_PAGE_SIZE = 1000
+REBUILD_CHUNK_SIZE = 100
+
+def empty_counters() -> dict:
+    return {
+        "sessions": 0,
+        "messages": 0,
+        "esi": [0] * ESI_LEVELS,
+        "triage_seconds": 0.0,
+        "triage_histogram": [0] * (len(TRIAGE_BUCKETS) + 1),
+    }
+
+def add_counters(total: dict, delta: dict) -> dict:
+    """Adds `delta` into `total` in place and returns it."""
+    for key, value in delta.items():
+        if isinstance(value, list):
+            current = total.setdefault(key, [0] * len(value))
+            for i, n in enumerate(value):
+                current[i] += n
+        else:
+            total[key] = total.get(key, 0) + value
+    return total
+
+def _as_datetime(value: str | datetime | None) -> datetime:
+    if value is None:
+        return datetime.now(timezone.utc)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def day_of(value: str | datetime | None) -> str:
+    """The UTC day of a timestamp (now if None), as YYYY-MM-DD."""
+    return _as_datetime(value).astimezone(timezone.utc).date().isoformat()
+
+def _triage_bucket(seconds: float) -> int:
+    for i, bound in enumerate(TRIAGE_BUCKETS):
+        if seconds <= bound:
+            return i
+    return len(TRIAGE_BUCKETS)
+
+class TriageAnalytics:
+    """
+    Pre-aggregated triage numbers for the operations dashboards, kept per UTC day:
+    sessions started, messages stored, the ESI level of each triaged session, and the
+    time from a session's start to its triage (sum and histogram). Sessions, ESI
+    levels and triage times count on the day the session started; messages on the
+    day they were sent.
+
+    Events are added to in-memory deltas as they happen, which costs a few dict
+    updates, and every `flush_interval` seconds each touched day's deltas are merged
+    into its ai_analytics_daily row with a compare-and-set, so every worker's counts
+    add up. A date-range query reads one row per day in the range, however many
+    sessions there are. `rebuild` recomputes past days from the sessions and messages
+    tables, for backfill or after a bug.
+    """
+
+    def __init__(self, flush_interval: float = ANALYTICS_FLUSH_SECONDS):
+        self.flush_interval = flush_interval
+        self._pending: dict[str, dict] = {}
+        self._flusher: asyncio.Task | None = None
+        self._rebuild: asyncio.Task | None = None
+        self.flushes = 0
+        self.flush_failures = 0
+        self.last_rebuild: dict | None = None
+
+    # Recording
+
+    def _day(self, day: str) -> dict:
+        counters = self._pending.get(day)
+        if counters is None:
+            counters = self._pending[day] = empty_counters()
+        return counters
+
+    def record_session(self, created_at: str | datetime | None = None):
+        self._day(day_of(created_at))["sessions"] += 1
+
+    def record_messages(self, timestamps: Iterable[str | None]):
+        for timestamp in timestamps:
+            self._day(day_of(timestamp))["messages"] += 1
+
+    def record_triage(self, created_at: str | datetime | None, esi_level: int, previous_level: int | None = None,
+                      timed: bool = False):
+        """
+        Counts a session's ESI level. A session whose level changes moves from the old
+        level to the new one. Its time to triage is counted the first time only: not
+        when it had a level, nor when `timed` says an earlier, withdrawn triage was
+        already timed, the way `rebuild` times the first triage too.
+        """
+        if esi_level == previous_level or not 1 <= esi_level <= ESI_LEVELS:
+            return
+        counters = self._day(day_of(created_at))
+        counters["esi"][esi_level - 1] += 1
+        if previous_level is not None:
+            if 1 <= previous_level <= ESI_LEVELS:
+                counters["esi"][previous_level - 1] -= 1
+            return
+        if created_at is not None and not timed:
+            seconds = max(0.0, (datetime.now(timezone.utc) - _as_datetime(created_at)).total_seconds())
+            counters["triage_seconds"] += seconds
+            counters["triage_histogram"][_triage_bucket(seconds)] += 1
+
+    def withdraw_triage(self, created_at: str | datetime | None, previous_level: int):
+        """Uncounts the ESI level of a session whose triage was reopened. Its time to triage stays counted."""
+        if 1 <= previous_level <= ESI_LEVELS:
+            self._day(day_of(created_at))["esi"][previous_level - 1] -= 1
+
+    # Persistence
+
+    def start(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        """Stops flushing and rebuilding, after one last flush."""
+        for task in (self._flusher, self._rebuild):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        await self.flush()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._rebuild is None or self._rebuild.done():
+                await self.flush()
+
+    async def flush(self):
+        """Merges the deltas into the stored rows. A day that can't be written is kept for the next flush."""
+        pending, self._pending = self._pending, {}
+        if pending:
+            self.flushes += 1
+        try:
+            while pending:
+                day = next(iter(pending))
+                if not await self._write_day(day, pending[day]):
+                    add_counters(self._day(day), pending[day])
+                    self.flush_failures += 1
+                del pending[day]
+        finally:
+            # Cancelled part-way (shutdown): keep what wasn't written for the final flush.
+            for day, delta in pending.items():
+                add_counters(self._day(day), delta)
+
+    async def _write_day(self, day: str, counters: dict, replace: bool = False) -> bool:
+        for _ in range(MAX_SAVE_ATTEMPTS):
+            rows = await db.get_analytics_days_async(day, day)
+            if rows is None:
+                return False
+            version = rows[0]["version"] if rows else 0
+            merged = counters if replace or not rows else add_counters(
+                add_counters(empty_counters(), rows[0]["counters"]), counters)
+            if await db.save_analytics_day_async(day, merged, version):
+                return True
+        log.warning("Gave up saving analytics after repeated conflicts", extra={"day": day})
+        return False
+
+    # Queries
+
+    async def query(self, first_day: date, last_day: date) -> dict | None:
+        """Totals and per-day numbers for the days from `first_day` to `last_day`, inclusive. None if the database is unavailable."""
+        rows = await db.get_analytics_days_async(first_day.isoformat(), last_day.isoformat())
+        if rows is None:
+            return None
+        by_day = {str(row["day"]): add_counters(empty_counters(), row["counters"]) for row in rows}
+        # This worker's counts that are not saved yet.
+        for day, delta in self._pending.items():
+            if first_day.isoformat() <= day <= last_day.isoformat():
+                add_counters(by_day.setdefault(day, empty_counters()), delta)
+
+        totals = empty_counters()
+        days = []
+        for day in sorted(by_day):
+            add_counters(totals, by_day[day])
+            days.append({"day": day, **summarize(by_day[day])})
+        return {"from": first_day.isoformat(), "to": last_day.isoformat(), "totals": summarize(totals), "days": days}
+
+    # Rebuilding
+
+    def start_rebuild(self) -> bool:
+        """Starts a rebuild in the background. Returns False if one is already running."""
+        if self._rebuild is not None and not self._rebuild.done():
+            return False
+        self._rebuild = asyncio.create_task(self.rebuild())
+        self._rebuild.add_done_callback(_log_rebuild_failure)
+        return True
+
+    async def rebuild(self) -> dict:
+        """
+        Recomputes every day before today from the database and overwrites those rows;
+        today keeps its live counts. Days with no sessions or messages left, e.g. after
+        the retention job, keep what they had. Events for past days that arrive while a
+        rebuild runs can be counted twice, so run it when traffic is low. This worker's
+        unsaved counts for past days are dropped, since the rebuild recounts them; if it
+        fails, those for the days it didn't rewrite are put back.
+        """
+        started = datetime.now(timezone.utc)
+        today = started.date().isoformat()
+        trimmed = {day: delta for day, delta in self._pending.items() if day < today}
+        self._pending = {day: delta for day, delta in self._pending.items() if day >= today}
+        rewritten = set()
+        try:
+            by_day: dict[str, dict] = {}
+            sessions = await self._rebuild_sessions(today, by_day)
+            messages = await self._rebuild_messages(today, by_day)
+            for day, counters in sorted(by_day.items()):
+                if not await self._write_day(day, counters, replace=True):
+                    raise RuntimeError(f"Could not save the analytics for {day}")
+                rewritten.add(day)
+        except BaseException:
+            for day, delta in trimmed.items():
+                if day not in rewritten:
+                    add_counters(self._day(day), delta)
+            raise
+        self.last_rebuild = {
+            "finished_at": datetime.now(timezone.utc).isoformat(), "days": len(by_day),
+            "sessions": sessions, "messages": messages,
+            "seconds": round((datetime.now(timezone.utc) - started).total_seconds(), 1),
+        }
+        log.info("Rebuilt the triage analytics", extra=self.last_rebuild)
+        return self.last_rebuild
+
+    async def _rebuild_sessions(self, before: str, by_day: dict) -> int:
+        scanned, after = 0, None
+        while True:
+            rows = await db.scan_sessions_async(before, REBUILD_PAGE_SIZE, after)
+            if rows is None:
+                raise RuntimeError("Could not scan the sessions")
+            if not rows:
+                return scanned
+            triaged = {row["id"]: row for row in rows if row["final_esi_level"] is not None}
+            triage_times = await self._triage_times(list(triaged))
+            for row in rows:
+                counters = by_day.setdefault(day_of(row["created_at"]), empty_counters())
+                counters["sessions"] += 1
+                level = row["final_esi_level"]
+                if level is None or not 1 <= level <= ESI_LEVELS:
+                    continue
+                counters["esi"][level - 1] += 1
+                if row["id"] in triage_times:
+                    seconds = max(0.0, (_as_datetime(triage_times[row["id"]]) - _as_datetime(row["created_at"])).total_seconds())
+                    counters["triage_seconds"] += seconds
+                    counters["triage_histogram"][_triage_bucket(seconds)] += 1
+            scanned += len(rows)
+            after = (rows[-1]["created_at"], rows[-1]["id"])
+
+    async def _triage_times(self, session_ids: list[str]) -> dict[str, str]:
+        """When each session was triaged: the first bot message that gave an ESI level or the emergency handover."""
+        from ai_service import parse_esi_level
+
+        triaged_at = {}
+        for i in range(0, len(session_ids), REBUILD_CHUNK_SIZE):
+            rows = await db.get_bot_messages_async(session_ids[i:i + REBUILD_CHUNK_SIZE])
+            if rows is None:
+                raise RuntimeError("Could not read the bot messages")
+            for row in rows:
+                text = row["message_content"] or ""
+                if row["session_id"] not in triaged_at and (
+                        text in (EMERGENCY_HANDOVER_MESSAGE, CRISIS_SUPPORT_MESSAGE) or parse_esi_level(text) is not None):
+                    triaged_at[row["session_id"]] = row["timestamp"]
+        return triaged_at
+
+    async def _rebuild_messages(self, before: str, by_day: dict) -> int:
+        scanned, after_id = 0, None
+        while True:
+            rows = await db.scan_message_times_async(before, REBUILD_PAGE_SIZE, after_id)
+            if rows is None:
+                raise RuntimeError("Could not scan the messages")
+            if not rows:
+                return scanned
+            for row in rows:
+                by_day.setdefault(day_of(row["timestamp"]), empty_counters())["messages"] += 1
+            scanned += len(rows)
+            after_id = rows[-1]["id"]
+
+    def stats(self) -> dict:
+        return {
+            "pending_days": len(self._pending),
+            "flushes": self.flushes,
+            "flush_failures": self.flush_failures,
+            "rebuilding": int(self._rebuild is not None and not self._rebuild.done()),
+            "last_rebuild": self.last_rebuild,
+        }
+
+def _log_rebuild_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        log.error("Analytics rebuild failed", extra={"error": str(task.exception())})
+
+def summarize(counters: dict) -> dict:
+    """A day's (or a range's) counters in the shape the API returns."""
+    histogram = counters["triage_histogram"]
+    timed = sum(histogram)
+
+    def percentile(q: float):
+        # The upper bound of the bucket the percentile falls in; None past the last bound.
+        seen = 0
+        for i, n in enumerate(histogram):
+            seen += n
+            if seen >= q * timed:
+                return TRIAGE_BUCKETS[i] if i < len(TRIAGE_BUCKETS) else None
+        return None
+
+    labels = [f"<={bound}s" for bound in TRIAGE_BUCKETS] + [f">{TRIAGE_BUCKETS[-1]}s"]
+    return {
+        "sessions": counters["sessions"],
+        "messages": counters["messages"],
+        "triaged": sum(counters["esi"]),
+        "esi_distribution": {str(level + 1): n for level, n in enumerate(counters["esi"])},
+        "time_to_triage": {
+            "count": timed,
+            "avg_seconds": round(counters["triage_seconds"] / timed, 1) if timed else None,
+            "p50_seconds_at_most": percentile(0.5) if timed else None,
+            "p90_seconds_at_most": percentile(0.9) if timed else None,
+            "histogram": dict(zip(labels, histogram)),
+        },
+    }
+
+triage_analytics = TriageAnalytics()
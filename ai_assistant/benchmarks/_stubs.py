@@ -0,0 +1,190 @@
+# ai_assistant/benchmarks/_stubs.py
+#
+# Latency-simulating stand-ins for Supabase and Gemini so the benchmarks can run
+# without network access or real keys. They only implement the calls the service uses.
+
+import asyncio
+import itertools
+import os
+import sys
+import time
+import uuid
+
+# Dummy keys so config.py does not refuse to load.
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:54321")
+os.environ.setdefault("SUPABASE_KEY", "benchmark")
+# Keep the service's log lines out of the benchmark output.
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class _Response:
+    def __init__(self, data):
+        self.data = data
+
+
+class _Query:
+    """Chainable query that sleeps like a real network round-trip on execute()."""
+
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.op = "select"
+        self.payload = None
+
+    def insert(self, payload):
+        self.op, self.payload = "insert", payload
+        return self
+
+    def update(self, payload):
+        self.op, self.payload = "update", payload
+        return self
+
+    def delete(self):
+        self.op = "delete"
+        return self
+
+    def select(self, *args, **kwargs):
+        return self
+
+    def __getattr__(self, name):
+        # eq / order / limit / single / lt ... are all no-ops for the stub
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        time.sleep(self.client.latency)
+        self.client.calls += 1
+        if self.op == "insert":
+            rows = self.payload if isinstance(self.payload, list) else [self.payload]
+            return _Response([{"id": str(uuid.uuid4()), **row} for row in rows])
+        if self.op == "select" and self.table == "ai_sessions":
+            return _Response({"user_id": "bench-user", "session_summary": "Summary", "final_esi_level": None})
+        if self.op == "select":
+            return _Response([])
+        return _Response([{"id": "ok"}])
+
+
+class _Bucket:
+    def __init__(self, client):
+        self.client = client
+
+    def upload(self, file, path, file_options=None):
+        time.sleep(self.client.latency)
+        self.client.calls += 1
+
+    def get_public_url(self, path):
+        return f"https://storage.local/{path}"
+
+
+class _Storage:
+    def __init__(self, client):
+        self.client = client
+
+    def from_(self, bucket):
+        return _Bucket(self.client)
+
+
+class SlowSupabase:
+    """Stands in for `supabase.Client`; every execute() blocks for `latency` seconds."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self.storage = _Storage(self)
+
+    def table(self, name):
+        return _Query(self, name)
+
+
+class _Text:
+    def __init__(self, text):
+        self.text = text
+        self.parts = [self]
+
+
+class _Usage:
+    def __init__(self, prompt_token_count):
+        self.prompt_token_count = prompt_token_count
+
+
+class _ChatResponse:
+    def __init__(self, text, prompt_tokens=None):
+        self.text = text
+        self.usage_metadata = _Usage(prompt_tokens) if prompt_tokens is not None else None
+
+
+def _prompt_tokens(history, content):
+    """Roughly what Gemini would bill for the text of a chat's history plus the new message."""
+    parts = [part for entry in history for part in entry["parts"]] + list(content)
+    return sum(len(part) for part in parts if isinstance(part, str)) // 4
+
+
+class _StreamedResponse:
+    """Yields the reply word by word: the first after `latency`, then one every `token_delay`."""
+
+    def __init__(self, text, latency, token_delay, prompt_tokens=None):
+        self.words = text.split(" ")
+        self.latency = latency
+        self.token_delay = token_delay
+        self.usage_metadata = _Usage(prompt_tokens)
+
+    async def __aiter__(self):
+        await asyncio.sleep(self.latency)
+        for i, word in enumerate(self.words):
+            if i:
+                await asyncio.sleep(self.token_delay)
+            yield _ChatResponse(word if i == 0 else " " + word)
+
+
+REPLY = ("I'm sorry to hear you're not feeling well. Based on what you've described, "
+         "this does not appear to be an emergency, but you should see a doctor within the next day or two.\n"
+         "Final ESI Level: 4")
+
+
+class SlowChat:
+    def __init__(self, latency, history, token_delay=0.0):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.history = list(history or [])
+        self._turn = itertools.count(1)
+
+    async def send_message_async(self, content, stream=False, **kwargs):
+        prompt_tokens = _prompt_tokens(self.history, content)
+        if stream:
+            return _StreamedResponse(REPLY, self.latency, self.token_delay, prompt_tokens)
+        await asyncio.sleep(self.latency + self.token_delay * (len(REPLY.split(" ")) - 1))
+        return _ChatResponse(f"Could you tell me more about that? (turn {next(self._turn)})", prompt_tokens)
+
+
+def slow_model_factory(latency: float, token_delay: float = 0.0):
+    """
+    Returns a GenerativeModel replacement whose chats start answering after `latency`
+    seconds and then produce one word every `token_delay` seconds.
+    """
+
+    class SlowModel:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def start_chat(self, history=None):
+            return SlowChat(latency, history, token_delay)
+
+        def generate_content(self, prompt, **kwargs):
+            time.sleep(latency)
+            return _ChatResponse("Summary")
+
+        async def generate_content_async(self, prompt, **kwargs):
+            await asyncio.sleep(latency)
+            return _ChatResponse("Summary")
+
+    return SlowModel
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
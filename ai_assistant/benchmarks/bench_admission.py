@@ -0,0 +1,130 @@
+# ai_assistant/benchmarks/bench_admission.py
+#
+# A burst against a provider that rejects calls beyond its concurrency limit, as
+# Gemini does with 429 RESOURCE_EXHAUSTED. One noisy user fires a flood of
+# messages; shortly after, a set of ordinary users send one message each, and a
+# few patients send messages the emergency classifier flags (with the fast path
+# off, so they go to Gemini at emergency priority).
+#
+# Without admission control every message hits the provider at once and most
+# fail, whoever sent them. With it, calls are capped at the provider's limit,
+# emergencies go first, ordinary users are served round-robin ahead of the
+# noisy user's backlog, and what cannot be served within the deadline is turned
+# away with 429 + Retry-After instead of an error reply.
+#
+#   python benchmarks/bench_admission.py --noisy 150 --users 30 --provider-limit 20
+
+import argparse
+import asyncio
+import os
+import time
+
+# The run without admission control logs every failed call; keep the tables readable.
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+
+import _stubs
+
+import httpx
+
+import config
+import database_service as db
+import main
+import model_registry
+from admission import admission
+
+ERROR_REPLY = "Sorry, I encountered an error. Please try again."
+
+
+def _provider_limited_model(latency, limit):
+    """A stand-in Gemini that fails any call made while `limit` others are in flight."""
+    base = _stubs.slow_model_factory(latency)
+    in_flight = 0
+
+    class LimitedChat(_stubs.SlowChat):
+        async def send_message_async(self, content, stream=False, **kwargs):
+            nonlocal in_flight
+            if in_flight >= limit:
+                raise RuntimeError("429 Resource has been exhausted (e.g. check quota).")
+            in_flight += 1
+            try:
+                return await super().send_message_async(content, stream, **kwargs)
+            finally:
+                in_flight -= 1
+
+    class LimitedModel(base):
+        def start_chat(self, history=None):
+            return LimitedChat(latency, history)
+
+    return LimitedModel
+
+
+async def _burst(args):
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        groups = {"noisy": [], "ordinary": [], "emergency": []}
+        senders = [("noisy", "noisy-user", "I have a headache")] * args.noisy
+        senders += [("ordinary", f"user-{i}", "I have a headache") for i in range(args.users)]
+        senders += [("emergency", f"patient-{i}", "My father is not breathing") for i in range(args.emergencies)]
+        sessions = []
+        for group, user_id, message in senders:
+            response = await client.post("/chat/start", json={"user_id": user_id})
+            sessions.append((group, response.json()["session_id"], message))
+
+        async def send(group, session_id, message, delay):
+            await asyncio.sleep(delay)
+            started = time.perf_counter()
+            response = await client.post("/chat/message", data={"session_id": session_id, "user_message": message})
+            elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code == 429:
+                outcome = "429"
+            elif response.status_code == 200 and response.json()["response_text"] != ERROR_REPLY:
+                outcome = "ok"
+            else:
+                outcome = "error"
+            groups[group].append((outcome, elapsed))
+
+        # The noisy user's flood lands first; everyone else arrives just after it.
+        await asyncio.gather(*(
+            send(group, session_id, message, 0 if group == "noisy" else 0.05)
+            for group, session_id, message in sessions
+        ))
+        return groups
+
+
+def _report(mode, groups):
+    print(f"\n{mode}:")
+    print(f"{'group':>10} {'sent':>6} {'ok':>6} {'429':>6} {'error':>6} {'p50 ms':>9} {'p95 ms':>9}")
+    for group, results in groups.items():
+        ok = [elapsed for outcome, elapsed in results if outcome == "ok"]
+        count = lambda name: sum(1 for outcome, _ in results if outcome == name)
+        print(f"{group:>10} {len(results):>6} {count('ok'):>6} {count('429'):>6} {count('error'):>6} "
+              f"{_stubs.percentile(ok, 50):>9.0f} {_stubs.percentile(ok, 95):>9.0f}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Gemini admission control under a burst")
+    parser.add_argument("--noisy", type=int, default=150, help="messages from the one noisy user")
+    parser.add_argument("--users", type=int, default=30, help="ordinary users, one message each")
+    parser.add_argument("--emergencies", type=int, default=5, help="flagged emergency messages")
+    parser.add_argument("--provider-limit", type=int, default=20, help="concurrent calls the provider accepts")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per Gemini reply")
+    parser.add_argument("--deadline", type=float, default=2.0, help="queue deadline in seconds")
+    parser.add_argument("--reserve", type=int, default=2, help="slots kept for emergencies")
+    args = parser.parse_args()
+
+    db.supabase_client = _stubs.SlowSupabase(0)
+    model_registry.model_class = _provider_limited_model(args.llm_latency, args.provider_limit)
+    config.EMERGENCY_FAST_PATH = False
+
+    for mode in ("no admission control", "admission control"):
+        if mode == "no admission control":
+            admission.max_concurrent, admission.rate, admission.deadline = 10 ** 9, 0, float("inf")
+        else:
+            admission.max_concurrent, admission.rate, admission.deadline = args.provider_limit, 0, args.deadline
+            admission.reserve = args.reserve
+        _report(mode, asyncio.run(_burst(args)))
+    print(f"\nAdmission stats: {admission.stats()}")
+
+
+if __name__ == "__main__":
+    main_cli()
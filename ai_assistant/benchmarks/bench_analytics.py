@@ -0,0 +1,105 @@
+# ai_assistant/benchmarks/bench_analytics.py
+#
+# What a 30-day triage dashboard costs as history grows, against the in-memory
+# fake Supabase client seeded with sessions spread over the last --days days.
+#
+# 1. Scan. Reading every session and message and aggregating them, which is what
+#    answering the dashboard took before: the same work as a rebuild of the
+#    analytics, so it is timed by running one.
+# 2. Query. GET /analytics/triage's work after the rebuild: one read of the
+#    pre-aggregated rows for the range, whatever the number of sessions.
+# 3. Recording. The cost added to create_session / the ESI update / message
+#    logging by counting each event in memory.
+#
+#   python benchmarks/bench_analytics.py --sessions 1000 5000 20000 --days 90
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+os.environ["USE_FAKE_BACKENDS"] = "true"
+os.environ["FAKE_DB_LATENCY_SECONDS"] = "0"
+
+import _stubs
+
+import database_service as db
+from analytics import TriageAnalytics
+from fake_backends import FakeSupabaseClient
+
+
+def _seed(client, sessions, days, messages_per_session, seed=7):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    for _ in range(sessions):
+        created = now - timedelta(days=rng.randint(1, days), seconds=rng.randint(0, 86399))
+        level = rng.choice([1, 2, 3, 3, 4, 4, 5, None])
+        session = client.insert_row("ai_sessions", {
+            "id": str(uuid.uuid4()), "user_id": "bench", "created_at": created.isoformat(), "final_esi_level": level,
+        })
+        sent = created
+        for turn in range(messages_per_session):
+            sent += timedelta(seconds=rng.randint(20, 400))
+            last = turn == messages_per_session - 1
+            content = f"Advice.\nFinal ESI Level: {level}" if last and level else "Tell me more about the pain."
+            client.insert_row("ai_messages", {
+                "session_id": session["id"], "sender": "bot" if turn % 2 else "user",
+                "message_content": content, "timestamp": sent.isoformat(),
+            })
+
+
+async def _measure(args, sessions):
+    db.supabase_client = FakeSupabaseClient()
+    _seed(db.supabase_client, sessions, args.days, args.messages)
+    analytics = TriageAnalytics()
+
+    started = time.perf_counter()
+    summary = await analytics.rebuild()
+    scan = time.perf_counter() - started
+
+    today = datetime.now(timezone.utc).date()
+    timings = []
+    for _ in range(args.queries):
+        started = time.perf_counter()
+        result = await analytics.query(today - timedelta(days=29), today)
+        timings.append(time.perf_counter() - started)
+    if result is None:
+        raise RuntimeError("The analytics query failed.")
+    return scan, statistics.median(timings), summary
+
+
+def _recording_overhead(events=100_000):
+    analytics = TriageAnalytics()
+    now = datetime.now(timezone.utc)
+    stamps = [now.isoformat()] * 4
+    started = time.perf_counter()
+    for _ in range(events):
+        analytics.record_session(now)
+        analytics.record_messages(stamps)
+        analytics.record_triage(now, 3)
+    return (time.perf_counter() - started) / events * 1e6
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Triage dashboard cost: full scan against pre-aggregated counters")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--messages", type=int, default=4, help="messages per session")
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"30-day dashboard, sessions spread over {args.days} days, {args.messages} messages each")
+    print(f"{'sessions':>9} {'messages':>9} {'scan ms':>10} {'query ms':>9}")
+    for sessions in args.sessions:
+        scan, query, summary = asyncio.run(_measure(args, sessions))
+        print(f"{summary['sessions']:>9} {summary['messages']:>9} {scan * 1000:>10.0f} {query * 1000:>9.2f}")
+    print(f"\nRecording one session, its triage and four messages: {_recording_overhead():.1f} us")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,87 @@
+# ai_assistant/benchmarks/bench_chat_concurrency.py
+#
+# Measures how many concurrent /chat/message requests one worker can serve when
+# every database round-trip is blocking (before) versus offloaded to the
+# database thread pool (after).
+#
+#   python benchmarks/bench_chat_concurrency.py --db-latency 0.05 --llm-latency 0.5
+
+import argparse
+import asyncio
+import time
+
+import _stubs
+
+import httpx
+
+import database_service as db
+import main
+import model_registry
+
+
+async def _inline(func, *args, **kwargs):
+    # What every handler did before: run the Supabase call on the event loop thread.
+    return func(*args, **kwargs)
+
+
+async def _run_level(client, session_ids, concurrency):
+    latencies = []
+
+    async def one(session_id):
+        started = time.perf_counter()
+        response = await client.post("/chat/message", data={"session_id": session_id, "user_message": "I have a headache"})
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(session_ids[i % len(session_ids)]) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return latencies, elapsed
+
+
+async def _run_mode(mode, args):
+    original = db._run_in_pool
+    if mode == "before":
+        db._run_in_pool = _inline
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            session_ids = []
+            for _ in range(args.sessions):
+                response = await client.post("/chat/start", json={"user_id": "bench-user"})
+                session_ids.append(response.json()["session_id"])
+
+            results = []
+            for concurrency in args.levels:
+                latencies, elapsed = await _run_level(client, session_ids, concurrency)
+                results.append((concurrency, _stubs.percentile(latencies, 95), concurrency / elapsed))
+            return results
+    finally:
+        db._run_in_pool = original
+        main.active_sessions.clear()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Concurrent /chat/message benchmark")
+    parser.add_argument("--db-latency", type=float, default=0.05, help="seconds per Supabase round-trip")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per Gemini reply")
+    parser.add_argument("--sessions", type=int, default=32)
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 4, 16, 64, 128])
+    parser.add_argument("--slo", type=float, default=2.0, help="p95 latency budget in seconds")
+    args = parser.parse_args()
+
+    db.supabase_client = _stubs.SlowSupabase(args.db_latency)
+    model_registry.model_class = _stubs.slow_model_factory(args.llm_latency)
+
+    for mode in ("before", "after"):
+        results = asyncio.run(_run_mode(mode, args))
+        print(f"\n[{mode}] db={args.db_latency * 1000:.0f}ms llm={args.llm_latency * 1000:.0f}ms")
+        print(f"{'concurrency':>12} {'p95 (s)':>10} {'req/s':>10}")
+        for concurrency, p95, throughput in results:
+            print(f"{concurrency:>12} {p95:>10.3f} {throughput:>10.1f}")
+        within_slo = [c for c, p95, _ in results if p95 <= args.slo]
+        print(f"max concurrency within p95 <= {args.slo}s: {max(within_slo) if within_slo else 0}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,66 @@
+# ai_assistant/benchmarks/bench_context.py
+#
+# Prompt size per turn over a long chat, sending the whole history every turn
+# (before) versus the bounded context window with a rolling summary (after).
+# Prompt tokens are what the stand-in model reports: the characters of the
+# history it was seeded with plus the new message, divided by four. The system
+# prompt is the same in both modes and is left out.
+#
+#   python benchmarks/bench_context.py --turns 40
+
+import argparse
+import asyncio
+
+import _stubs
+
+import ai_service
+import database_service as db
+import model_registry
+from job_queue import background_jobs
+from message_buffer import message_log
+
+MESSAGE = ("It started two days ago as a dull ache behind my eyes and it gets worse in the evening. "
+           "I took paracetamol twice today which helped a little. I also feel slightly nauseous and "
+           "bright light bothers me more than usual. No fever that I know of.")
+
+
+async def _run(turns: int, bounded: bool) -> list[int]:
+    original = ai_service.fold_point
+    if not bounded:
+        ai_service.fold_point = lambda history, *window: 0
+    try:
+        service = await ai_service.AIService.create("bench-user")
+        prompt_tokens = []
+        for _ in range(turns):
+            timer = ai_service.StageTimer()
+            await service.get_non_streamed_response(MESSAGE, timer=timer)
+            prompt_tokens.append(timer.prompt_tokens)
+            # Let the fold finish before the next message, as it would between a patient's replies.
+            while background_jobs.is_pending(f"context:{service.session_id}"):
+                await asyncio.sleep(0.001)
+        await message_log.stop()
+        await background_jobs.stop()
+        return prompt_tokens
+    finally:
+        ai_service.fold_point = original
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Prompt tokens per turn with and without the context window")
+    parser.add_argument("--turns", type=int, default=40)
+    args = parser.parse_args()
+
+    db.supabase_client = _stubs.SlowSupabase(0)
+    model_registry.model_class = _stubs.slow_model_factory(0)
+
+    before = asyncio.run(_run(args.turns, bounded=False))
+    after = asyncio.run(_run(args.turns, bounded=True))
+
+    print(f"{'turn':>6} {'before':>10} {'after':>10}")
+    for turn in sorted({1, 5, 10, 20, 30, args.turns} & set(range(1, args.turns + 1))):
+        print(f"{turn:>6} {before[turn - 1]:>10} {after[turn - 1]:>10}")
+    print(f"{'total':>6} {sum(before):>10} {sum(after):>10}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,118 @@
+# ai_assistant/benchmarks/bench_duplicates.py
+#
+# Patients double-submitting and a frontend retrying, against the fake backends.
+# Each session sends a few messages; some are double-clicked (two identical
+# requests at once, no key) and some are retried by the client with the same
+# Idempotency-Key after a short timeout, once while the first attempt is still
+# running and once after it has finished.
+#
+# Without coalescing every copy is a separate Gemini call and a separate pair of
+# ai_messages rows. With it, copies join the original request (or replay its
+# stored reply), so Gemini calls and stored rows match the messages actually
+# meant, and each session's turns stay in order.
+#
+#   python benchmarks/bench_duplicates.py --sessions 50 --turns 4 --double-click 0.2 --retry 0.2
+
+import argparse
+import asyncio
+import os
+import random
+import time
+
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+os.environ["USE_FAKE_BACKENDS"] = "true"
+os.environ["FAKE_LLM_ESI_LEVEL"] = "0"
+os.environ["FAKE_LLM_LATENCY_SECONDS"] = "0.3"
+os.environ["FAKE_DB_LATENCY_SECONDS"] = "0.005"
+
+import _stubs
+
+import httpx
+
+import database_service as db
+import main
+import resilience
+from admission import admission
+from message_buffer import message_log
+from request_dedup import RequestCoalescer
+
+
+class _NoCoalescing(RequestCoalescer):
+    """Runs every request, as the service did before duplicates were coalesced."""
+
+    async def run(self, key, work, remember=True, keep=None):
+        self.executed += 1
+        return await work(), False
+
+
+async def _traffic(args, seed):
+    rng = random.Random(seed)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        sessions = []
+        for i in range(args.sessions):
+            response = await client.post("/chat/start", json={"user_id": f"user-{i}"})
+            sessions.append(response.json()["session_id"])
+
+        async def chat(session_id):
+            for turn in range(args.turns):
+                data = {"session_id": session_id, "user_message": f"Symptom update {turn}"}
+                headers = {"Idempotency-Key": f"{session_id}:{turn}"}
+                send = lambda: client.post("/chat/message", data=data, headers=headers)
+                roll = rng.random()
+                if roll < args.double_click:
+                    # Two clicks, no key: only the content says they are the same message.
+                    await asyncio.gather(*(client.post("/chat/message", data=data) for _ in range(2)))
+                elif roll < args.double_click + args.retry:
+                    # The client times out after 0.2 s and retries while the first attempt runs...
+                    first = asyncio.ensure_future(send())
+                    await asyncio.sleep(0.2)
+                    await asyncio.gather(first, send())
+                    # ...and once more after a dropped response.
+                    await send()
+                else:
+                    await send()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(chat(session_id) for session_id in sessions))
+        elapsed = time.perf_counter() - started
+        await message_log.flush()
+        return sessions, elapsed
+
+
+def _in_order(session_ids, turns):
+    """Sessions whose stored patient messages are each turn exactly once, in order."""
+    expected = [f"Symptom update {turn}" for turn in range(turns)]
+    ordered = 0
+    for session_id in session_ids:
+        rows = db.supabase_client.children("ai_messages", session_id)
+        ordered += [row["message_content"] for row in rows if row["sender"] == "user"] == expected
+    return ordered
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Coalescing of double-submitted and retried chat messages")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--double-click", type=float, default=0.2, help="share of messages sent twice at once")
+    parser.add_argument("--retry", type=float, default=0.2, help="share of messages retried with the same key")
+    args = parser.parse_args()
+
+    admission.rate = 0
+    db.connect()
+    print(f"{args.sessions} sessions x {args.turns} messages, {args.double_click:.0%} double-clicked, "
+          f"{args.retry:.0%} retried twice")
+    print(f"{'':>16} {'gemini calls':>13} {'stored rows':>12} {'in order':>9} {'seconds':>8}")
+    for mode in ("no coalescing", "coalescing"):
+        main.chat_requests = _NoCoalescing() if mode == "no coalescing" else RequestCoalescer()
+        calls_before = resilience.gemini.calls
+        rows_before = len(db.supabase_client.tables["ai_messages"])
+        sessions, elapsed = asyncio.run(_traffic(args, seed=7))
+        rows = len(db.supabase_client.tables["ai_messages"]) - rows_before
+        print(f"{mode:>16} {resilience.gemini.calls - calls_before:>13} {rows:>12} "
+              f"{_in_order(sessions, args.turns):>5}/{len(sessions):<3} {elapsed:>8.2f}")
+    print(f"\nMessages meant: {args.sessions * args.turns}. Coalescer stats: {main.chat_requests.stats()}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,103 @@
+# ai_assistant/benchmarks/bench_emergency.py
+#
+# Accuracy of the local emergency classifier on the labeled corpus in
+# emergency_corpus.jsonl (English, Filipino and Cebuano), its per-message cost
+# against a plain substring scan over the same phrases, and the time to the
+# emergency reply through AIService with and without the fast path.
+#
+#   python benchmarks/bench_emergency.py --llm-latency 1.5
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import _stubs
+
+import ai_service
+import config
+import database_service as db
+import model_registry
+from emergency_classifier import EMERGENCY_PHRASES, classify_emergency, normalize
+from job_queue import background_jobs
+from message_buffer import message_log
+
+CORPUS = os.path.join(os.path.dirname(__file__), "emergency_corpus.jsonl")
+
+
+def _load_corpus():
+    with open(CORPUS, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _accuracy(corpus):
+    tp = fp = fn = tn = 0
+    for row in corpus:
+        predicted = classify_emergency(row["text"]) is not None
+        if predicted and row["emergency"]:
+            tp += 1
+        elif predicted:
+            fp += 1
+            print(f"  false positive [{row['lang']}]: {row['text']}")
+        elif row["emergency"]:
+            fn += 1
+            print(f"  missed [{row['lang']}]: {row['text']}")
+        else:
+            tn += 1
+    precision = tp / (tp + fp) if tp + fp else 1.0
+    recall = tp / (tp + fn) if tp + fn else 1.0
+    print(f"{len(corpus)} messages: precision {precision:.3f}, recall {recall:.3f} (tp={tp} fp={fp} fn={fn} tn={tn})")
+
+
+def _naive(message, patterns=[f" {p.rstrip('*')}" for ps in EMERGENCY_PHRASES.values() for p in ps]):
+    # One substring search per phrase, with no negation handling: the obvious alternative.
+    text = normalize(message)
+    return any(pattern in text for pattern in patterns)
+
+
+def _throughput(corpus, rounds):
+    texts = [row["text"] for row in corpus]
+    for name, classify in (("substring scan", _naive), ("aho-corasick", classify_emergency)):
+        timings = []
+        for _ in range(rounds):
+            for text in texts:
+                started = time.perf_counter()
+                classify(text)
+                timings.append((time.perf_counter() - started) * 1e6)
+        total = sum(timings) / 1e6
+        print(f"{name:>15}: {len(timings) / total:>10.0f} msg/s  "
+              f"p50 {_stubs.percentile(timings, 50):6.1f} us  p99 {_stubs.percentile(timings, 99):6.1f} us")
+
+
+async def _reply_latency(message):
+    service = await ai_service.AIService.create("bench-user")
+    started = time.perf_counter()
+    await service.get_non_streamed_response(message)
+    elapsed = time.perf_counter() - started
+    await message_log.stop()
+    await background_jobs.stop()
+    return elapsed
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Emergency fast-path accuracy and speed")
+    parser.add_argument("--llm-latency", type=float, default=1.5, help="seconds per Gemini reply")
+    parser.add_argument("--rounds", type=int, default=200, help="passes over the corpus for throughput")
+    args = parser.parse_args()
+
+    corpus = _load_corpus()
+    _accuracy(corpus)
+    _throughput(corpus, args.rounds)
+
+    db.supabase_client = _stubs.SlowSupabase(0)
+    model_registry.model_class = _stubs.slow_model_factory(args.llm_latency)
+    message = "My dad collapsed and is unresponsive"
+    for enabled in (False, True):
+        config.EMERGENCY_FAST_PATH = enabled
+        elapsed = asyncio.run(_reply_latency(message))
+        print(f"fast path {'on ' if enabled else 'off'}: emergency reply after {elapsed * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main_cli()
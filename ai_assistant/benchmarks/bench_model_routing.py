@@ -0,0 +1,124 @@
+# ai_assistant/benchmarks/bench_model_routing.py
+#
+# Gemini tokens, estimated cost and time for a batch of long triage chats, against
+# the offline fake model (USE_FAKE_BACKENDS), in two modes:
+#
+# 1. Standard. Every call on the standard model and no token budget, which is how
+#    every session ran before.
+# 2. Routed. Titles and context folds on the light model (LIGHT_MODEL_TASKS), and
+#    the context window tightened once a session has used --budget tokens.
+#
+# Each chat sends --turns patient messages, asks for its title after the first
+# exchange (as the frontend does) and gets its ESI level, and with it the clinical
+# summary, on the last turn. Token counts are what the fake reports (characters
+# over four); costs use the list prices in model_registry; the fake light model
+# answers in FAKE_LLM_LIGHT_LATENCY_FACTOR of the standard model's time.
+#
+#   python benchmarks/bench_model_routing.py --sessions 20 --turns 24 --budget 25000
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+os.environ["USE_FAKE_BACKENDS"] = "true"
+os.environ["FAKE_DB_LATENCY_SECONDS"] = "0"
+os.environ.setdefault("FAKE_LLM_LATENCY_SECONDS", "0.05")
+os.environ.setdefault("FAKE_LLM_TOKENS_PER_SECOND", "2000")
+
+import _stubs
+
+import ai_service
+import config
+import llm_usage
+import model_registry
+from job_queue import background_jobs
+from message_buffer import message_log
+
+MESSAGE = ("It started two days ago as a dull ache behind my eyes and it gets worse in the evening. "
+           "I took paracetamol twice today which helped a little. I also feel slightly nauseous and "
+           "bright light bothers me more than usual. No fever that I know of.")
+
+
+async def _chat(turns: int) -> tuple[ai_service.AIService, list[float]]:
+    service = await ai_service.AIService.create("bench-user")
+    turn_seconds = []
+    for turn in range(turns):
+        started = time.perf_counter()
+        await service.get_non_streamed_response(MESSAGE, timer=ai_service.StageTimer())
+        turn_seconds.append(time.perf_counter() - started)
+        if turn == 0:
+            background_jobs.enqueue(f"title:{service.session_id}", service.generate_and_save_title)
+        # Let a fold finish before the next message, as it would between a patient's replies.
+        while background_jobs.is_pending(f"context:{service.session_id}"):
+            await asyncio.sleep(0.001)
+    return service, turn_seconds
+
+
+async def _run(args, routed: bool) -> dict:
+    model_registry.LIGHT_TASKS = args.light_tasks if routed else frozenset()
+    config.SESSION_TOKEN_BUDGET = args.budget if routed else 0
+    llm_usage.usage_stats = llm_usage.UsageStats()
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(_chat(args.turns) for _ in range(args.sessions)))
+    await background_jobs.stop()
+    await message_log.stop()
+    elapsed = time.perf_counter() - started
+
+    sessions = [service.usage for service, _ in results]
+    return {
+        "models": llm_usage.usage_stats.stats()["by_model"],
+        "over_budget": llm_usage.usage_stats.sessions_over_budget,
+        "session_tokens": [usage.total_tokens for usage in sessions],
+        "llm_seconds": sum(usage.seconds for usage in sessions),
+        "turn_seconds": [seconds for _, turn_seconds in results for seconds in turn_seconds],
+        "elapsed": elapsed,
+    }
+
+
+def _report(name: str, result: dict):
+    print(f"\n{name}")
+    print(f"  {'model':<24} {'calls':>6} {'prompt tok':>11} {'output tok':>11} {'llm s':>8} {'cost $':>9}")
+    for model_name, entry in sorted(result["models"].items()):
+        print(f"  {model_name:<24} {entry['calls']:>6} {entry['prompt_tokens']:>11} {entry['output_tokens']:>11} "
+              f"{entry['seconds']:>8.1f} {entry['cost_usd']:>9.4f}")
+    tokens = result["session_tokens"]
+    print(f"  tokens per session: mean {statistics.mean(tokens):.0f}, max {max(tokens)}; "
+          f"sessions over budget: {result['over_budget']}")
+    print(f"  patient turn: mean {statistics.mean(result['turn_seconds']) * 1000:.0f} ms; "
+          f"wall time {result['elapsed']:.1f} s")
+
+
+def _totals(result: dict) -> tuple[int, float, float]:
+    models = result["models"].values()
+    return (sum(entry["prompt_tokens"] + entry["output_tokens"] for entry in models),
+            sum(entry["cost_usd"] for entry in models), result["llm_seconds"])
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Gemini tokens and cost with and without model routing and token budgets")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=24, help="patient messages per chat")
+    parser.add_argument("--budget", type=int, default=25000, help="per-session token budget in the routed mode")
+    args = parser.parse_args()
+    args.light_tasks = model_registry.LIGHT_TASKS
+    # Only the last turn is tagged, so each chat gets one summary, as a real triage does.
+    config.FAKE_LLM_ESI_AFTER_TURNS = args.turns
+
+    print(f"{args.sessions} chats of {args.turns} messages; light model {model_registry.LIGHT_MODEL} "
+          f"for {', '.join(sorted(args.light_tasks))}")
+    standard = asyncio.run(_run(args, routed=False))
+    routed = asyncio.run(_run(args, routed=True))
+    _report("Standard model for everything, no budget", standard)
+    _report(f"Routed, {args.budget}-token budget", routed)
+
+    (tokens, cost, seconds), (routed_tokens, routed_cost, routed_seconds) = _totals(standard), _totals(routed)
+    print(f"\nSaved: {1 - routed_tokens / tokens:.0%} of tokens, {1 - routed_cost / cost:.0%} of the estimated cost, "
+          f"{1 - routed_seconds / seconds:.0%} of the time spent waiting on Gemini")
+
+
+if __name__ == "__main__":
+    main_cli()
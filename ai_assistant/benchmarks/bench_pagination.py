@@ -0,0 +1,97 @@
+# ai_assistant/benchmarks/bench_pagination.py
+#
+# Session-list response time against a seeded local SQLite copy of the
+# ai_sessions schema: the old "every session with its summary" query, OFFSET
+# paging, and the keyset paging used by /sessions/user/{user_id}. Keyset pages
+# should cost the same at any depth; the others grow with the user's history.
+#
+#   python benchmarks/bench_pagination.py --sessions 10000 --page-size 50
+
+import argparse
+import json
+import sqlite3
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+LEAN_COLUMNS = "id, title, created_at, final_esi_level, has_summary"
+SUMMARY = "The patient reports a two-day history of headache and mild fever. " * 20
+
+
+def _seed(db, user_sessions, other_users):
+    db.execute("""
+        CREATE TABLE ai_sessions (
+            id TEXT PRIMARY KEY, user_id TEXT, title TEXT, created_at TEXT,
+            session_summary TEXT, final_esi_level INTEGER, has_summary INTEGER
+        )""")
+    db.execute("CREATE INDEX ai_sessions_user_created ON ai_sessions (user_id, created_at DESC, id DESC)")
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    users = ["bench-user"] + [f"user-{i}" for i in range(other_users)]
+    rows = (
+        (str(uuid.uuid4()), user, "Headache and Fever", (start + timedelta(minutes=i)).isoformat(), SUMMARY, 4, 1)
+        for user in users
+        for i in range(user_sessions if user == "bench-user" else 20)
+    )
+    db.executemany("INSERT INTO ai_sessions VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    db.commit()
+
+
+def _keyset_query(cursor, page_size):
+    # Same shape as the PostgREST filter: rows strictly before (created_at, id), newest first.
+    if cursor is None:
+        return (f"SELECT {LEAN_COLUMNS} FROM ai_sessions WHERE user_id = ? "
+                "ORDER BY created_at DESC, id DESC LIMIT ?", ("bench-user", page_size + 1))
+    return (f"SELECT {LEAN_COLUMNS} FROM ai_sessions WHERE user_id = ? AND (created_at, id) < (?, ?) "
+            "ORDER BY created_at DESC, id DESC LIMIT ?", ("bench-user", cursor[0], cursor[1], page_size + 1))
+
+
+def _timed(db, sql, params, repeat):
+    times, payload = [], 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = db.execute(sql, params).fetchall()
+        payload = len(json.dumps(rows))
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times), payload, rows
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Session list pagination benchmark")
+    parser.add_argument("--sessions", type=int, default=10_000, help="sessions for the benchmarked user")
+    parser.add_argument("--other-users", type=int, default=1000)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    db = sqlite3.connect(":memory:")
+    _seed(db, args.sessions, args.other_users)
+    last_page = args.sessions // args.page_size - 1
+    depths = sorted({0, 10, last_page // 2, last_page})
+
+    full_ms, full_bytes, _ = _timed(db, """
+        SELECT id, title, created_at, session_summary, final_esi_level, has_summary FROM ai_sessions
+        WHERE user_id = ? ORDER BY created_at DESC""", ("bench-user",), args.repeat)
+    print(f"{args.sessions} sessions for one user; page size {args.page_size}")
+    print(f"old full list with summaries: {full_ms:8.2f} ms  {full_bytes / 1024:9.1f} KiB\n")
+    print(f"{'page':>6} {'offset (ms)':>12} {'keyset (ms)':>12} {'page KiB':>9}")
+
+    # Walk the keyset cursor to each depth the way a client would.
+    cursors, cursor, page = {}, None, 0
+    while page <= last_page:
+        cursors[page] = cursor
+        rows = db.execute(*_keyset_query(cursor, args.page_size)).fetchall()
+        cursor = (rows[args.page_size - 1][2], rows[args.page_size - 1][0]) if len(rows) > args.page_size else None
+        page += 1
+
+    for depth in depths:
+        offset_ms, _, _ = _timed(db, f"""
+            SELECT {LEAN_COLUMNS} FROM ai_sessions WHERE user_id = ?
+            ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?""",
+            ("bench-user", args.page_size, depth * args.page_size), args.repeat)
+        keyset_ms, page_bytes, _ = _timed(db, *_keyset_query(cursors[depth], args.page_size), args.repeat)
+        print(f"{depth:>6} {offset_ms:>12.3f} {keyset_ms:>12.3f} {page_bytes / 1024:>9.1f}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,83 @@
+# ai_assistant/benchmarks/bench_pdf_export.py
+#
+# Bulk summary export: renders N synthetic summaries one after another on the
+# calling thread (what N calls to /session/{id}/summary/pdf did) and through
+# stream_summaries_zip with the PDF process pool, and checks the ZIP is valid.
+#
+#   python benchmarks/bench_pdf_export.py --sessions 1000 --workers 4
+
+import argparse
+import asyncio
+import io
+import resource
+import time
+import uuid
+import zipfile
+
+import _stubs
+
+import pdf_service
+from pdf_export import PdfRenderer, stream_summaries_zip
+
+SUMMARY = (
+    "The patient is a 34-year-old reporting a throbbing frontal headache for two days, "
+    "rated 6/10, with mild nausea and sensitivity to light. No fever, neck stiffness, "
+    "weakness or vision loss reported.\n"
+    "* Symptoms: headache, nausea, photophobia\n"
+    "* Duration: 2 days\n"
+    "* Final ESI Level: 4"
+)
+
+
+def _rows(count):
+    return [
+        {"id": str(uuid.uuid4()), "user_id": "bench-user", "session_summary": SUMMARY, "created_at": "2025-01-01T00:00:00Z"}
+        for _ in range(count)
+    ]
+
+
+def _sequential(rows):
+    started = time.perf_counter()
+    total = sum(len(pdf_service.create_summary_pdf(r["session_summary"], r["id"], r["user_id"])) for r in rows)
+    return time.perf_counter() - started, total
+
+
+async def _streamed(rows, workers):
+    renderer = PdfRenderer(workers)
+    renderer.warm_up()
+    await asyncio.sleep(0)
+    sink = io.BytesIO()
+    started = time.perf_counter()
+    first_chunk = None
+    try:
+        async for chunk in stream_summaries_zip(rows, renderer):
+            if first_chunk is None and chunk:
+                first_chunk = time.perf_counter() - started
+            sink.write(chunk)
+    finally:
+        renderer.shutdown()
+    elapsed = time.perf_counter() - started
+    names = zipfile.ZipFile(io.BytesIO(sink.getvalue())).namelist()
+    assert len(names) == len(rows), "every session should be in the archive"
+    return elapsed, first_chunk, sink.tell()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Bulk PDF export benchmark")
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    rows = _rows(args.sessions)
+    sequential, _ = _sequential(rows)
+    streamed, first_chunk, size = asyncio.run(_streamed(rows, args.workers))
+
+    print(f"{args.sessions} PDFs, {size / 2**20:.1f} MiB archive")
+    print(f"sequential on one thread : {sequential:7.2f}s  ({args.sessions / sequential:6.1f} PDFs/s)")
+    print(f"streamed ZIP, {args.workers} processes : {streamed:7.2f}s  ({args.sessions / streamed:6.1f} PDFs/s), "
+          f"first bytes after {first_chunk * 1000:.0f} ms")
+    print(f"peak RSS of this process: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,172 @@
+# ai_assistant/benchmarks/bench_resilience.py
+#
+# Chat turns against the fake backends with faults injected, with and without
+# the resilience layer:
+#
+# 1. Flaky Gemini: a share of calls fail with 503 and a few hang. Without
+#    retries every failure reaches the patient as an error reply, and a hung
+#    call holds the turn until it gives up; with them, failures are retried
+#    with backoff and hangs are cut off at the timeout and retried.
+#
+# 2. Slow tail: a few calls take ten times as long as usual. Hedging sends a
+#    second attempt when the first is slower than the hedge delay, which cuts
+#    the p99 for a small share of extra calls.
+#
+# 3. Outage: Gemini stops answering. Without a breaker every turn waits out
+#    its timeouts and retries; once the breaker opens, turns are refused with
+#    503 + Retry-After in milliseconds. After the reset period a probe finds
+#    Gemini back and the breaker closes.
+#
+# 4. Flaky database: reads are retried, so a share of failed round-trips no
+#    longer turns into "session not found".
+#
+#   python benchmarks/bench_resilience.py --turns 200 --error-rate 0.15 --hang-rate 0.03
+
+import argparse
+import asyncio
+import os
+import time
+
+# Failed calls are logged; keep the tables readable.
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+os.environ["USE_FAKE_BACKENDS"] = "true"
+os.environ["FAKE_LLM_ESI_LEVEL"] = "0"
+os.environ["FAKE_DB_LATENCY_SECONDS"] = "0.005"
+
+import _stubs
+
+import httpx
+
+import database_service as db
+import main
+import resilience
+from admission import admission
+from model_registry import DEFAULT_MODEL, get_model
+from prompts import TRIAGE_SYSTEM_PROMPT
+
+ERROR_REPLY = "Sorry, I encountered an error. Please try again."
+
+
+def _configure(service, timeout=None, attempts=1, hedge_after=0.0, hedge_budget=0.0, threshold=10 ** 9, reset=30.0):
+    """Sets a policy and clears its counters and breaker. The defaults are no resilience at all."""
+    service.__init__(service.name, timeout, attempts, hedge_after=hedge_after, hedge_budget=hedge_budget,
+                     base_delay=0.05, max_delay=0.5)
+    service.breaker.failure_threshold = threshold
+    service.breaker.reset_seconds = reset
+
+
+async def _turns(count, concurrency):
+    """One message in each of `count` new sessions. Returns [(outcome, ms)]."""
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        sessions = []
+        for i in range(count):
+            response = await client.post("/chat/start", json={"user_id": f"user-{i}"})
+            sessions.append(response.json()["session_id"])
+        semaphore = asyncio.Semaphore(concurrency)
+        results = []
+
+        async def turn(session_id):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/chat/message", data={
+                    "session_id": session_id, "user_message": "I have had a headache since yesterday",
+                })
+                elapsed = (time.perf_counter() - started) * 1000
+                if response.status_code == 503:
+                    outcome = "503"
+                elif response.status_code == 200 and response.json()["response_text"] != ERROR_REPLY:
+                    outcome = "ok"
+                else:
+                    outcome = "error"
+                results.append((outcome, elapsed))
+
+        await asyncio.gather(*(turn(session_id) for session_id in sessions))
+        return results
+
+
+def _row(label, results, extra=""):
+    count = lambda name: sum(1 for outcome, _ in results if outcome == name)
+    timings = [elapsed for _, elapsed in results]
+    print(f"{label:>26} {count('ok'):>5} {count('error'):>6} {count('503'):>5} "
+          f"{_stubs.percentile(timings, 50):>8.0f} {_stubs.percentile(timings, 99):>8.0f} {max(timings):>8.0f}  {extra}")
+
+
+def _header(title):
+    print(f"\n{title}")
+    print(f"{'':>26} {'ok':>5} {'error':>6} {'503':>5} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Retries, timeouts, hedging and circuit breakers under injected faults")
+    parser.add_argument("--turns", type=int, default=200, help="chat turns per run")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds per fake Gemini reply")
+    parser.add_argument("--error-rate", type=float, default=0.15, help="share of Gemini calls that fail")
+    parser.add_argument("--hang-rate", type=float, default=0.03, help="share of Gemini calls that hang")
+    parser.add_argument("--hang-seconds", type=float, default=20.0)
+    parser.add_argument("--timeout", type=float, default=2.0, help="Gemini timeout per attempt")
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="share of Gemini calls 10x slower")
+    parser.add_argument("--hedge-after", type=float, default=1.0, help="comfortably above a normal reply's time")
+    parser.add_argument("--db-error-rate", type=float, default=0.2, help="share of database reads that fail")
+    args = parser.parse_args()
+
+    admission.rate = 0
+    model = get_model(DEFAULT_MODEL, TRIAGE_SYSTEM_PROMPT)
+    model.latency = args.llm_latency
+    faults = model.faults
+    faults.hang_seconds = args.hang_seconds
+    gemini = resilience.gemini
+    _configure(resilience.supabase, attempts=3)
+
+    _header(f"1. Flaky Gemini: {args.error_rate:.0%} of calls fail, {args.hang_rate:.0%} hang for {args.hang_seconds:.0f}s")
+    faults.error_rate, faults.hang_rate = args.error_rate, args.hang_rate
+    _configure(gemini)
+    _row("no retries, no timeout", asyncio.run(_turns(args.turns, args.concurrency)))
+    _configure(gemini, timeout=args.timeout, attempts=3)
+    results = asyncio.run(_turns(args.turns, args.concurrency))
+    stats = gemini.stats()
+    _row(f"{args.timeout:.0f}s timeout, 3 attempts", results,
+         f"retries {stats['retries']}, timeouts {stats['timeouts']}")
+    faults.error_rate = faults.hang_rate = 0
+
+    _header(f"2. Slow tail: {args.slow_rate:.0%} of calls take {faults.slow_factor:.0f}x as long")
+    faults.slow_rate = args.slow_rate
+    _configure(gemini, timeout=30, attempts=3)
+    _row("no hedging", asyncio.run(_turns(args.turns, args.concurrency)))
+    _configure(gemini, timeout=30, attempts=3, hedge_after=args.hedge_after, hedge_budget=0.1)
+    results = asyncio.run(_turns(args.turns, args.concurrency))
+    stats = gemini.stats()
+    _row(f"hedge after {args.hedge_after}s", results,
+         f"hedges {stats['hedges']} ({stats['hedges'] / stats['calls']:.0%} extra calls), won {stats['hedge_wins']}")
+    faults.slow_rate = 0
+
+    _header("3. Outage: every Gemini call hangs")
+    faults.hang_rate = 1.0
+    _configure(gemini, timeout=args.timeout, attempts=3)
+    _row("retries, no breaker", asyncio.run(_turns(args.turns // 4, args.concurrency)))
+    _configure(gemini, timeout=args.timeout, attempts=3, threshold=5, reset=1.0)
+    _row("retries + breaker", asyncio.run(_turns(args.turns // 4, args.concurrency)),
+         f"breaker {gemini.breaker.state}, short-circuited {gemini.breaker.short_circuited}")
+    faults.hang_rate = 0
+    time.sleep(1.0)
+    probe = asyncio.run(_turns(1, 1))
+    _row("recovered, after a probe", asyncio.run(_turns(args.turns // 4, args.concurrency)),
+         f"probe {probe[0][0]}, breaker {gemini.breaker.state}")
+
+    print(f"\n4. Flaky database: {args.db_error_rate:.0%} of round-trips fail, "
+          f"{args.turns} session reads")
+    session_ids = [db.create_session(f"reader-{i}") for i in range(args.turns)]
+    db.supabase_client.faults.error_rate = args.db_error_rate
+    for label, attempts in (("no retries", 1), ("3 attempts", 3)):
+        _configure(resilience.supabase, attempts=attempts)
+        db.session_details_cache.clear()
+        found = sum(db.get_session_details(session_id) is not None for session_id in session_ids)
+        print(f"{label:>26}: {found}/{len(session_ids)} found, retries {resilience.supabase.retries}")
+    db.supabase_client.faults.error_rate = 0
+
+    print(f"\nInjected Gemini faults: {faults.injected}")
+
+
+if __name__ == "__main__":
+    main_cli()
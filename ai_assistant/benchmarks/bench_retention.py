@@ -0,0 +1,411 @@
+# ai_assistant/benchmarks/bench_retention.py
+#
+# The retention job against a seeded local SQLite copy of ai_sessions,
+# ai_messages and the symptom-images bucket, with millions of rows. A small
+# client below turns the PostgREST and storage calls database_service makes into
+# SQL, and sleeps --latency per call like a round-trip would.
+#
+# 1. One at a time: delete_session_from_db for a sample of expired sessions, as
+#    the API does, and the time that would take for all of them. Their images stay.
+# 2. Dry run over the whole store.
+# 3. The batched job, unthrottled, while a second thread keeps reading a user's
+#    session list: throughput, round trips, and the reads' latency before and during.
+# 4. On a fresh, smaller store: the job throttled to --rate rows a second, stopped
+#    halfway and resumed from its checkpoint. Sessions and messages must match the
+#    dry run; it undercounts images shared across batches.
+#
+# After each real run the store is checked: no expired session or its messages
+# left, every image a message points to still stored, no unreferenced image past
+# the grace period left.
+#
+#   python benchmarks/bench_retention.py --sessions 200000 --messages 10 --rate 5000
+
+import argparse
+import asyncio
+import random
+import sqlite3
+import statistics
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import _stubs
+
+import database_service as db
+from fake_backends import _split_top_level
+from retention import RetentionJob
+from session_store import MemorySessionStore
+
+BUCKET_URL = "https://bench.local/storage/v1/object/public/symptom-images/"
+SQL_OPS = {"eq": "=", "neq": "!=", "lt": "<", "lte": "<=", "gt": ">", "gte": ">="}
+
+
+class _Response:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+def _logic_sql(expression, joiner=" OR "):
+    """A PostgREST logic filter such as `a.gt."x",and(a.eq."x",id.gt."y")` as SQL."""
+    clauses, params = [], []
+    for part in _split_top_level(expression):
+        if part.startswith(("and(", "or(")):
+            clause, inner = _logic_sql(part[part.index("(") + 1:-1], " AND " if part.startswith("and(") else " OR ")
+        else:
+            column, op, value = part.split(".", 2)
+            clause, inner = f"{column} {SQL_OPS[op]} ?", [value.strip('"')]
+        clauses.append(f"({clause})")
+        params.extend(inner)
+    return joiner.join(clauses), params
+
+
+class _Query:
+    """The query shapes database_service's retention and session-list calls use, as SQL."""
+
+    def __init__(self, client, table):
+        self.client, self.table = client, table
+        self.action, self.columns, self.count, self.head = "select", "*", None, False
+        self.where, self.params, self.orders = [], [], []
+        self.limit_, self.offset, self.negate = None, 0, False
+
+    def select(self, columns="*", count=None, head=False, **kwargs):
+        self.action, self.columns, self.count, self.head = "select", columns, count, head
+        return self
+
+    def delete(self, count=None, returning="representation", **kwargs):
+        self.action, self.count = "delete", count
+        return self
+
+    def _add(self, clause, params=()):
+        if self.negate:
+            clause, self.negate = f"NOT ({clause})", False
+        self.where.append(f"({clause})")
+        self.params.extend(params)
+        return self
+
+    def eq(self, column, value):
+        return self._add(f"{column} = ?", [value])
+
+    def lt(self, column, value):
+        return self._add(f"{column} < ?", [value])
+
+    def gte(self, column, value):
+        return self._add(f"{column} >= ?", [value])
+
+    def in_(self, column, values):
+        values = list(values)
+        return self._add(f"{column} IN ({','.join('?' * len(values))})", values)
+
+    def is_(self, column, value):
+        return self._add(f"{column} IS NULL")
+
+    @property
+    def not_(self):
+        self.negate = True
+        return self
+
+    def or_(self, filters, **kwargs):
+        return self._add(*_logic_sql(filters))
+
+    def order(self, column, desc=False, **kwargs):
+        self.orders.append(f"{column} {'DESC' if desc else 'ASC'}")
+        return self
+
+    def limit(self, size, **kwargs):
+        self.limit_ = size
+        return self
+
+    def range(self, start, end, **kwargs):
+        self.offset, self.limit_ = start, end - start + 1
+        return self
+
+    def execute(self):
+        where = f" WHERE {' AND '.join(self.where)}" if self.where else ""
+        if self.action == "delete":
+            return _Response([], self.client.run(f"DELETE FROM {self.table}{where}", self.params).rowcount)
+        if self.head:
+            count = self.client.run(f"SELECT COUNT(*) FROM {self.table}{where}", self.params).fetchone()[0]
+            return _Response([], count)
+        sql = f"SELECT {self.columns} FROM {self.table}{where}"
+        if self.orders:
+            sql += " ORDER BY " + ", ".join(self.orders)
+        if self.limit_ is not None:
+            sql += f" LIMIT {self.limit_} OFFSET {self.offset}"
+        cursor = self.client.run(sql, self.params)
+        names = [column[0] for column in cursor.description]
+        return _Response([dict(zip(names, row)) for row in cursor.fetchall()])
+
+
+class _Bucket:
+    def __init__(self, client):
+        self.client = client
+
+    def list(self, path=None, options=None):
+        cursor = self.client.run("SELECT name, created_at FROM storage_objects ORDER BY name LIMIT ? OFFSET ?",
+                                 [options["limit"], options["offset"]])
+        return [{"name": name, "created_at": created_at} for name, created_at in cursor.fetchall()]
+
+    def remove(self, paths):
+        cursor = self.client.run(f"DELETE FROM storage_objects WHERE name IN ({','.join('?' * len(paths))}) "
+                                 "RETURNING name", list(paths))
+        return [{"name": row[0]} for row in cursor.fetchall()]
+
+    def get_public_url(self, path):
+        return BUCKET_URL + path
+
+
+class _Storage:
+    def __init__(self, client):
+        self.bucket = _Bucket(client)
+
+    def from_(self, name):
+        return self.bucket
+
+
+class SqliteSupabase:
+    """One SQLite database behind a lock, like one Postgres instance serving every caller."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.conn = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.storage = _Storage(self)
+
+    def table(self, name):
+        return _Query(self, name)
+
+    def run(self, sql, params=()):
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls += 1
+            cursor = self.conn.execute(sql, params)
+            if cursor.description is not None:
+                # Materialize while holding the lock.
+                rows = cursor.fetchall()
+                return _Rows(cursor.description, rows)
+            return cursor
+
+
+class _Rows:
+    def __init__(self, description, rows):
+        self.description = description
+        self._rows = rows
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+
+def _seed(client, args, rng):
+    """Sessions spread over the last three years, with messages, images, shared images and orphans."""
+    conn = client.conn
+    conn.executescript("""
+        CREATE TABLE ai_sessions (
+            id TEXT PRIMARY KEY, user_id TEXT, title TEXT, created_at TEXT,
+            final_esi_level INTEGER, has_summary INTEGER);
+        CREATE TABLE ai_messages (
+            id INTEGER PRIMARY KEY, session_id TEXT REFERENCES ai_sessions(id) ON DELETE CASCADE,
+            sender TEXT, message_content TEXT, image_url TEXT, timestamp TEXT);
+        CREATE TABLE storage_objects (name TEXT PRIMARY KEY, created_at TEXT);
+    """)
+    now = datetime.now(timezone.utc)
+    sessions, messages, objects, image_names = [], [], [], []
+    for i in range(args.sessions):
+        session_id = str(uuid.uuid4())
+        created = (now - timedelta(days=rng.uniform(0, 3 * 365))).isoformat()
+        sessions.append((session_id, f"user-{i % 5000}", "Headache", created, 4, 1))
+        image_url = None
+        if i % 4 == 0:
+            if image_names and rng.random() < 0.05:
+                image_url = BUCKET_URL + rng.choice(image_names)
+            else:
+                name = f"{uuid.uuid4().hex}.webp"
+                image_names.append(name)
+                objects.append((name, created))
+                image_url = BUCKET_URL + name
+        for turn in range(args.messages):
+            messages.append((session_id, "user" if turn % 2 == 0 else "ai", "Symptom update " * 4,
+                             image_url if turn == 0 else None, created))
+    for _ in range(args.orphans):
+        objects.append((f"{uuid.uuid4().hex}.webp", (now - timedelta(days=rng.uniform(2, 900))).isoformat()))
+    for _ in range(args.orphans // 20):
+        # Just uploaded; the message that points to each may still be on its way.
+        objects.append((f"{uuid.uuid4().hex}.webp", (now - timedelta(minutes=rng.uniform(0, 60))).isoformat()))
+
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO ai_sessions VALUES (?, ?, ?, ?, ?, ?)", sessions)
+    conn.executemany("INSERT INTO ai_messages (session_id, sender, message_content, image_url, timestamp) "
+                     "VALUES (?, ?, ?, ?, ?)", messages)
+    conn.executemany("INSERT INTO storage_objects VALUES (?, ?)", objects)
+    conn.execute("COMMIT")
+    conn.executescript("""
+        CREATE INDEX ai_sessions_created ON ai_sessions (created_at, id);
+        CREATE INDEX ai_sessions_user_created ON ai_sessions (user_id, created_at DESC, id DESC);
+        CREATE INDEX ai_messages_session ON ai_messages (session_id);
+        CREATE INDEX ai_messages_image ON ai_messages (image_url) WHERE image_url IS NOT NULL;
+    """)
+    return len(sessions) + len(messages), len(objects)
+
+
+def _check(client, retention_days, grace_hours):
+    now = datetime.now(timezone.utc)
+    sessions_before = (now - timedelta(days=retention_days)).isoformat()
+    images_before = (now - timedelta(hours=grace_hours)).isoformat()
+    conn = client.conn
+    problems = {
+        "expired sessions left": conn.execute(
+            "SELECT COUNT(*) FROM ai_sessions WHERE created_at < ?", [sessions_before]).fetchone()[0],
+        "messages without a session": conn.execute(
+            "SELECT COUNT(*) FROM ai_messages m LEFT JOIN ai_sessions s ON s.id = m.session_id "
+            "WHERE s.id IS NULL").fetchone()[0],
+        "referenced images missing": conn.execute(
+            "SELECT COUNT(DISTINCT image_url) FROM ai_messages WHERE image_url IS NOT NULL "
+            "AND substr(image_url, ?) NOT IN (SELECT name FROM storage_objects)", [len(BUCKET_URL) + 1]).fetchone()[0],
+        "orphaned images left": conn.execute(
+            "SELECT COUNT(*) FROM storage_objects WHERE created_at < ? AND ? || name NOT IN "
+            "(SELECT image_url FROM ai_messages WHERE image_url IS NOT NULL)", [images_before, BUCKET_URL]).fetchone()[0],
+    }
+    bad = {name: count for name, count in problems.items() if count}
+    return "ok" if not bad else f"FAILED {bad}"
+
+
+def _counts(client):
+    conn = client.conn
+    return tuple(conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                 for table in ("ai_sessions", "ai_messages", "storage_objects"))
+
+
+class _Probe:
+    """Reads a user's first page of sessions in a loop, like the sidebar does, and records how long each takes."""
+
+    def __init__(self):
+        self.times = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def _loop(self):
+        i = 0
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            db._fetch_sessions_for_user(f"user-{i % 5000}", 20, None)
+            self.times.append((time.perf_counter() - started) * 1000)
+            i += 1
+            time.sleep(0.005)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self):
+        times = sorted(self.times)
+        return f"p50 {statistics.median(times):6.1f} ms  p99 {times[int(len(times) * 0.99)]:6.1f} ms"
+
+
+def _job(args, rate, store):
+    return RetentionJob(retention_days=args.retention_days, batch_size=args.batch_size, rows_per_second=rate,
+                        concurrency=args.concurrency, image_grace_hours=args.grace_hours, store=store)
+
+
+def _print_run(label, result, seconds, calls):
+    rows = result["sessions_deleted"] + result["messages_deleted"]
+    print(f"{label:>26} {seconds:8.1f} s  {result['sessions_deleted']:>8} sessions {result['messages_deleted']:>9} "
+          f"messages {result['images_deleted']:>7} images  {rows / seconds:>9.0f} rows/s  {calls:>6} calls")
+
+
+async def _interrupted_run(args, client):
+    """Runs throttled, stops about halfway, then resumes in a new job as a restarted worker would."""
+    store = MemorySessionStore()
+    first = _job(args, args.rate, store)
+    task = asyncio.ensure_future(first.run())
+    expired = client.conn.execute("SELECT COUNT(*) FROM ai_sessions WHERE created_at < ?", [
+        (datetime.now(timezone.utc) - timedelta(days=args.retention_days)).isoformat()]).fetchone()[0]
+    while first.progress["sessions_deleted"] < expired // 2:
+        await asyncio.sleep(0.05)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    stopped_at = first.progress["sessions_deleted"]
+    return stopped_at, await _job(args, args.rate, store).run()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Retention job on a seeded local store")
+    parser.add_argument("--sessions", type=int, default=200_000)
+    parser.add_argument("--messages", type=int, default=10, help="messages per session")
+    parser.add_argument("--orphans", type=int, default=20_000, help="images left behind by deleted sessions")
+    parser.add_argument("--retention-days", type=int, default=365)
+    parser.add_argument("--grace-hours", type=float, default=24)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=5000, help="rows a second for the throttled run")
+    parser.add_argument("--latency", type=float, default=0.002, help="seconds per database call")
+    parser.add_argument("--sample", type=int, default=1000, help="sessions deleted one at a time")
+    args = parser.parse_args()
+
+    client = SqliteSupabase(args.latency)
+    started = time.perf_counter()
+    rows, objects = _seed(client, args, random.Random(7))
+    print(f"Seeded {rows:,} rows and {objects:,} images in {time.perf_counter() - started:.1f} s; "
+          f"keeping {args.retention_days} days, {args.latency * 1000:g} ms per call\n")
+    db.supabase_client = client
+
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=args.retention_days)).isoformat()
+    expired = [row[0] for row in client.conn.execute(
+        "SELECT id FROM ai_sessions WHERE created_at < ? ORDER BY created_at", [cutoff]).fetchall()]
+    calls, started = client.calls, time.perf_counter()
+    for session_id in expired[:args.sample]:
+        db.delete_session_from_db(session_id)
+    per_session = (time.perf_counter() - started) / args.sample
+    print(f"One at a time: {per_session * 1000:.2f} ms and {(client.calls - calls) / args.sample:.0f} call per session; "
+          f"{len(expired) - args.sample:,} more expired sessions would take {per_session * (len(expired) - args.sample) / 60:.1f} "
+          f"min, and their images stay in storage.\n")
+
+    calls, started = client.calls, time.perf_counter()
+    dry = asyncio.run(_job(args, 0, MemorySessionStore()).run(dry_run=True))
+    _print_run("dry run", dry, time.perf_counter() - started, client.calls - calls)
+
+    with _Probe() as idle:
+        time.sleep(2)
+    before = _counts(client)
+    calls, started = client.calls, time.perf_counter()
+    with _Probe() as busy:
+        result = asyncio.run(_job(args, 0, MemorySessionStore()).run())
+    _print_run("batched, unthrottled", result, time.perf_counter() - started, client.calls - calls)
+    after = _counts(client)
+    print(f"{'':>26} sessions {before[0]:,} -> {after[0]:,}, messages {before[1]:,} -> {after[1]:,}, "
+          f"images {before[2]:,} -> {after[2]:,}; check: {_check(client, args.retention_days, args.grace_hours)}")
+    print(f"{'session list reads':>26} idle: {idle.summary()}   during the run: {busy.summary()}")
+
+    print(f"\nFresh store of {args.sessions // 10:,} sessions, throttled to {args.rate:g} rows/s, stopped halfway:")
+    small = SqliteSupabase(args.latency)
+    small_args = argparse.Namespace(**{**vars(args), "sessions": args.sessions // 10, "orphans": args.orphans // 10})
+    _seed(small, small_args, random.Random(11))
+    db.supabase_client = small
+    dry = asyncio.run(_job(args, 0, MemorySessionStore()).run(dry_run=True))
+    started = time.perf_counter()
+    with _Probe() as throttled:
+        stopped_at, result = asyncio.run(_interrupted_run(args, small))
+    seconds = time.perf_counter() - started
+    rows = result["sessions_deleted"] + result["messages_deleted"]
+    print(f"{'':>26} stopped after {stopped_at:,} sessions; the resumed run finished with "
+          f"{result['sessions_deleted']:,} sessions, {result['messages_deleted']:,} messages and "
+          f"{result['images_deleted']:,} images (dry run: {dry['sessions_deleted']:,}, {dry['messages_deleted']:,}, "
+          f"{dry['images_deleted']:,})")
+    print(f"{'':>26} {rows / seconds:,.0f} rows/s overall; check: {_check(small, args.retention_days, args.grace_hours)}")
+    print(f"{'session list reads':>26} during the throttled run: {throttled.summary()}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,180 @@
+# ai_assistant/benchmarks/bench_scaling.py
+#
+# What externalized session state buys:
+#
+# 1. Restore cost. A chat that is not in this worker's memory is rebuilt either
+#    from the database (one embedded query for every message) or from its
+#    compact stored state (one key lookup, no query).
+#
+# 2. Scale-out. 1..N uvicorn workers on the fake backends share a SQLite session
+#    store and sit behind a client-side round-robin with no stickiness: every
+#    turn of a session goes to a different worker than the one before. Offered
+#    load grows with the worker count, so ideal scaling is linear throughput.
+#    Each worker is its own process, so on a machine with fewer cores than
+#    workers the processes share the CPU and the curve flattens accordingly.
+#
+#   python benchmarks/bench_scaling.py --workers 1 2 4 --sessions 64 --turns 4
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+import _stubs
+
+import ai_service
+import database_service as db
+from fake_backends import FakeSupabaseClient
+from loadtest import APP_DIR, _free_port, _percentile, _wait_until_up
+from session_store import SqliteSessionStore
+
+MESSAGES = [
+    "I've had a headache since yesterday morning.",
+    "It's about a 6 out of 10 and gets worse when I stand up.",
+    "No fever, but I feel a bit nauseous.",
+    "I slept badly and I've been drinking a lot of coffee.",
+]
+
+
+async def _restore_cost(history_turns, db_latency, rounds):
+    db.supabase_client = FakeSupabaseClient(db_latency)
+    # Only the restore itself is measured, so keep it from queueing context folds.
+    ai_service.fold_point = lambda history, *window: 0
+    db.session_details_cache.clear()
+    session_id = db.create_session("bench-user")
+    for i in range(history_turns):
+        db.log_messages([
+            {"session_id": session_id, "sender": "user", "message_content": MESSAGES[i % len(MESSAGES)]},
+            {"session_id": session_id, "sender": "bot", "message_content": "Thank you. " * 30},
+        ])
+    details = db.get_session_details(session_id)
+    service = ai_service.AIService.from_existing_session("bench-user", session_id, details["messages"])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SqliteSessionStore(os.path.join(tmp, "store.db"))
+        version = await store.save(session_id, service.to_state(), 0)
+
+        from_db, from_store = [], []
+        for _ in range(rounds):
+            db.session_details_cache.clear()
+            started = time.perf_counter()
+            details = await db.get_session_details_async(session_id)
+            ai_service.AIService.from_existing_session("bench-user", session_id, details["messages"])
+            from_db.append((time.perf_counter() - started) * 1000)
+
+            started = time.perf_counter()
+            ai_service.AIService.from_state(*await store.load(session_id))
+            from_store.append((time.perf_counter() - started) * 1000)
+        await store.close()
+
+    print(f"Restoring a {history_turns}-turn chat ({db_latency * 1000:.0f} ms per database round-trip, state v{version}):")
+    for name, timings in (("database", from_db), ("session store", from_store)):
+        print(f"  {name:>14}: p50 {_percentile(timings, 50):7.2f} ms  p95 {_percentile(timings, 95):7.2f} ms")
+
+
+def _start_workers(count, store_path, args):
+    env = dict(os.environ)
+    env.update({
+        "USE_FAKE_BACKENDS": "true",
+        "SESSION_STORE_URL": f"sqlite:///{store_path}",
+        "FAKE_DB_LATENCY_SECONDS": str(args.db_latency),
+        "FAKE_LLM_LATENCY_SECONDS": str(args.llm_latency),
+        "FAKE_LLM_ESI_LEVEL": "0",
+        "LOG_LEVEL": "WARNING",
+    })
+    workers = []
+    for _ in range(count):
+        port = _free_port()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+             "--log-level", "warning"],
+            cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        workers.append((port, process))
+    return workers
+
+
+async def _scale_run(count, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        workers = _start_workers(count, os.path.join(tmp, "store.db"), args)
+        clients = [httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60) for port, _ in workers]
+        try:
+            for client, (_, process) in zip(clients, workers):
+                await _wait_until_up(client, process)
+
+            sessions = []
+            for i in range(args.sessions):
+                response = await clients[i % count].post("/chat/start", json={"user_id": f"scale-user-{i}"})
+                sessions.append(response.json()["session_id"])
+
+            concurrency = args.concurrency * count
+            semaphore = asyncio.Semaphore(concurrency)
+            latencies, errors = [], 0
+
+            async def chat(index, session_id):
+                nonlocal errors
+                for turn in range(args.turns):
+                    # Never the worker that served the previous turn (with more than one worker).
+                    client = clients[(index + turn + 1) % count]
+                    async with semaphore:
+                        started = time.perf_counter()
+                        response = await client.post("/chat/message", data={
+                            "session_id": session_id, "user_message": MESSAGES[turn % len(MESSAGES)],
+                        })
+                        latencies.append((time.perf_counter() - started) * 1000)
+                        errors += response.status_code != 200
+
+            started = time.perf_counter()
+            await asyncio.gather(*(chat(i, sid) for i, sid in enumerate(sessions)))
+            elapsed = time.perf_counter() - started
+
+            restored = {"store": 0, "database": 0}
+            for client in clients:
+                stats = (await client.get("/internal/stats")).json()["session_store"]["restored_from"]
+                for source in restored:
+                    restored[source] += stats[source]
+            return len(latencies) / elapsed, latencies, errors, restored
+        finally:
+            for client in clients:
+                await client.aclose()
+            for _, process in workers:
+                process.terminate()
+            for _, process in workers:
+                try:
+                    process.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Session restore cost and multi-worker scaling")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--sessions", type=int, default=64)
+    parser.add_argument("--turns", type=int, default=4, help="messages per session")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight per worker")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per fake Gemini reply")
+    parser.add_argument("--db-latency", type=float, default=0.02, help="seconds per fake Supabase round-trip")
+    parser.add_argument("--history-turns", type=int, default=30, help="turns in the chat for the restore comparison")
+    args = parser.parse_args()
+
+    asyncio.run(_restore_cost(args.history_turns, args.db_latency, rounds=50))
+
+    print(f"\nRound-robin chat turns, {args.sessions} sessions x {args.turns} turns, "
+          f"{args.concurrency} in flight per worker ({os.cpu_count()} CPUs):")
+    print(f"{'workers':>8} {'turns/s':>9} {'scaling':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7} "
+          f"{'from store':>11} {'from db':>8}")
+    baseline = None
+    for count in args.workers:
+        throughput, latencies, errors, restored = asyncio.run(_scale_run(count, args))
+        baseline = baseline or throughput / count
+        print(f"{count:>8} {throughput:>9.1f} {throughput / baseline:>7.2f}x {_percentile(latencies, 50):>8.1f} "
+              f"{_percentile(latencies, 95):>8.1f} {errors:>7} {restored['store']:>11} {restored['database']:>8}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,77 @@
+# ai_assistant/benchmarks/bench_sessions.py
+#
+# Start-up time and resident memory of N active sessions, comparing the old
+# per-session GenerativeModel + ChatSession with the shared-model AIService.
+# Each session carries the same short restored conversation. No network calls
+# are made: building models and chats is local. Memory is the Python heap as
+# seen by tracemalloc, so protobuf buffers held in C are not included.
+#
+#   python benchmarks/bench_sessions.py --sessions 10000
+
+import argparse
+import contextlib
+import gc
+import io
+import time
+import tracemalloc
+import uuid
+
+import _stubs
+
+import google.generativeai as genai
+
+from ai_service import AIService
+from prompts import INITIAL_GREETING, TRIAGE_SYSTEM_PROMPT
+
+CONVERSATION = [
+    {"type": "bot", "text": INITIAL_GREETING},
+    {"type": "user", "text": "I've had a headache and a mild fever since yesterday."},
+    {"type": "bot", "text": "I'm sorry to hear that. How high is the fever, and do you have a stiff neck or a rash?"},
+    {"type": "user", "text": "About 38.2C. No stiff neck, no rash."},
+]
+
+
+def _old_session(user_id, session_id):
+    # What AIService.from_existing_session used to build for every session.
+    history = [
+        {"role": "user" if m["type"] == "user" else "model", "parts": [{"text": m["text"]}]}
+        for m in CONVERSATION
+    ]
+    model = genai.GenerativeModel("gemini-2.5-flash", system_instruction=TRIAGE_SYSTEM_PROMPT)
+    return (user_id, session_id, model, model.start_chat(history=history))
+
+
+def _new_session(user_id, session_id):
+    return AIService.from_existing_session(user_id, session_id, CONVERSATION)
+
+
+def _measure(factory, count):
+    ids = [str(uuid.uuid4()) for _ in range(count)]
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    sessions = [factory("bench-user", session_id) for session_id in ids]
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del sessions
+    return elapsed, current
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Per-session start-up time and memory")
+    parser.add_argument("--sessions", type=int, default=10_000)
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = {name: _measure(factory, args.sessions) for name, factory in (("before", _old_session), ("after", _new_session))}
+
+    print(f"{args.sessions} sessions")
+    print(f"{'':<8} {'total (s)':>10} {'per session (us)':>17} {'memory (MiB)':>13} {'per session (KiB)':>18}")
+    for name, (elapsed, memory) in results.items():
+        print(f"{name:<8} {elapsed:>10.3f} {elapsed / args.sessions * 1e6:>17.1f} "
+              f"{memory / 2**20:>13.1f} {memory / args.sessions / 1024:>18.2f}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,114 @@
+# ai_assistant/benchmarks/bench_startup.py
+#
+# How soon a fresh worker can take traffic. The real client libraries are used
+# (with dummy keys; nothing here needs the network), so the numbers include
+# importing google.generativeai, supabase and fpdf.
+#
+# 1. Import. `import main` in a fresh interpreter, against importing it and then
+#    doing everything it used to do at import time (configure Gemini, build the
+#    Supabase client, load fpdf and Pillow).
+#
+# 2. Start-up. A uvicorn worker is started and polled: time until /healthz
+#    answers (the worker accepts requests) and until /readyz says 200 (every
+#    client and worker pool is warm), with the warm-up in the background and
+#    with STARTUP_WARMUP_BLOCKING=true, which holds requests until it is done.
+#
+#   python benchmarks/bench_startup.py --runs 5
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+import _stubs
+
+from loadtest import APP_DIR, _free_port
+
+ENV = {
+    "GEMINI_API_KEY": "benchmark",
+    "SUPABASE_URL": "http://127.0.0.1:54321",
+    "SUPABASE_KEY": "benchmark",
+    "USE_FAKE_BACKENDS": "false",
+    "LOG_LEVEL": "WARNING",
+}
+
+IMPORT_ONLY = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+IMPORT_AND_WARM = (
+    "import time; t = time.perf_counter(); import main; "
+    "main._warm_gemini(); main._warm_supabase(); import pdf_service, PIL.Image, PIL.ImageOps; "
+    "print(time.perf_counter() - t)"
+)
+
+
+def _env(**extra):
+    env = dict(os.environ)
+    env.update(ENV)
+    env.update(extra)
+    return env
+
+
+def _time_import(code):
+    output = subprocess.run([sys.executable, "-c", code], cwd=APP_DIR, env=_env(), capture_output=True, text=True)
+    if output.returncode:
+        raise RuntimeError(output.stderr)
+    return float(output.stdout.strip().splitlines()[-1]) * 1000
+
+
+async def _time_startup(blocking):
+    port = _free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=APP_DIR, env=_env(STARTUP_WARMUP_BLOCKING=str(blocking).lower()),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    live = ready = None
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=5) as client:
+            while ready is None and time.perf_counter() - started < 60:
+                if process.poll() is not None:
+                    raise RuntimeError("The server exited during start-up.")
+                try:
+                    if live is None and (await client.get("/healthz")).status_code == 200:
+                        live = (time.perf_counter() - started) * 1000
+                    if (await client.get("/readyz")).status_code == 200:
+                        ready = (time.perf_counter() - started) * 1000
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.01)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    if ready is None:
+        raise RuntimeError("The server did not become ready in time.")
+    return live, ready
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Import and start-up time of the service")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    lazy = [_time_import(IMPORT_ONLY) for _ in range(args.runs)]
+    eager = [_time_import(IMPORT_AND_WARM) for _ in range(args.runs)]
+    print(f"Import (median of {args.runs}):")
+    print(f"  import main                         {statistics.median(lazy):7.0f} ms")
+    print(f"  import main + warm every client     {statistics.median(eager):7.0f} ms")
+
+    print(f"\nFrom process start (median of {args.runs}):")
+    print(f"{'':>24} {'/healthz ms':>12} {'/readyz ms':>11}")
+    for label, blocking in (("background warm-up", False), ("blocking warm-up", True)):
+        runs = [asyncio.run(_time_startup(blocking)) for _ in range(args.runs)]
+        print(f"{label:>24} {statistics.median(r[0] for r in runs):>12.0f} {statistics.median(r[1] for r in runs):>11.0f}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,90 @@
+# ai_assistant/benchmarks/bench_streaming.py
+#
+# Compares time-to-first-token of /chat/message (whole reply at once) and
+# /chat/message/stream (Server-Sent Events) with a simulated Gemini that takes
+# `--llm-latency` to start replying and `--token-delay` per word after that.
+#
+#   python benchmarks/bench_streaming.py --requests 20
+
+import argparse
+import asyncio
+import socket
+import time
+
+import _stubs
+
+import httpx
+import uvicorn
+
+import database_service as db
+import main
+import model_registry
+
+
+async def _time_plain(client, session_id):
+    started = time.perf_counter()
+    response = await client.post("/chat/message", data={"session_id": session_id, "user_message": "I have a headache"})
+    response.raise_for_status()
+    elapsed = time.perf_counter() - started
+    return elapsed, elapsed
+
+
+async def _time_stream(client, session_id):
+    started = time.perf_counter()
+    first_token = None
+    async with client.stream("POST", "/chat/message/stream", data={"session_id": session_id, "user_message": "I have a headache"}) as response:
+        async for line in response.aiter_lines():
+            if first_token is None and line.startswith("data:") and '"token"' in line:
+                first_token = time.perf_counter() - started
+    return first_token, time.perf_counter() - started
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _run(args):
+    # A real server is needed here: httpx's in-process ASGI transport buffers whole responses.
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    try:
+        await _measure(args, f"http://127.0.0.1:{port}")
+    finally:
+        server.should_exit = True
+        await serving
+
+
+async def _measure(args, base_url):
+    async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+        response = await client.post("/chat/start", json={"user_id": "bench-user"})
+        session_id = response.json()["session_id"]
+
+        print(f"{'endpoint':<22} {'TTFT p50 (s)':>13} {'TTFT p95 (s)':>13} {'total p50 (s)':>14}")
+        for name, timer in (("/chat/message", _time_plain), ("/chat/message/stream", _time_stream)):
+            results = [await timer(client, session_id) for _ in range(args.requests)]
+            ttft = [r[0] for r in results]
+            total = [r[1] for r in results]
+            print(f"{name:<22} {_stubs.percentile(ttft, 50):>13.3f} {_stubs.percentile(ttft, 95):>13.3f} {_stubs.percentile(total, 50):>14.3f}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Time-to-first-token benchmark")
+    parser.add_argument("--db-latency", type=float, default=0.02)
+    parser.add_argument("--llm-latency", type=float, default=0.4, help="seconds until the first token")
+    parser.add_argument("--token-delay", type=float, default=0.03, help="seconds between streamed words")
+    parser.add_argument("--requests", type=int, default=10)
+    args = parser.parse_args()
+
+    db.supabase_client = _stubs.SlowSupabase(args.db_latency)
+    model_registry.model_class = _stubs.slow_model_factory(args.llm_latency, args.token_delay)
+    asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,289 @@
+# ai_assistant/benchmarks/bench_websocket.py
+#
+# Chat turns over /chat/ws against the HTTP endpoints, with the app running under
+# uvicorn (one worker) on the offline fake backends and a near-instant fake
+# Gemini, so what is measured is the cost of the transport and the per-turn work
+# around the model call.
+#
+# 1. Per-turn overhead. One patient sends --turns messages one after another over
+#    POST /chat/message and /chat/ws with "stream": false (the whole reply at
+#    once), and over POST /chat/message/stream and /chat/ws streamed: latency, and
+#    the server's CPU time per turn (from /proc, Linux only).
+#
+# 2. Connected patients. --patients N patients each send --rounds messages with
+#    a random think time around --think seconds between them, every patient on
+#    its own keep-alive connection to POST /chat/message or its own socket
+#    (non-streamed; --stream compares the streamed endpoints instead). Reported
+#    per N: turn latency, errors, the server's CPU use, its resident memory and the
+#    growth per open connection, how many session restores (from the store or the
+#    database) there were, and how often an HTTP patient had to reconnect. Past
+#    SESSION_CACHE_MAX_ENTRIES patients the HTTP path restores sessions the cache
+#    evicted on every turn; a socket does so at most once, when it connects, and
+#    keeps its session while it is connected.
+#
+# uvicorn is run with --ws-per-message-deflate false, as it should be for /chat/ws:
+# with compression each idle socket holds two zlib contexts (~130 KB), for frames
+# that are mostly a few words long. --ws-deflate measures it with compression on.
+#
+#   python benchmarks/bench_websocket.py --turns 200 --patients 250 500 1000 --rounds 5 --think 5
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from urllib.parse import urlencode
+
+import httpx
+from websockets.asyncio.client import connect
+
+from loadtest import APP_DIR, _free_port, _percentile, _rss_kb, _wait_until_up
+
+MESSAGE = "I've had a headache since yesterday morning."
+
+
+def _cpu_seconds(pid):
+    """User plus system CPU time of a process, from /proc (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _start_server(args, port):
+    env = dict(os.environ)
+    env.update({
+        "USE_FAKE_BACKENDS": "true",
+        "LOG_LEVEL": "WARNING",
+        "FAKE_DB_LATENCY_SECONDS": str(args.db_latency),
+        "FAKE_LLM_LATENCY_SECONDS": str(args.llm_latency),
+        "FAKE_LLM_TOKENS_PER_SECOND": "100000",
+        # No triage, so no summaries or PDFs in the background of the measurement.
+        "FAKE_LLM_ESI_LEVEL": "0",
+        "GEMINI_RATE_PER_SECOND": "0",
+        "GEMINI_MAX_CONCURRENT": "100000",
+        "GEMINI_QUEUE_DEADLINE_SECONDS": "600",
+    })
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--backlog", "4096", "--ws-per-message-deflate", str(args.ws_deflate).lower()],
+        cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+class _Socket:
+    """A patient's /chat/ws connection."""
+
+    def __init__(self, ws_url, session_id):
+        self.url = f"{ws_url}/chat/ws?session_id={session_id}"
+        self.connection = None
+        self._ids = 0
+
+    async def open(self):
+        self.connection = await connect(self.url, max_size=None, ping_interval=None)
+        ready = json.loads(await self.connection.recv())
+        if ready["type"] != "ready":
+            raise RuntimeError(f"Unexpected first event: {ready}")
+
+    async def turn(self, text, stream=True):
+        self._ids += 1
+        message_id = str(self._ids)
+        await self.connection.send(json.dumps({"type": "message", "id": message_id, "text": text, "stream": stream}))
+        while True:
+            event = json.loads(await self.connection.recv())
+            if event["type"] == "ping":
+                await self.connection.send('{"type": "pong"}')
+            elif event.get("id") == message_id and event["type"] in ("done", "error"):
+                return event["type"] == "done"
+
+    async def close(self):
+        if self.connection is not None:
+            await self.connection.close()
+
+
+class _Http:
+    """
+    A patient's keep-alive HTTP/1.1 connection, on plain asyncio streams: with a thousand
+    connections, httpx's pool costs the benchmark more CPU than the requests cost the
+    server, and the two share the machine. Requests carry an Origin header, as the
+    browser's would, so the CORS middleware does its usual work. Like a browser, it
+    opens a new connection when uvicorn has closed an idle one (after 5 s by default).
+    """
+
+    def __init__(self, port, session_id):
+        self.port = port
+        self.session_id = session_id
+        self.reader = self.writer = None
+        self.reconnects = 0
+
+    async def open(self):
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", self.port)
+
+    async def turn(self, text, stream=False):
+        if self.reader.at_eof():
+            self.writer.close()
+            self.reconnects += 1
+            await self.open()
+        body = urlencode({"session_id": self.session_id, "user_message": text}).encode()
+        path = "/chat/message/stream" if stream else "/chat/message"
+        self.writer.write(
+            f"POST {path} HTTP/1.1\r\nHost: 127.0.0.1:{self.port}\r\nOrigin: http://localhost:5173\r\n"
+            f"Content-Type: application/x-www-form-urlencoded\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+        )
+        head = (await self.reader.readuntil(b"\r\n\r\n")).decode("latin-1").lower()
+        status = int(head.split(" ", 2)[1])
+        if "transfer-encoding: chunked" in head:
+            content = b""
+            while True:
+                size = int((await self.reader.readline()).strip(), 16)
+                content += (await self.reader.readexactly(size + 2))[:size]
+                if not size:
+                    break
+        else:
+            length = int(head.split("content-length:", 1)[1].split("\r\n", 1)[0])
+            content = await self.reader.readexactly(length)
+        return status == 200 and (not stream or b'"type": "done"' in content)
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def _start_sessions(client, count):
+    semaphore = asyncio.Semaphore(64)
+
+    async def start(i):
+        async with semaphore:
+            response = await client.post("/chat/start", json={"user_id": f"patient-{i}"})
+            return response.json()["session_id"]
+
+    return await asyncio.gather(*(start(i) for i in range(count)))
+
+
+async def _overhead(args, client, port, ws_url, pid):
+    print(f"Per-turn overhead, one patient, {args.turns} turns (fake Gemini answers in {args.llm_latency * 1000:.0f} ms):")
+    print(f"{'':>25} {'p50 ms':>8} {'p95 ms':>8} {'server CPU ms/turn':>19}")
+    session_id, = await _start_sessions(client, 1)
+    http, socket = _Http(port, session_id), _Socket(ws_url, session_id)
+    await http.open()
+    await socket.open()
+    transports = (
+        ("POST /chat/message", lambda: http.turn(MESSAGE)),
+        ("/chat/ws", lambda: socket.turn(MESSAGE, stream=False)),
+        ("POST /chat/message/stream", lambda: http.turn(MESSAGE, stream=True)),
+        ("/chat/ws streamed", lambda: socket.turn(MESSAGE)),
+    )
+    try:
+        for name, turn in transports:
+            for _ in range(5):
+                await turn()
+            latencies = []
+            cpu_before = _cpu_seconds(pid)
+            for _ in range(args.turns):
+                started = time.perf_counter()
+                if not await turn():
+                    raise RuntimeError(f"A turn over {name} failed.")
+                latencies.append((time.perf_counter() - started) * 1000)
+            cpu = _cpu_seconds(pid)
+            cpu_per_turn = f"{(cpu - cpu_before) * 1000 / args.turns:.2f}" if cpu is not None else "-"
+            print(f"{name:>25} {_percentile(latencies, 50):>8.1f} {_percentile(latencies, 95):>8.1f} {cpu_per_turn:>19}")
+    finally:
+        await http.close()
+        await socket.close()
+
+
+async def _patients(args, client, port, ws_url, pid, transport, count):
+    session_ids = await _start_sessions(client, count)
+    stats_before = (await client.get("/internal/stats")).json()
+    rss_before, _ = _rss_kb(pid)
+    if transport == "websocket":
+        connections = [_Socket(ws_url, session_id) for session_id in session_ids]
+    else:
+        connections = [_Http(port, session_id) for session_id in session_ids]
+    semaphore = asyncio.Semaphore(64)
+
+    async def open_connection(connection):
+        async with semaphore:
+            await connection.open()
+
+    await asyncio.gather(*(open_connection(connection) for connection in connections))
+    rss_connected, _ = _rss_kb(pid)
+
+    latencies, errors = [], 0
+
+    async def patient(i):
+        nonlocal errors
+        rng = random.Random(i)
+        await asyncio.sleep(rng.uniform(0, args.think))
+        for _ in range(args.rounds):
+            started = time.perf_counter()
+            try:
+                ok = await connections[i].turn(MESSAGE, stream=args.stream)
+            except Exception:
+                ok = False
+            latencies.append((time.perf_counter() - started) * 1000)
+            errors += not ok
+            await asyncio.sleep(rng.uniform(0.5, 1.5) * args.think)
+
+    cpu_before = _cpu_seconds(pid)
+    started = time.perf_counter()
+    await asyncio.gather(*(patient(i) for i in range(count)))
+    elapsed = time.perf_counter() - started
+    cpu = _cpu_seconds(pid)
+    rss_after, _ = _rss_kb(pid)
+    await asyncio.gather(*(connection.close() for connection in connections))
+
+    stats = (await client.get("/internal/stats")).json()
+    restores = sum(stats["session_store"]["restored_from"].values()) - sum(stats_before["session_store"]["restored_from"].values())
+    reconnects = sum(getattr(connection, "reconnects", 0) for connection in connections)
+    cpu_share = f"{(cpu - cpu_before) / elapsed:.0%}" if cpu is not None else "-"
+    per_connection = f"{(rss_connected - rss_before) / count:.1f}" if rss_connected and rss_before else "-"
+    print(f"{transport:>10} {count:>9} {len(latencies):>6} {errors:>6} {_percentile(latencies, 50):>8.1f} "
+          f"{_percentile(latencies, 95):>8.1f} {_percentile(latencies, 99):>8.1f} {cpu_share:>5} "
+          f"{(rss_after or 0) / 1024:>7.0f} {per_connection:>8} {restores:>9} {reconnects:>11}")
+
+
+async def _run(args):
+    port = _free_port()
+    process = _start_server(args, port)
+    base_url, ws_url = f"http://127.0.0.1:{port}", f"ws://127.0.0.1:{port}"
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+            await _wait_until_up(client, process)
+            await _overhead(args, client, port, ws_url, process.pid)
+
+            print(f"\nConnected patients, {args.rounds} messages each, ~{args.think:.0f} s apart:")
+            print(f"{'transport':>10} {'patients':>9} {'turns':>6} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} "
+                  f"{'p99 ms':>8} {'CPU':>5} {'RSS MB':>7} {'KB/conn':>8} {'restores':>9} {'reconnects':>11}")
+            for count in args.patients:
+                for transport in ("http", "websocket"):
+                    await _patients(args, client, port, ws_url, process.pid, transport, count)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="WebSocket chat against the HTTP chat endpoints")
+    parser.add_argument("--turns", type=int, default=200, help="turns per transport in the overhead test")
+    parser.add_argument("--patients", type=int, nargs="+", default=[250, 500, 1000])
+    parser.add_argument("--rounds", type=int, default=5, help="messages per patient")
+    parser.add_argument("--think", type=float, default=5.0, help="average seconds between a patient's messages")
+    parser.add_argument("--db-latency", type=float, default=0.005)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--stream", action="store_true", help="compare streamed turns in the connected-patients test")
+    parser.add_argument("--ws-deflate", action="store_true", help="run uvicorn with WebSocket compression on")
+    args = parser.parse_args()
+    asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    main_cli()
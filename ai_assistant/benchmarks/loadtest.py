@@ -0,0 +1,271 @@
+# ai_assistant/benchmarks/loadtest.py
+#
+# Load test for the API running on the offline fake backends. Starts the app
+# with uvicorn in a subprocess (USE_FAKE_BACKENDS=true) and drives, phase by
+# phase at a fixed concurrency:
+#
+#   chat_start      POST /chat/start
+#   message_image   POST /chat/message with a 2000x1500 JPEG
+#   message_<n>     POST /chat/message, text only, turn n of every session
+#   session         GET /session/{id}
+#   pdf             GET /session/{id}/summary/pdf
+#
+# For each phase it reports p50/p95/p99 latency, throughput, errors and the
+# server's resident memory after the phase (and growth during it). Results are
+# saved as JSON; pass --compare with an earlier file to flag regressions.
+#
+#   python benchmarks/loadtest.py --sessions 200 --concurrency 32
+#   python benchmarks/loadtest.py --compare benchmarks/results/loadtest-<stamp>.json
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import httpx
+from PIL import Image
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+MESSAGES = [
+    "I've had a headache since yesterday morning.",
+    "It's about a 6 out of 10 and gets worse when I stand up.",
+    "No fever, but I feel a bit nauseous.",
+]
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _rss_kb(pid):
+    """Current and peak resident memory of a process in KiB, from /proc (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["VmRSS"].split()[0]), int(fields["VmHWM"].split()[0])
+    except (OSError, KeyError):
+        return None, None
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _test_image():
+    # A photo-sized JPEG with enough detail that preprocessing has real work to do.
+    image = Image.effect_noise((2000, 1500), 64).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def _start_server(args, port):
+    env = dict(os.environ)
+    env.update({
+        "USE_FAKE_BACKENDS": "true",
+        "FAKE_DB_LATENCY_SECONDS": str(args.db_latency),
+        "FAKE_LLM_LATENCY_SECONDS": str(args.llm_latency),
+        "FAKE_LLM_TOKENS_PER_SECOND": str(args.tokens_per_second),
+        # Every session is tagged by its last text message, so its summary (and PDF) exists by the pdf phase.
+        "FAKE_LLM_ESI_AFTER_TURNS": str(args.messages),
+    })
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+async def _wait_until_up(client, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("The server exited during start-up.")
+        try:
+            await client.get("/internal/stats")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError("The server did not start in time.")
+
+
+async def _wait_for_summaries(client, session_ids, timeout=120):
+    # Summaries are background jobs, so the PDF phase waits until every session has one.
+    pending = set(session_ids)
+    deadline = time.monotonic() + timeout
+    while pending and time.monotonic() < deadline:
+        for sid in list(pending):
+            response = await client.get(f"/session/{sid}", params={"limit": 1})
+            if response.status_code == 200 and response.json().get("session_summary"):
+                pending.discard(sid)
+        if pending:
+            await asyncio.sleep(0.5)
+    if pending:
+        print(f"{len(pending)} sessions still had no summary; their PDF requests will fail.")
+
+
+async def _phase(name, requests, concurrency, pid):
+    """Runs `requests` (coroutine factories) with at most `concurrency` in flight."""
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+    rss_before, _ = _rss_kb(pid)
+
+    async def one(request):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await request()
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            latencies.append((time.perf_counter() - started) * 1000)
+            errors += not ok
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(request) for request in requests))
+    elapsed = time.perf_counter() - started
+    rss_after, rss_peak = _rss_kb(pid)
+
+    result = {
+        "requests": len(requests),
+        "errors": errors,
+        "p50_ms": round(_percentile(latencies, 50), 1),
+        "p95_ms": round(_percentile(latencies, 95), 1),
+        "p99_ms": round(_percentile(latencies, 99), 1),
+        "throughput_rps": round(len(requests) / elapsed, 1) if elapsed else 0.0,
+        "rss_mb": round(rss_after / 1024, 1) if rss_after else None,
+        "rss_growth_mb": round((rss_after - rss_before) / 1024, 1) if rss_after and rss_before else None,
+        "peak_rss_mb": round(rss_peak / 1024, 1) if rss_peak else None,
+    }
+    print(f"{name:>14} {result['requests']:>6} {result['errors']:>6} {result['p50_ms']:>9} {result['p95_ms']:>9} "
+          f"{result['p99_ms']:>9} {result['throughput_rps']:>9} {result['rss_mb'] or '-':>8} {result['rss_growth_mb'] or '-':>8}")
+    return result
+
+
+async def _run(args):
+    port = _free_port()
+    process = _start_server(args, port)
+    image = _test_image()
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120, limits=limits) as client:
+            await _wait_until_up(client, process)
+            pid = process.pid
+            session_ids = []
+            phases = {}
+
+            print(f"{'phase':>14} {'reqs':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+                  f"{'req/s':>9} {'rss MB':>8} {'+MB':>8}")
+
+            async def start(i):
+                response = await client.post("/chat/start", json={"user_id": f"load-user-{i % 50}"})
+                if response.status_code == 200:
+                    session_ids.append(response.json()["session_id"])
+                return response
+
+            phases["chat_start"] = await _phase(
+                "chat_start", [lambda i=i: start(i) for i in range(args.sessions)], args.concurrency, pid)
+
+            # The sessions' last text message triggers the ESI tag, so image turns go first.
+            phases["message_image"] = await _phase("message_image", [
+                lambda sid=sid: client.post("/chat/message", data={"session_id": sid, "user_message": "Here is a photo of the rash."},
+                                            files={"image": ("rash.jpg", image, "image/jpeg")})
+                for sid in session_ids[:args.image_sessions]
+            ], args.concurrency, pid)
+
+            for turn in range(1, args.messages + 1):
+                phases[f"message_{turn}"] = await _phase(f"message_{turn}", [
+                    lambda sid=sid, message=MESSAGES[(turn - 1) % len(MESSAGES)]: client.post(
+                        "/chat/message", data={"session_id": sid, "user_message": message})
+                    for sid in session_ids
+                ], args.concurrency, pid)
+
+            phases["session"] = await _phase("session", [
+                lambda sid=sid: client.get(f"/session/{sid}") for sid in session_ids
+            ], args.concurrency, pid)
+
+            await _wait_for_summaries(client, session_ids)
+            phases["pdf"] = await _phase("pdf", [
+                lambda sid=sid: client.get(f"/session/{sid}/summary/pdf") for sid in session_ids
+            ], args.concurrency, pid)
+
+            stats = (await client.get("/internal/stats")).json()
+            return phases, stats
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def _compare(current, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nAgainst {os.path.basename(baseline_path)} (regression if p95 or req/s is more than {threshold:.0f}% worse):")
+    regressions = 0
+    for phase, result in current["phases"].items():
+        before = baseline["phases"].get(phase)
+        if not before:
+            continue
+        p95_change = (result["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0.0
+        rps_change = (result["throughput_rps"] - before["throughput_rps"]) / before["throughput_rps"] * 100 \
+            if before["throughput_rps"] else 0.0
+        regressed = p95_change > threshold or rps_change < -threshold
+        regressions += regressed
+        print(f"{phase:>14}  p95 {before['p95_ms']:>8} -> {result['p95_ms']:>8} ({p95_change:+6.1f}%)  "
+              f"req/s {before['throughput_rps']:>7} -> {result['throughput_rps']:>7} ({rps_change:+6.1f}%)"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Load test on the fake backends")
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--messages", type=int, default=2, help="text messages per session")
+    parser.add_argument("--image-sessions", type=int, default=50, help="sessions that also send a photo")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=80)
+    parser.add_argument("--db-latency", type=float, default=0.02, help="seconds per Supabase round-trip")
+    parser.add_argument("--out", help="where to save results (default: benchmarks/results/loadtest-<time>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    args = parser.parse_args()
+
+    phases, stats = asyncio.run(_run(args))
+    results = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("out", "compare")},
+        "environment": {"python": platform.python_version(), "cpus": os.cpu_count()},
+        "phases": phases,
+        "server_stats": stats,
+    }
+
+    out = args.out or os.path.join(RESULTS_DIR, f"loadtest-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nSaved results to {out}")
+
+    if args.compare and _compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
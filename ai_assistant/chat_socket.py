@@ -0,0 +1,348 @@
+# ai_assistant/chat_socket.py
+
+import asyncio
+import json
+import math
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Callable
+
+from starlette.websockets import WebSocket
+
+from admission import Overloaded
+from resilience import CircuitOpen
+from config import WS_HEARTBEAT_SECONDS, WS_IDLE_TIMEOUT_SECONDS, WS_RESUME_SECONDS, WS_REPLAY_EVENTS
+from structured_log import get_logger
+
+log = get_logger(__name__)
+
+# Message ids remembered per session, so a message resent after a reconnect is not answered twice.
+REMEMBERED_MESSAGE_IDS = 256
+# Close codes: the session does not exist, another connection took it over, it was ended.
+CLOSE_NOT_FOUND = 4404
+CLOSE_REPLACED = 4409
+CLOSE_ENDED = 4410
+
+class SessionChannel:
+    """
+    A session's side of /chat/ws: the AIService it is bound to and the events sent for
+    it. Every event gets the next `seq`; the last `replay_size` are kept so a client
+    that reconnects with the `stream` and `last_seq` it saw gets the ones it missed.
+    `stream` changes whenever the channel is recreated (another worker, or after
+    WS_RESUME_SECONDS without a connection); the client is then told to resync, i.e.
+    reload the history over HTTP. At most one connection is attached at a time.
+
+    Turns run in their own tasks, one after another, and keep going if the connection
+    drops, so a reply that was being streamed is waiting for the client when it returns.
+    """
+
+    def __init__(self, session_id: str, service, replay_size: int = WS_REPLAY_EVENTS,
+                 after_turn: Callable[[], None] | None = None):
+        self.session_id = session_id
+        self.service = service
+        self.after_turn = after_turn
+        self.stream = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self._recent: deque[dict] = deque(maxlen=replay_size)
+        self._outbox: asyncio.Queue | None = None
+        self._websocket: WebSocket | None = None
+        self._turn_lock = asyncio.Lock()
+        self._turns: set[asyncio.Task] = set()
+        self._message_ids: OrderedDict[str, None] = OrderedDict()
+        self.detached_at: float | None = time.monotonic()
+
+    @property
+    def attached(self) -> bool:
+        return self._outbox is not None
+
+    @property
+    def busy(self) -> bool:
+        return bool(self._turns)
+
+    def publish(self, event: dict) -> dict:
+        """Numbers an event, keeps it for replay and sends it if a client is connected."""
+        self.seq += 1
+        event["seq"] = self.seq
+        self._recent.append(event)
+        if self._outbox is not None:
+            self._outbox.put_nowait(event)
+        return event
+
+    def attach(self, websocket: WebSocket, stream: str | None, last_seq: int | None) -> tuple[asyncio.Queue, WebSocket | None, int]:
+        """
+        Makes `websocket` the channel's connection and queues the `ready` event and any
+        replay for it. Returns its outbox, the connection it replaced (if any) and the
+        number of events replayed (-1 if the client has to resync).
+        """
+        replaced = self._websocket
+        outbox: asyncio.Queue = asyncio.Queue()
+        if stream is None or last_seq is None:
+            missed = []
+        elif stream == self.stream and last_seq <= self.seq and (
+                last_seq >= self.seq - len(self._recent)):
+            missed = [event for event in self._recent if event["seq"] > last_seq]
+        else:
+            missed = None
+        outbox.put_nowait({
+            "type": "ready", "session_id": self.session_id, "stream": self.stream, "seq": self.seq,
+            "esi_level": self.service.esi_level, "resync": missed is None,
+        })
+        for event in missed or ():
+            outbox.put_nowait(event)
+        self._outbox, self._websocket, self.detached_at = outbox, websocket, None
+        return outbox, replaced, -1 if missed is None else len(missed)
+
+    def detach(self, outbox: asyncio.Queue):
+        """Drops the connection that owns `outbox`, unless a newer one has replaced it."""
+        if self._outbox is outbox:
+            self._outbox, self._websocket, self.detached_at = None, None, time.monotonic()
+
+    def send_control(self, outbox: asyncio.Queue, event: dict):
+        """Sends a connection-level event (pong, protocol error) that is not numbered or replayed."""
+        outbox.put_nowait(event)
+
+    def start_turn(self, message_id: str | None, text: str, image_bytes: bytes | None = None,
+                   image_content_type: str | None = None, stream: bool = True) -> bool:
+        """Queues a patient message. Returns False for a message id this channel has already taken."""
+        if message_id is not None:
+            if message_id in self._message_ids:
+                return False
+            self._message_ids[message_id] = None
+            if len(self._message_ids) > REMEMBERED_MESSAGE_IDS:
+                self._message_ids.popitem(last=False)
+        task = asyncio.create_task(self._run_turn(message_id, text, image_bytes, image_content_type, stream))
+        self._turns.add(task)
+        task.add_done_callback(self._turns.discard)
+        return True
+
+    async def _run_turn(self, message_id: str | None, text: str, image_bytes: bytes | None,
+                        image_content_type: str | None, stream: bool):
+        async with self._turn_lock:
+            try:
+                if stream:
+                    async for event in self.service.stream_response(text, image_bytes, image_content_type):
+                        event["id"] = message_id
+                        self.publish(event)
+                else:
+                    result = await self.service.get_non_streamed_response(text, image_bytes, image_content_type)
+                    self.publish({"type": "done", **result, "id": message_id})
+            except (Overloaded, CircuitOpen) as e:
+                self.publish({
+                    "type": "error", "id": message_id, "status": 429 if isinstance(e, Overloaded) else 503,
+                    "detail": "The assistant is busy right now. Please try again shortly."
+                    if isinstance(e, Overloaded) else "The assistant is temporarily unavailable. Please try again shortly.",
+                    "retry_after": max(1, math.ceil(e.retry_after)),
+                })
+            except Exception as e:
+                log.error("WebSocket turn failed", extra={"session_id": self.session_id, "error": str(e)})
+                self.publish({"type": "error", "id": message_id, "status": 500, "detail": "The message could not be processed."})
+            finally:
+                if self.after_turn:
+                    self.after_turn()
+
+    async def close(self, code: int = 1000):
+        websocket = self._websocket
+        if websocket is not None:
+            self.detach(self._outbox)
+            try:
+                await websocket.close(code)
+            except Exception:
+                # Already closed from the other side.
+                pass
+
+class ChatChannels:
+    """
+    The channels of this worker's WebSocket chats, by session id. A channel outlives its
+    connection by `resume_seconds` (or until its last turn is done, if later) so a
+    patient who reconnects picks up where they were; the reaper drops it after that.
+    """
+
+    def __init__(self, heartbeat: float = WS_HEARTBEAT_SECONDS, idle_timeout: float = WS_IDLE_TIMEOUT_SECONDS,
+                 resume_seconds: float = WS_RESUME_SECONDS, replay_size: int = WS_REPLAY_EVENTS):
+        self.heartbeat = heartbeat
+        self.idle_timeout = idle_timeout
+        self.resume_seconds = resume_seconds
+        self.replay_size = replay_size
+        self._channels: dict[str, SessionChannel] = {}
+        self._reaper: asyncio.Task | None = None
+        self.connections = 0
+        self.resumes = 0
+        self.resyncs = 0
+        self.replayed_events = 0
+        self.turns = 0
+        self.duplicate_messages = 0
+        self.idle_closes = 0
+
+    def open(self, session_id: str, service, after_turn: Callable[[], None] | None = None) -> SessionChannel:
+        """The session's channel, created if needed, bound to `service`."""
+        channel = self._channels.get(session_id)
+        if channel is None:
+            channel = self._channels[session_id] = SessionChannel(session_id, service, self.replay_size, after_turn)
+        elif not channel.busy:
+            # The caller looked the session up again; between turns its copy is the one to use.
+            channel.service = service
+        return channel
+
+    def publish(self, session_id: str, event: dict):
+        """Sends an event to the session's WebSocket client, if it has a channel on this worker."""
+        channel = self._channels.get(session_id)
+        if channel is not None:
+            channel.publish(event)
+
+    async def close(self, session_id: str):
+        """Closes the session's connection and forgets its channel (the chat has ended)."""
+        channel = self._channels.pop(session_id, None)
+        if channel is not None:
+            await channel.close(CLOSE_ENDED)
+
+    async def serve(self, websocket: WebSocket, channel: SessionChannel, stream: str | None, last_seq: int | None):
+        """Runs an accepted connection until it closes: replay, then turns in and events out."""
+        outbox, replaced, replayed = channel.attach(websocket, stream, last_seq)
+        self.connections += 1
+        if stream is not None:
+            self.resumes += 1
+            if replayed < 0:
+                self.resyncs += 1
+            else:
+                self.replayed_events += replayed
+        if replaced is not None:
+            try:
+                await replaced.close(CLOSE_REPLACED)
+            except Exception:
+                pass
+
+        reader = asyncio.create_task(self._read(websocket, channel, outbox))
+        writer = asyncio.create_task(self._write(websocket, outbox))
+        try:
+            await asyncio.wait({reader, writer}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (reader, writer):
+                task.cancel()
+            await asyncio.gather(reader, writer, return_exceptions=True)
+            channel.detach(outbox)
+
+    async def _write(self, websocket: WebSocket, outbox: asyncio.Queue):
+        """
+        Sends queued events, and a ping whenever nothing else has gone out for a heartbeat
+        interval. Tokens that queued up while a send was in progress (a slow client, a
+        busy worker, a replay) go out as one `token` event with the last one's `seq`.
+        """
+        while True:
+            try:
+                events = [await asyncio.wait_for(outbox.get(), self.heartbeat)]
+            except asyncio.TimeoutError:
+                events = [{"type": "ping"}]
+            while not outbox.empty():
+                event = outbox.get_nowait()
+                last = events[-1]
+                if event["type"] == last["type"] == "token" and event.get("id") == last.get("id"):
+                    events[-1] = {**event, "text": last["text"] + event["text"]}
+                else:
+                    events.append(event)
+            for event in events:
+                await websocket.send_text(json.dumps(event))
+
+    async def _read(self, websocket: WebSocket, channel: SessionChannel, outbox: asyncio.Queue):
+        """
+        Handles client frames until the client goes away or is silent for `idle_timeout`:
+        `message` (with `image_content_type` when a binary frame with the image follows,
+        and `"stream": false` for the whole reply in one `done` event), `ping`, which is
+        answered with `pong`, and `pong`.
+        """
+        awaiting_image: dict | None = None
+        while True:
+            try:
+                frame = await asyncio.wait_for(websocket.receive(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                self.idle_closes += 1
+                await websocket.close(1001)
+                return
+            if frame["type"] == "websocket.disconnect":
+                return
+
+            if frame.get("bytes") is not None:
+                if awaiting_image is None:
+                    channel.send_control(outbox, {"type": "error", "detail": "Binary frames must follow a message that announces an image."})
+                    continue
+                message, awaiting_image = awaiting_image, None
+                self._start_turn(channel, message, frame["bytes"])
+                continue
+
+            try:
+                message = json.loads(frame.get("text") or "")
+                kind = message.get("type")
+            except (ValueError, AttributeError):
+                channel.send_control(outbox, {"type": "error", "detail": "Frames must be JSON objects."})
+                continue
+            if kind == "ping":
+                channel.send_control(outbox, {"type": "pong"})
+            elif kind == "pong":
+                pass
+            elif kind == "message" and isinstance(message.get("text"), str):
+                if awaiting_image is not None:
+                    channel.send_control(outbox, {"type": "error", "id": awaiting_image.get("id"), "detail": "The announced image never arrived."})
+                if message.get("image_content_type"):
+                    awaiting_image = message
+                else:
+                    awaiting_image = None
+                    self._start_turn(channel, message, None)
+            else:
+                channel.send_control(outbox, {"type": "error", "detail": f"Unsupported frame: {kind!r}."})
+
+    def _start_turn(self, channel: SessionChannel, message: dict, image_bytes: bytes | None):
+        message_id = message.get("id")
+        if channel.start_turn(None if message_id is None else str(message_id), message["text"], image_bytes,
+                              message.get("image_content_type") if image_bytes else None, message.get("stream", True) is not False):
+            self.turns += 1
+        else:
+            self.duplicate_messages += 1
+
+    def start_reaper(self):
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap_periodically())
+
+    async def _reap_periodically(self):
+        while True:
+            await asyncio.sleep(max(1.0, self.resume_seconds / 4))
+            self.reap()
+
+    def reap(self) -> int:
+        """Drops channels that have had no connection for `resume_seconds` and no turn running."""
+        cutoff = time.monotonic() - self.resume_seconds
+        expired = [
+            session_id for session_id, channel in self._channels.items()
+            if not channel.attached and not channel.busy and channel.detached_at is not None and channel.detached_at < cutoff
+        ]
+        for session_id in expired:
+            del self._channels[session_id]
+        return len(expired)
+
+    async def stop(self):
+        """Stops the reaper and closes every connection as going away, so clients reconnect elsewhere."""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            try:
+                await self._reaper
+            except asyncio.CancelledError:
+                pass
+            self._reaper = None
+        await asyncio.gather(*(channel.close(1001) for channel in self._channels.values()))
+
+    def stats(self) -> dict:
+        channels = list(self._channels.values())
+        return {
+            "connected": sum(channel.attached for channel in channels),
+            "detached": sum(not channel.attached for channel in channels),
+            "turns_running": sum(channel.busy for channel in channels),
+            "connections": self.connections,
+            "turns": self.turns,
+            "duplicate_messages": self.duplicate_messages,
+            "resumes": self.resumes,
+            "resyncs": self.resyncs,
+            "replayed_events": self.replayed_events,
+            "idle_closes": self.idle_closes,
+        }
+
+# WebSocket chats on this worker.
+chat_channels = ChatChannels()
@@ -14,13 +14,233 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
+# --- Database Connection Pool ---
+# Supabase calls are blocking, so they run on a bounded thread pool that
+# shares one pooled HTTP client instead of stalling the event loop.
+DB_MAX_WORKERS = int(os.getenv("DB_MAX_WORKERS", "16"))
+DB_TIMEOUT_SECONDS = float(os.getenv("DB_TIMEOUT_SECONDS", "10"))
+
+# --- Read-Through Cache ---
+# Session details and per-user session lists are cached in process for a short
+# time and invalidated by this process's own writes.
+READ_CACHE_TTL_SECONDS = float(os.getenv("READ_CACHE_TTL_SECONDS", "30"))
+READ_CACHE_MAX_ENTRIES = int(os.getenv("READ_CACHE_MAX_ENTRIES", "2048"))
+
+# --- Pagination ---
+# Page sizes for session lists and message history when a cursor is passed without a
+# limit, and the largest limit allowed. Without either, the full list is returned.
+SESSION_PAGE_SIZE = int(os.getenv("SESSION_PAGE_SIZE", "50"))
+MESSAGE_PAGE_SIZE = int(os.getenv("MESSAGE_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "500"))
+
+# --- Message Log Write-Behind Buffer ---
+# Chat messages are queued in memory and written as multi-row inserts once
+# either threshold is hit, instead of one insert per message.
+MESSAGE_BUFFER_MAX_ROWS = int(os.getenv("MESSAGE_BUFFER_MAX_ROWS", "50"))
+MESSAGE_BUFFER_FLUSH_SECONDS = float(os.getenv("MESSAGE_BUFFER_FLUSH_SECONDS", "0.5"))
+MESSAGE_BUFFER_MAX_RETRIES = int(os.getenv("MESSAGE_BUFFER_MAX_RETRIES", "3"))
+MESSAGE_BUFFER_MAX_PENDING = int(os.getenv("MESSAGE_BUFFER_MAX_PENDING", "10000"))
+# A row the database keeps rejecting while the rest of its batch is written (e.g. its
+# session was deleted) is logged and dropped after this many flushes.
+MESSAGE_BUFFER_MAX_ROW_FAILURES = int(os.getenv("MESSAGE_BUFFER_MAX_ROW_FAILURES", "3"))
+
+# --- Background Jobs ---
+# Summary and title generation run on an in-process worker pool so the
+# final triage reply is not held up by extra Gemini calls.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_RETRIES = int(os.getenv("JOB_MAX_RETRIES", "3"))
+
+# --- Active Session Cache ---
+# Live chats are kept in memory up to these limits. Evicted chats are rebuilt
+# from the session store (or, failing that, the database) on their next message.
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "1000"))
+SESSION_CACHE_MAX_BYTES = int(os.getenv("SESSION_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+SESSION_CACHE_IDLE_TTL_SECONDS = float(os.getenv("SESSION_CACHE_IDLE_TTL_SECONDS", "1800"))
+SESSION_CACHE_REAP_SECONDS = float(os.getenv("SESSION_CACHE_REAP_SECONDS", "60"))
+
+# --- Gemini Admission Control ---
+# Every Gemini call waits for a slot: at most GEMINI_MAX_CONCURRENT at once,
+# started no faster than GEMINI_RATE_PER_SECOND (0 for no rate limit) with
+# bursts of up to GEMINI_BURST, with GEMINI_EMERGENCY_RESERVE of the slots kept
+# for flagged emergencies. A patient's message that would wait longer than
+# GEMINI_QUEUE_DEADLINE_SECONDS is answered with 429 and Retry-After instead.
+GEMINI_MAX_CONCURRENT = int(os.getenv("GEMINI_MAX_CONCURRENT", "32"))
+GEMINI_RATE_PER_SECOND = float(os.getenv("GEMINI_RATE_PER_SECOND", "25"))
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", "50"))
+GEMINI_QUEUE_DEADLINE_SECONDS = float(os.getenv("GEMINI_QUEUE_DEADLINE_SECONDS", "10"))
+GEMINI_EMERGENCY_RESERVE = int(os.getenv("GEMINI_EMERGENCY_RESERVE", "2"))
+
+# --- External Call Resilience ---
+# Each Gemini attempt is cut off after GEMINI_TIMEOUT_SECONDS (for streamed
+# replies: to the first chunk, then between chunks). Failures that may pass
+# (timeouts, connection errors, 408/429/5xx) are retried up to *_MAX_ATTEMPTS
+# times with jittered exponential backoff, but only for calls that are safe to
+# repeat. With GEMINI_HEDGE_AFTER_SECONDS > 0, a Gemini call still unanswered
+# after that long gets a second, parallel attempt, for at most GEMINI_HEDGE_BUDGET
+# of all calls. After BREAKER_FAILURE_THRESHOLD failures in a row a backend's
+# circuit breaker opens and calls fail at once for BREAKER_RESET_SECONDS.
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "30"))
+GEMINI_MAX_ATTEMPTS = int(os.getenv("GEMINI_MAX_ATTEMPTS", "3"))
+GEMINI_HEDGE_AFTER_SECONDS = float(os.getenv("GEMINI_HEDGE_AFTER_SECONDS", "0"))
+GEMINI_HEDGE_BUDGET = float(os.getenv("GEMINI_HEDGE_BUDGET", "0.05"))
+DB_MAX_ATTEMPTS = int(os.getenv("DB_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY_SECONDS = float(os.getenv("RETRY_BASE_DELAY_SECONDS", "0.2"))
+RETRY_MAX_DELAY_SECONDS = float(os.getenv("RETRY_MAX_DELAY_SECONDS", "5"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+# --- Duplicate Message Coalescing ---
+# A /chat/message retry with the same Idempotency-Key gets the original reply
+# instead of a second Gemini call, while it is in flight and for
+# IDEMPOTENCY_TTL_SECONDS after. Without a key, an identical message joins one
+# that is still in flight.
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "600"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+
+# --- WebSocket Chat ---
+# /chat/ws sends a ping every WS_HEARTBEAT_SECONDS and closes a connection it
+# has heard nothing on for WS_IDLE_TIMEOUT_SECONDS. The last WS_REPLAY_EVENTS
+# events of a session are kept for WS_RESUME_SECONDS after it disconnects, so a
+# client that reconnects to the same worker gets what it missed. Run uvicorn with
+# --ws-per-message-deflate false: compression costs ~130 KB per open socket and
+# saves little on frames this small.
+WS_HEARTBEAT_SECONDS = float(os.getenv("WS_HEARTBEAT_SECONDS", "20"))
+WS_IDLE_TIMEOUT_SECONDS = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "60"))
+WS_RESUME_SECONDS = float(os.getenv("WS_RESUME_SECONDS", "120"))
+WS_REPLAY_EVENTS = int(os.getenv("WS_REPLAY_EVENTS", "1000"))
+
+# --- Session State Store ---
+# Each chat's state (history, rolling summary, ESI level) is saved after every
+# turn, so any worker or node can serve the next one. SESSION_STORE_URL is
+# memory:// (one process only: the session cache is the state, nothing is copied),
+# sqlite:///path/to/file.db (every worker on one host) or redis://host:6379/0
+# (every node).
+SESSION_STORE_URL = os.getenv("SESSION_STORE_URL", "memory://")
+SESSION_STORE_TTL_SECONDS = float(os.getenv("SESSION_STORE_TTL_SECONDS", str(24 * 3600)))
+SESSION_STORE_MAX_CONFLICT_RETRIES = int(os.getenv("SESSION_STORE_MAX_CONFLICT_RETRIES", "3"))
+
+# --- Image Preprocessing ---
+# Uploaded photos are orientation-fixed, downscaled and re-encoded in a
+# separate process pool before they are sent to Gemini and stored.
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "1536"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "WEBP")
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+
+# --- PDF Summary Cache ---
+# Rendered summary PDFs are kept in memory up to this many bytes.
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# --- PDF Rendering ---
+# PDFs are rendered in a separate process pool; bulk exports keep at most
+# PDF_EXPORT_WINDOW renders in flight per worker.
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+PDF_EXPORT_WINDOW = int(os.getenv("PDF_EXPORT_WINDOW", "4"))
+
+# --- Conversation Context Window ---
+# Only the newest CONTEXT_RECENT_TURNS exchanges are sent to Gemini verbatim;
+# older turns are folded into a rolling summary once the history outgrows
+# either budget.
+CONTEXT_RECENT_TURNS = int(os.getenv("CONTEXT_RECENT_TURNS", "6"))
+CONTEXT_MAX_CHARS = int(os.getenv("CONTEXT_MAX_CHARS", "12000"))
+
+# --- Model Routing and Token Budgets ---
+# Patient-facing turns and the clinical summary run on GEMINI_MODEL; the tasks
+# in LIGHT_MODEL_TASKS (titles, context folding) run on the smaller, faster
+# and cheaper GEMINI_LIGHT_MODEL. Every session counts its Gemini tokens and
+# time; once it has used SESSION_TOKEN_BUDGET tokens (0 for no budget), its
+# context window shrinks to the CONTEXT_BUDGET_* limits, so each further turn
+# sends a shorter history.
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+GEMINI_LIGHT_MODEL = os.getenv("GEMINI_LIGHT_MODEL", "gemini-2.5-flash-lite")
+LIGHT_MODEL_TASKS = os.getenv("LIGHT_MODEL_TASKS", "title,context")
+SESSION_TOKEN_BUDGET = int(os.getenv("SESSION_TOKEN_BUDGET", "50000"))
+CONTEXT_BUDGET_RECENT_TURNS = int(os.getenv("CONTEXT_BUDGET_RECENT_TURNS", "2"))
+CONTEXT_BUDGET_MAX_CHARS = int(os.getenv("CONTEXT_BUDGET_MAX_CHARS", "4000"))
+
+# --- Emergency Fast Path ---
+# Messages that clearly describe an ESI Level 1 emergency get the emergency
+# handover immediately from a local phrase matcher; Gemini confirms afterwards.
+EMERGENCY_FAST_PATH = os.getenv("EMERGENCY_FAST_PATH", "true").lower() == "true"
+
+# --- Triage Analytics ---
+# Daily session, message, ESI and time-to-triage counters are kept in memory
+# and merged into the ai_analytics_daily table every ANALYTICS_FLUSH_SECONDS.
+ANALYTICS_FLUSH_SECONDS = float(os.getenv("ANALYTICS_FLUSH_SECONDS", "30"))
+
+# --- Retention ---
+# The retention job deletes sessions older than SESSION_RETENTION_DAYS (0 keeps
+# them forever) together with their messages, and symptom images that no
+# message references any more, such as those of deleted sessions. It deletes
+# RETENTION_BATCH_SIZE sessions at a time, at most RETENTION_MAX_ROWS_PER_SECOND
+# rows and images a second, with up to RETENTION_STORAGE_CONCURRENCY storage
+# calls at once. Images written to storage less than RETENTION_IMAGE_GRACE_HOURS
+# ago are left alone, since the message that refers to one may not be written yet.
+# It runs every RETENTION_INTERVAL_HOURS (0 for only when started through
+# POST /internal/retention/run or `python retention.py`).
+SESSION_RETENTION_DAYS = int(os.getenv("SESSION_RETENTION_DAYS", "0"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "100"))
+RETENTION_MAX_ROWS_PER_SECOND = float(os.getenv("RETENTION_MAX_ROWS_PER_SECOND", "1000"))
+RETENTION_STORAGE_CONCURRENCY = int(os.getenv("RETENTION_STORAGE_CONCURRENCY", "4"))
+RETENTION_IMAGE_GRACE_HOURS = float(os.getenv("RETENTION_IMAGE_GRACE_HOURS", "24"))
+RETENTION_INTERVAL_HOURS = float(os.getenv("RETENTION_INTERVAL_HOURS", "0"))
+# A worker reuses a content-addressed image it wrote less than IMAGE_REFRESH_SECONDS
+# ago without uploading it; after that it writes it again, which refreshes the
+# object's updated_at, so images in use never look old to the retention job. Keep it
+# well under the grace period.
+IMAGE_REFRESH_SECONDS = float(os.getenv("IMAGE_REFRESH_SECONDS", "3600"))
+
+# --- Internal Endpoints ---
+# The /internal/* endpoints (stats, usage, analytics rebuild, retention run) need
+# an X-Internal-Token header equal to INTERNAL_API_TOKEN. Without a token they
+# are refused, except with USE_FAKE_BACKENDS for local runs and load tests.
+INTERNAL_API_TOKEN = os.getenv("INTERNAL_API_TOKEN", "")
+
+# --- Start-up ---
+# The Gemini and Supabase clients, the session store and the worker pools are
+# readied in the background after the server starts listening; /readyz reports
+# when they are. With STARTUP_WARMUP_BLOCKING=true the server waits for them
+# before it accepts any request instead.
+STARTUP_WARMUP_BLOCKING = os.getenv("STARTUP_WARMUP_BLOCKING", "false").lower() == "true"
+
+# --- Logging ---
+# Log records are queued and written by a background thread. LOG_FORMAT is
+# "json" (one object per line, for log shipping) or "text".
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+
+# --- Offline Fake Backends ---
+# With USE_FAKE_BACKENDS=true, Supabase and Gemini are replaced by the in-memory
+# stand-ins in fake_backends.py, so no keys or network are needed. For local
+# runs and load tests only.
+USE_FAKE_BACKENDS = os.getenv("USE_FAKE_BACKENDS", "false").lower() == "true"
+FAKE_DB_LATENCY_SECONDS = float(os.getenv("FAKE_DB_LATENCY_SECONDS", "0.02"))
+FAKE_LLM_LATENCY_SECONDS = float(os.getenv("FAKE_LLM_LATENCY_SECONDS", "0.8"))
+FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "80"))
+# The fake light model answers in this fraction of the fake standard model's time.
+FAKE_LLM_LIGHT_LATENCY_FACTOR = float(os.getenv("FAKE_LLM_LIGHT_LATENCY_FACTOR", "0.4"))
+# The fake model tags its reply with this ESI level (0 for never) from the
+# FAKE_LLM_ESI_AFTER_TURNS-th patient message on.
+FAKE_LLM_ESI_LEVEL = int(os.getenv("FAKE_LLM_ESI_LEVEL", "4"))
+FAKE_LLM_ESI_AFTER_TURNS = int(os.getenv("FAKE_LLM_ESI_AFTER_TURNS", "3"))
+# Fault injection: the share of fake calls that fail with a 503, hang for
+# FAKE_HANG_SECONDS, or take FAKE_SLOW_FACTOR times their usual latency.
+FAKE_DB_ERROR_RATE = float(os.getenv("FAKE_DB_ERROR_RATE", "0"))
+FAKE_DB_HANG_RATE = float(os.getenv("FAKE_DB_HANG_RATE", "0"))
+FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+FAKE_LLM_HANG_RATE = float(os.getenv("FAKE_LLM_HANG_RATE", "0"))
+FAKE_LLM_SLOW_RATE = float(os.getenv("FAKE_LLM_SLOW_RATE", "0"))
+FAKE_SLOW_FACTOR = float(os.getenv("FAKE_SLOW_FACTOR", "10"))
+FAKE_HANG_SECONDS = float(os.getenv("FAKE_HANG_SECONDS", "120"))
+
 
 # --- Sanity Check ---
 # We add a check to ensure the application fails loudly and early
-# if any of the required secret keys are missing.
-if not GEMINI_API_KEY:
-    raise ValueError("Missing required environment variable: GEMINI_API_KEY")
-if not SUPABASE_URL:
-    raise ValueError("Missing required environment variable: SUPABASE_URL")
-if not SUPABASE_KEY:
-    raise ValueError("Missing required environment variable: SUPABASE_KEY")
\ No newline at end of file
+# if any of the required secret keys are missing. The fake backends need none.
+if not USE_FAKE_BACKENDS:
+    if not GEMINI_API_KEY:
+        raise ValueError("Missing required environment variable: GEMINI_API_KEY")
+    if not SUPABASE_URL:
+        raise ValueError("Missing required environment variable: SUPABASE_URL")
+    if not SUPABASE_KEY:
+        raise ValueError("Missing required environment variable: SUPABASE_KEY")
\ No newline at end of file
@@ -0,0 +1,53 @@
+# ai_assistant/context_window.py
+
+from config import CONTEXT_RECENT_TURNS, CONTEXT_MAX_CHARS
+
+# Gemini bills roughly one token per four characters of English text.
+CHARS_PER_TOKEN = 4
+
+# Opens the prompt when older turns have been folded into a summary. The model
+# entry that follows keeps the history alternating user/model.
+SUMMARY_PREAMBLE = "[Summary of the earlier part of this conversation]\n"
+SUMMARY_ACK = "Understood. I will continue the triage with that in mind."
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def history_chars(history: list[tuple]) -> int:
+    return sum(len(text) for _, text, _ in history)
+
+def fold_point(history: list[tuple], recent_turns: int = CONTEXT_RECENT_TURNS,
+               max_chars: int = CONTEXT_MAX_CHARS) -> int:
+    """
+    How many leading history entries should be folded into the rolling summary:
+    0 while the history fits both the turn and the character budget, otherwise
+    everything but the newest `recent_turns` exchanges (fewer if those alone are
+    over `max_chars`, but always the last exchange). The point falls on a user
+    entry so the kept window starts the way Gemini expects.
+    """
+    keep_entries = recent_turns * 2
+    if len(history) <= keep_entries and history_chars(history) <= max_chars:
+        return 0
+
+    point = max(len(history) - keep_entries, 0)
+    kept_chars = history_chars(history[point:])
+    while kept_chars > max_chars and point < len(history) - 2:
+        kept_chars -= len(history[point][1])
+        point += 1
+
+    # Never split an exchange: move back to the user entry that opened it.
+    while point > 0 and history[point][0] != "user":
+        point -= 1
+    return point
+
+def format_transcript(entries: list[tuple]) -> str:
+    return "\n".join(
+        f"{'Patient' if role == 'user' else 'Nurse'}: {text}" + (" [sent a photo]" if image else "")
+        for role, text, image in entries
+    )
+
+def summary_entries(summary: str | None) -> list[tuple]:
+    """The synthetic exchange that carries the rolling summary into a chat's history."""
+    if not summary:
+        return []
+    return [("user", SUMMARY_PREAMBLE + summary, None), ("model", SUMMARY_ACK, None)]
@@ -1,122 +1,737 @@
 # ai_assistant/database_service.py
 
-import supabase
+import asyncio
+import base64
+import functools
+import json
+import threading
+import time
 import uuid
 import pytz
-from config import SUPABASE_URL, SUPABASE_KEY
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from config import (SUPABASE_URL, SUPABASE_KEY, DB_MAX_WORKERS, DB_TIMEOUT_SECONDS,
+                    USE_FAKE_BACKENDS, FAKE_DB_LATENCY_SECONDS, FAKE_DB_ERROR_RATE, FAKE_DB_HANG_RATE,
+                    FAKE_HANG_SECONDS, IMAGE_REFRESH_SECONDS)
 from datetime import datetime
+from metrics import timed
+from read_cache import ReadThroughCache
+from resilience import supabase as supabase_service
+from structured_log import get_logger
 
-try:
-    supabase_client: supabase.Client = supabase.create_client(SUPABASE_URL, SUPABASE_KEY)
-    print("Successfully connected to Supabase.")
-except Exception as e:
-    print(f"Error connecting to Supabase: {e}")
-    supabase_client = None
+log = get_logger(__name__)
 
+# Created by connect() on first use, or by the start-up warm-up.
+supabase_client = None
+_connect_lock = threading.Lock()
+
+def connect():
+    """
+    Returns the Supabase client, creating it if need be. Importing the client library
+    and building the client are a noticeable share of start-up, so neither happens at
+    import. Returns None if the client can't be created; the error is logged, and the
+    next call tries again.
+    """
+    global supabase_client
+    if supabase_client is not None:
+        return supabase_client
+    with _connect_lock:
+        if supabase_client is not None:
+            return supabase_client
+        try:
+            if USE_FAKE_BACKENDS:
+                from fake_backends import FakeSupabaseClient, FaultInjector
+                supabase_client = FakeSupabaseClient(latency=FAKE_DB_LATENCY_SECONDS, faults=FaultInjector(
+                    "supabase", error_rate=FAKE_DB_ERROR_RATE, hang_rate=FAKE_DB_HANG_RATE, hang_seconds=FAKE_HANG_SECONDS,
+                ))
+                log.info("Using the in-memory fake Supabase client.")
+            else:
+                import supabase
+                # The client keeps one pooled HTTP connection that every worker thread below reuses.
+                supabase_client = supabase.create_client(
+                    SUPABASE_URL, SUPABASE_KEY,
+                    options=supabase.ClientOptions(
+                        postgrest_client_timeout=DB_TIMEOUT_SECONDS,
+                        storage_client_timeout=DB_TIMEOUT_SECONDS,
+                    ),
+                )
+                log.info("Successfully connected to Supabase.")
+        except Exception as e:
+            log.error("Error connecting to Supabase", extra={"error": str(e)})
+        return supabase_client
+
+def _execute(query, idempotent: bool = True):
+    """
+    Runs a PostgREST query through the Supabase circuit breaker. Reads, updates and
+    deletes by key are retried on transient errors; inserts are not, since a retry
+    after a lost response would write the rows twice.
+    """
+    return supabase_service.call_sync(query.execute, idempotent=idempotent)
+
+# Process-local read caches. Every write below invalidates what it changes; other
+# workers' writes become visible when the TTL expires.
+session_details_cache = ReadThroughCache("session_details")
+user_sessions_cache = ReadThroughCache("user_sessions")
+
+# Entries are keyed by (session_id or user_id, page size, cursor).
+def _invalidate_messages(session_id: str):
+    session_details_cache.invalidate_where(lambda key, _: key[0] == session_id)
+
+def _invalidate_user_sessions(user_id: str):
+    user_sessions_cache.invalidate_where(lambda key, _: key[0] == user_id)
+
+def _invalidate_session(session_id: str):
+    _invalidate_messages(session_id)
+    user_sessions_cache.invalidate_where(lambda _, page: any(s.get("id") == session_id for s in page["sessions"]))
+
+# --- Keyset Cursors ---
+# A cursor is the (timestamp, id) of the last row on a page, so the next page is
+# an index range scan that costs the same however deep the user has scrolled.
+
+def encode_cursor(timestamp: str, row_id) -> str:
+    return base64.urlsafe_b64encode(json.dumps([timestamp, str(row_id)]).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    """Raises ValueError for a malformed cursor."""
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(timestamp), str(row_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def _before(column: str, cursor: str) -> str:
+    """PostgREST filter for rows that sort before the cursor in descending (column, id) order."""
+    timestamp, row_id = decode_cursor(cursor)
+    return f'{column}.lt."{timestamp}",and({column}.eq."{timestamp}",id.lt."{row_id}")'
+
+def _after(column: str, timestamp: str, row_id) -> str:
+    """PostgREST filter for rows that sort after (timestamp, row_id) in ascending (column, id) order."""
+    return f'{column}.gt."{timestamp}",and({column}.eq."{timestamp}",id.gt."{row_id}")'
+
+@timed("db_insert")
 def create_session(user_id: str) -> str | None:
-    if not supabase_client: return None
+    if not connect(): return None
     try:
-        response = supabase_client.table("ai_sessions").insert({"user_id": user_id}).execute()
+        response = _execute(supabase_client.table("ai_sessions").insert({"user_id": user_id}), idempotent=False)
+        _invalidate_user_sessions(user_id)
         if response.data:
             session_id = response.data[0]['id']
-            print(f"Created new AI session with ID: {session_id}")
+            log.info("Created new AI session", extra={"session_id": session_id, "user_id": user_id})
             return session_id
         return None
     except Exception as e:
-        print(f"Error creating AI session in database: {e}")
+        log.error("Error creating AI session in database", extra={"user_id": user_id, "error": str(e)})
         return None
 
+@timed("db_insert")
 def log_message(session_id: str, sender: str, message_content: str, image_url: str | None = None):
-    if not supabase_client: return
+    if not connect(): return
     try:
-        supabase_client.table("ai_messages").insert({
+        _execute(supabase_client.table("ai_messages").insert({
             "session_id": session_id, "sender": sender,
             "message_content": message_content, "image_url": image_url
-        }).execute()
+        }), idempotent=False)
+        _invalidate_messages(session_id)
+    except Exception as e:
+        log.error("Error logging AI message to database", extra={"session_id": session_id, "error": str(e)})
+
+@timed("db_insert")
+def log_messages(rows: list[dict]) -> bool:
+    """Inserts several ai_messages rows in one request. Returns False so callers can retry."""
+    if not connect(): return False
+    try:
+        _execute(supabase_client.table("ai_messages").insert(rows), idempotent=False)
+        for session_id in {row["session_id"] for row in rows}:
+            _invalidate_messages(session_id)
+        return True
     except Exception as e:
-        print(f"Error logging AI message to database: {e}")
+        log.error("Error logging AI messages to database", extra={"rows": len(rows), "error": str(e)})
+        return False
 
-def update_session_esi_level(session_id: str, esi_level: int):
-    if not supabase_client: return
+@timed("db_update")
+def update_session_esi_level(session_id: str, esi_level: int) -> bool:
+    if not connect(): return False
     try:
-        supabase_client.table("ai_sessions").update({"final_esi_level": esi_level}).eq("id", session_id).execute()
-        print(f"Updated AI session {session_id} with ESI level {esi_level}.")
+        _execute(supabase_client.table("ai_sessions").update({"final_esi_level": esi_level}).eq("id", session_id))
+        _invalidate_session(session_id)
+        log.info("Updated AI session ESI level", extra={"session_id": session_id, "esi_level": esi_level})
+        return True
     except Exception as e:
-        print(f"Error updating AI session ESI level: {e}")
+        log.error("Error updating AI session ESI level", extra={"session_id": session_id, "error": str(e)})
+        return False
 
-def update_session_summary(session_id: str, summary_text: str):
-    if not supabase_client: return
+@timed("db_update")
+def reopen_session_triage(session_id: str) -> bool:
+    """Clears a session's ESI level and summary, e.g. after Gemini overruled the emergency fast path."""
+    if not connect(): return False
     try:
-        supabase_client.table("ai_sessions").update({
+        _execute(supabase_client.table("ai_sessions").update(
+            {"final_esi_level": None, "session_summary": None, "has_summary": False}
+        ).eq("id", session_id))
+        _invalidate_session(session_id)
+        log.info("Reopened AI session triage", extra={"session_id": session_id})
+        return True
+    except Exception as e:
+        log.error("Error reopening AI session triage", extra={"session_id": session_id, "error": str(e)})
+        return False
+
+@timed("db_update")
+def update_session_summary(session_id: str, summary_text: str) -> bool:
+    """
+    Saves the session's summary, but only while the session has an ESI level, so a
+    summary that finishes after the triage was reopened can't be saved over the
+    cleared one. Returns False if nothing was saved.
+    """
+    if not connect(): return False
+    try:
+        response = _execute(supabase_client.table("ai_sessions").update({
             "session_summary": summary_text,
             "has_summary": True
-        }).eq("id", session_id).execute()
-        print(f"Updated AI session {session_id} with summary.")
+        }).eq("id", session_id).not_.is_("final_esi_level", "null"))
+        _invalidate_session(session_id)
+        if not response.data:
+            return False
+        log.info("Updated AI session summary", extra={"session_id": session_id})
+        return True
     except Exception as e:
-        print(f"Error updating AI session summary: {e}")
+        log.error("Error updating AI session summary", extra={"session_id": session_id, "error": str(e)})
+        return False
 
-def get_session_details(session_id: str) -> dict | None:
-    if not supabase_client: return None
+def get_session_details(session_id: str, limit: int | None = None, cursor: str | None = None) -> dict | None:
+    """
+    Session fields plus its messages in chronological order. With `limit`, only the
+    most recent `limit` messages older than `cursor` are returned, and `next_cursor`
+    points at the page before them (None on the first message). Without `limit`, the
+    whole history is returned. Cached; the result must not be modified.
+    """
+    if cursor is not None:
+        decode_cursor(cursor)
+    return session_details_cache.get_or_load(
+        (session_id, limit, cursor), lambda: _fetch_session_details(session_id, limit, cursor)
+    )
+
+@timed("db_select")
+def _fetch_session_details(session_id: str, limit: int | None, cursor: str | None) -> dict | None:
+    if not connect(): return None
     try:
-        session_response = supabase_client.table("ai_sessions").select(
-            "session_summary, user_id, final_esi_level"
-        ).eq("id", session_id).single().execute()
+        # One round-trip: the messages come back embedded through the ai_messages foreign key.
+        query = supabase_client.table("ai_sessions").select(
+            "session_summary, user_id, created_at, final_esi_level, context_summary, context_summary_turns, llm_usage, ai_messages(id, sender, message_content, image_url, timestamp)"
+        ).eq("id", session_id)
+        if limit is None:
+            query = query.order("timestamp", desc=False, foreign_table="ai_messages")
+        else:
+            # Newest first so the page is the latest `limit` messages; one extra row tells us if there are more.
+            query = query.order("timestamp", desc=True, foreign_table="ai_messages").order(
+                "id", desc=True, foreign_table="ai_messages"
+            ).limit(limit + 1, foreign_table="ai_messages")
+            if cursor:
+                query = query.or_(_before("timestamp", cursor), reference_table="ai_messages")
+        response = _execute(query.maybe_single())
 
-        if not session_response.data:
+        if not response or not response.data:
             return None
 
-        session_data = session_response.data
-
-        messages_response = supabase_client.table("ai_messages").select(
-            "sender, message_content, image_url"
-        ).eq("session_id", session_id).order("timestamp", desc=False).execute()
+        session_data = response.data
+        rows = session_data.pop('ai_messages', None) or []
+        session_data['next_cursor'] = None
+        if limit is not None:
+            if len(rows) > limit:
+                rows = rows[:limit]
+                session_data['next_cursor'] = encode_cursor(rows[-1]['timestamp'], rows[-1]['id'])
+            rows.reverse()
 
         session_data['messages'] = [
             {"type": row['sender'], "text": row['message_content'], "imageUrl": row.get('image_url')} 
-            for row in messages_response.data
+            for row in rows
         ]
 
         return session_data
     except Exception as e:
-        print(f"Error fetching session details: {e}")
+        log.error("Error fetching session details", extra={"session_id": session_id, "error": str(e)})
         return None
 
-def get_sessions_for_user(user_id: str) -> list[dict] | None:
-    if not supabase_client: return None
+@timed("db_select")
+def get_session_summary(session_id: str) -> dict | None:
+    """Fetches only what the summary PDF prints, without the message history."""
+    if not connect(): return None
     try:
-        response = supabase_client.table("ai_sessions").select(
-            "id, title, created_at, session_summary, final_esi_level, has_summary"
-            ).eq("user_id", user_id).order("created_at", desc=True).execute()
+        response = _execute(supabase_client.table("ai_sessions").select(
+            "session_summary, user_id"
+        ).eq("id", session_id).maybe_single())
+        return response.data if response else None
+    except Exception as e:
+        log.error("Error fetching session summary", extra={"session_id": session_id, "error": str(e)})
+        return None
 
-        return response.data
+# PostgREST caps rows per response (1000 by default), so large reads are fetched in pages.
+_PAGE_SIZE = 1000
+
+@timed("db_select")
+def get_session_summaries(user_id: str | None = None, session_ids: list[str] | None = None,
+                          created_from: str | None = None, created_to: str | None = None) -> list[dict] | None:
+    """
+    Fetches the summaries of every summarized session that matches the filters, for
+    bulk PDF export. Returns rows with id, user_id, session_summary and created_at.
+    """
+    if not connect(): return None
+    try:
+        rows = []
+        while True:
+            query = supabase_client.table("ai_sessions").select(
+                "id, user_id, session_summary, created_at"
+            ).eq("has_summary", True)
+            if user_id:
+                query = query.eq("user_id", user_id)
+            if session_ids:
+                query = query.in_("id", session_ids)
+            if created_from:
+                query = query.gte("created_at", created_from)
+            if created_to:
+                query = query.lt("created_at", created_to)
+            page = _execute(query.order("created_at").order("id").range(len(rows), len(rows) + _PAGE_SIZE - 1)).data
+            rows.extend(page)
+            if len(page) < _PAGE_SIZE:
+                return rows
     except Exception as e:
-        print(f"Error fetching AI sessions for user: {e}")
+        log.error("Error fetching session summaries for export", extra={"error": str(e)})
         return None
 
+def get_sessions_for_user(user_id: str, limit: int | None, cursor: str | None = None) -> dict | None:
+    """
+    One page of the user's sessions, newest first, as {"sessions": [...], "next_cursor": ...}.
+    Without `limit`, every session is returned. Only the columns the sidebar needs are
+    read; summaries are fetched when a session is opened. Cached; the result must not be modified.
+    """
+    if cursor is not None:
+        decode_cursor(cursor)
+    return user_sessions_cache.get_or_load(
+        (user_id, limit, cursor), lambda: _fetch_sessions_for_user(user_id, limit, cursor)
+    )
+
+@timed("db_select")
+def _fetch_sessions_for_user(user_id: str, limit: int | None, cursor: str | None) -> dict | None:
+    if not connect(): return None
+
+    def newest_first():
+        query = supabase_client.table("ai_sessions").select(
+            "id, title, created_at, final_esi_level, has_summary"
+            ).eq("user_id", user_id)
+        if cursor:
+            query = query.or_(_before("created_at", cursor))
+        return query.order("created_at", desc=True).order("id", desc=True)
+
+    try:
+        if limit is None:
+            sessions = []
+            while True:
+                page = _execute(newest_first().range(len(sessions), len(sessions) + _PAGE_SIZE - 1)).data
+                sessions.extend(page)
+                if len(page) < _PAGE_SIZE:
+                    return {"sessions": sessions, "next_cursor": None}
+
+        sessions = _execute(newest_first().limit(limit + 1)).data
+        next_cursor = None
+        if len(sessions) > limit:
+            sessions = sessions[:limit]
+            next_cursor = encode_cursor(sessions[-1]['created_at'], sessions[-1]['id'])
+        return {"sessions": sessions, "next_cursor": next_cursor}
+    except Exception as e:
+        log.error("Error fetching AI sessions for user", extra={"user_id": user_id, "error": str(e)})
+        return None
+
+@timed("db_delete")
 def delete_session_from_db(session_id: str) -> bool:
-    if not supabase_client: return False
+    if not connect(): return False
     try:
-        response = supabase_client.table("ai_sessions").delete().eq("id", session_id).execute()
+        response = _execute(supabase_client.table("ai_sessions").delete().eq("id", session_id))
+        _invalidate_session(session_id)
         return bool(response.data)
     except Exception as e:
-        print(f"Error deleting AI session: {e}")
+        log.error("Error deleting AI session", extra={"session_id": session_id, "error": str(e)})
         return False
 
-def upload_image(file_bytes: bytes, content_type: str) -> str | None:
-    if not supabase_client: return None
+@timed("image_upload")
+def upload_image(file_bytes: bytes, content_type: str, file_name: str | None = None) -> str | None:
+    """
+    Uploads an image and returns its public URL. Pass a content-hash `file_name` to
+    deduplicate: the object is shared by every message with the same image, and this
+    process only uploads it again once it last wrote it IMAGE_REFRESH_SECONDS ago.
+    Writing it again (an upsert) moves its updated_at, which the retention job goes
+    by, so an image that is still being reused is never deleted as old.
+    """
+    if not connect(): return None
     try:
-        file_name = f"img_{uuid.uuid4()}"
-        bucket_name = "symptom-images"
-        supabase_client.storage.from_(bucket_name).upload(file=file_bytes, path=file_name, file_options={"content-type": content_type})
+        content_addressed = file_name is not None
+        file_name = file_name or f"img_{uuid.uuid4()}"
+        bucket_name = IMAGE_BUCKET
+        if not (content_addressed and _written_recently(file_name)):
+            # Retrying a content-hash upsert is safe: it writes the same bytes again.
+            supabase_service.call_sync(
+                lambda: supabase_client.storage.from_(bucket_name).upload(
+                    file=file_bytes, path=file_name,
+                    file_options={"content-type": content_type, "upsert": "true" if content_addressed else "false"}),
+                idempotent=content_addressed,
+            )
+            if content_addressed:
+                _remember_upload(file_name)
         return supabase_client.storage.from_(bucket_name).get_public_url(file_name)
     except Exception as e:
-        print(f"Error uploading image to Supabase Storage: {e}")
+        log.error("Error uploading image to Supabase Storage", extra={"error": str(e)})
         return None
+
+# Content-addressed images this process wrote, with when (time.time()), so repeats
+# within IMAGE_REFRESH_SECONDS skip the upload.
+_uploaded_images: OrderedDict[str, float] = OrderedDict()
+_uploaded_images_lock = threading.Lock()
+_UPLOADED_IMAGES_MAX = 10_000
+
+def _written_recently(file_name: str) -> bool:
+    with _uploaded_images_lock:
+        written_at = _uploaded_images.get(file_name)
+        if written_at is None:
+            return False
+        if time.time() - written_at < IMAGE_REFRESH_SECONDS:
+            return True
+        del _uploaded_images[file_name]
+        return False
+
+def _remember_upload(file_name: str):
+    with _uploaded_images_lock:
+        _uploaded_images[file_name] = time.time()
+        _uploaded_images.move_to_end(file_name)
+        if len(_uploaded_images) > _UPLOADED_IMAGES_MAX:
+            _uploaded_images.popitem(last=False)
     
+@timed("db_update")
 def update_session_title(session_id: str, title: str):
-    if not supabase_client: return
+    if not connect(): return
+    try:
+        _execute(supabase_client.table("ai_sessions").update({"title": title}).eq("id", session_id))
+        _invalidate_session(session_id)
+        log.info("Updated session title", extra={"session_id": session_id})
+    except Exception as e:
+        log.error("Error updating session title", extra={"session_id": session_id, "error": str(e)})
+
+@timed("db_update")
+def update_session_context(session_id: str, summary: str, summarized_turns: int):
+    """Saves the rolling context summary and how many history entries it covers."""
+    if not connect(): return
+    try:
+        _execute(supabase_client.table("ai_sessions").update(
+            {"context_summary": summary, "context_summary_turns": summarized_turns}
+        ).eq("id", session_id))
+        _invalidate_messages(session_id)
+    except Exception as e:
+        log.error("Error updating session context summary", extra={"session_id": session_id, "error": str(e)})
+
+# --- LLM Usage ---
+# Each session's Gemini usage (llm_usage.py), with its token and time totals in
+# their own columns so the heaviest sessions can be listed from an index. The
+# columns and indexes are added by database/migrations/0001_ai_assistant_sessions.sql.
+
+USAGE_ORDERS = {"tokens": "llm_tokens", "seconds": "llm_seconds"}
+
+@timed("db_update")
+def update_session_usage(session_id: str, usage: dict) -> bool:
+    """Saves a session's Gemini usage, as returned by SessionUsage.to_dict()."""
+    if not connect(): return False
+    try:
+        _execute(supabase_client.table("ai_sessions").update(
+            {"llm_usage": usage, "llm_tokens": usage["total_tokens"], "llm_seconds": usage["seconds"]}
+        ).eq("id", session_id))
+        _invalidate_messages(session_id)
+        return True
+    except Exception as e:
+        log.error("Error updating session usage", extra={"session_id": session_id, "error": str(e)})
+        return False
+
+@timed("db_select")
+def get_top_usage_sessions(order: str, limit: int) -> list[dict] | None:
+    """The `limit` sessions that used the most Gemini tokens (order="tokens") or time (order="seconds")."""
+    if not connect(): return None
+    try:
+        return _execute(supabase_client.table("ai_sessions").select(
+            "id, user_id, created_at, title, final_esi_level, llm_tokens, llm_seconds, llm_usage"
+        ).order(USAGE_ORDERS[order], desc=True).limit(limit)).data
+    except Exception as e:
+        log.error("Error fetching sessions by usage", extra={"order": order, "error": str(e)})
+        return None
+
+# --- Retention ---
+# Bulk reads and deletes for the retention job (retention.py). Each call is one
+# bounded request; the job decides how many to make and how fast.
+
+IMAGE_BUCKET = "symptom-images"
+
+def image_name(image_url: str) -> str:
+    """The storage object name behind a public image URL."""
+    return image_url.split("?", 1)[0].rsplit("/", 1)[-1]
+
+@timed("db_select")
+def get_expired_sessions(created_before: str, limit: int, after: tuple[str, str] | None = None) -> list[dict] | None:
+    """
+    Up to `limit` sessions created before `created_before`, oldest first, as rows with
+    id and created_at. `after` is the (created_at, id) of the last row of the previous
+    batch, so each batch is an index range scan on (created_at, id).
+    """
+    if not connect(): return None
+    try:
+        query = supabase_client.table("ai_sessions").select("id, created_at").lt("created_at", created_before)
+        if after:
+            # The gte is implied by the or_, but it gives the index scan its starting point.
+            query = query.gte("created_at", after[0]).or_(_after("created_at", *after))
+        return _execute(query.order("created_at").order("id").limit(limit)).data
+    except Exception as e:
+        log.error("Error scanning for expired sessions", extra={"error": str(e)})
+        return None
+
+@timed("db_select")
+def get_session_image_urls(session_ids: list[str]) -> set[str] | None:
+    """The distinct image URLs referenced by the messages of these sessions."""
+    if not connect(): return None
+    try:
+        urls, offset = set(), 0
+        while True:
+            page = _execute(supabase_client.table("ai_messages").select("image_url")
+                            .in_("session_id", session_ids).not_.is_("image_url", "null")
+                            .order("id").range(offset, offset + _PAGE_SIZE - 1)).data
+            urls.update(row["image_url"] for row in page)
+            offset += len(page)
+            if len(page) < _PAGE_SIZE:
+                return urls
+    except Exception as e:
+        log.error("Error fetching image URLs of sessions", extra={"error": str(e)})
+        return None
+
+@timed("db_select")
+def count_session_messages(session_ids: list[str]) -> int | None:
+    if not connect(): return None
+    try:
+        return _execute(supabase_client.table("ai_messages").select("id", count="exact", head=True)
+                        .in_("session_id", session_ids)).count or 0
+    except Exception as e:
+        log.error("Error counting session messages", extra={"error": str(e)})
+        return None
+
+@timed("db_delete")
+def delete_sessions(session_ids: list[str]) -> tuple[int, int] | None:
+    """
+    Deletes these sessions and their messages, two statements in all, and returns
+    (sessions deleted, messages deleted). Messages go first, so an interrupted call
+    never leaves messages whose session is gone, and the cascade has nothing left to do.
+    """
+    if not connect(): return None
+    try:
+        messages = _execute(supabase_client.table("ai_messages").delete(count="exact", returning="minimal")
+                            .in_("session_id", session_ids)).count or 0
+        sessions = _execute(supabase_client.table("ai_sessions").delete(count="exact", returning="minimal")
+                            .in_("id", session_ids)).count or 0
+        deleted = set(session_ids)
+        session_details_cache.invalidate_where(lambda key, _: key[0] in deleted)
+        user_sessions_cache.invalidate_where(lambda _, page: any(s.get("id") in deleted for s in page["sessions"]))
+        return sessions, messages
+    except Exception as e:
+        log.error("Error deleting expired sessions", extra={"sessions": len(session_ids), "error": str(e)})
+        return None
+
+@timed("db_select")
+def get_referenced_image_urls(image_urls: list[str], exclude_sessions: set[str] = frozenset()) -> set[str] | None:
+    """Which of these image URLs a message outside `exclude_sessions` references."""
+    if not connect(): return None
+    try:
+        referenced, offset = set(), 0
+        while True:
+            page = _execute(supabase_client.table("ai_messages").select("session_id, image_url")
+                            .in_("image_url", image_urls).order("id").range(offset, offset + _PAGE_SIZE - 1)).data
+            referenced.update(row["image_url"] for row in page if row["session_id"] not in exclude_sessions)
+            offset += len(page)
+            if len(page) < _PAGE_SIZE:
+                return referenced
+    except Exception as e:
+        log.error("Error checking image references", extra={"error": str(e)})
+        return None
+
+def list_images(limit: int, offset: int) -> list[dict] | None:
+    """One page of the image bucket, sorted by name, as storage objects with name, created_at and updated_at."""
+    if not connect(): return None
+    try:
+        return supabase_service.call_sync(lambda: supabase_client.storage.from_(IMAGE_BUCKET).list(
+            options={"limit": limit, "offset": offset, "sortBy": {"column": "name", "order": "asc"}}))
+    except Exception as e:
+        log.error("Error listing stored images", extra={"error": str(e)})
+        return None
+
+def public_image_url(file_name: str) -> str:
+    return supabase_client.storage.from_(IMAGE_BUCKET).get_public_url(file_name)
+
+@timed("image_delete")
+def delete_images(file_names: list[str]) -> int | None:
+    """Removes these objects from the image bucket; returns how many existed."""
+    if not connect(): return None
     try:
-        supabase_client.table("ai_sessions").update({"title": title}).eq("id", session_id).execute()
-        print(f"Updated session {session_id} with new title.")
+        with _uploaded_images_lock:
+            for file_name in file_names:
+                _uploaded_images.pop(file_name, None)
+        removed = supabase_service.call_sync(lambda: supabase_client.storage.from_(IMAGE_BUCKET).remove(file_names))
+        return len(removed or [])
     except Exception as e:
-        print(f"Error updating session title: {e}")
\ No newline at end of file
+        log.error("Error deleting stored images", extra={"images": len(file_names), "error": str(e)})
+        return None
+
+# --- Triage Analytics ---
+# Daily counters for the analytics endpoint (analytics.py), one row per UTC day:
+#   ai_analytics_daily(day date primary key, counters jsonb not null, version int not null)
+# `version` goes up with every write, so concurrent writers can compare-and-set.
+# The table is created by database/migrations/0001_ai_assistant_sessions.sql.
+
+@timed("db_select")
+def get_analytics_days(first_day: str, last_day: str) -> list[dict] | None:
+    """The stored rows (day, counters, version) for the days from `first_day` to `last_day`, inclusive."""
+    if not connect(): return None
+    try:
+        return _execute(supabase_client.table("ai_analytics_daily").select("day, counters, version")
+                        .gte("day", first_day).lte("day", last_day).order("day")).data
+    except Exception as e:
+        log.error("Error fetching analytics", extra={"error": str(e)})
+        return None
+
+@timed("db_update")
+def save_analytics_day(day: str, counters: dict, version: int) -> bool:
+    """
+    Writes a day's counters if its row is still at `version` (0 for a day with no row
+    yet). Returns False if another writer got there first, or on an error.
+    """
+    if not connect(): return False
+    try:
+        if version == 0:
+            _execute(supabase_client.table("ai_analytics_daily").insert(
+                {"day": day, "counters": counters, "version": 1}), idempotent=False)
+            return True
+        response = _execute(supabase_client.table("ai_analytics_daily").update(
+            {"counters": counters, "version": version + 1}).eq("day", day).eq("version", version))
+        return bool(response.data)
+    except Exception as e:
+        log.error("Error saving analytics", extra={"day": day, "error": str(e)})
+        return False
+
+@timed("db_select")
+def scan_sessions(before: str, limit: int, after: tuple[str, str] | None = None) -> list[dict] | None:
+    """Up to `limit` sessions created before `before`, in (created_at, id) order, for rebuilding the analytics."""
+    if not connect(): return None
+    try:
+        query = supabase_client.table("ai_sessions").select("id, created_at, final_esi_level").lt("created_at", before)
+        if after:
+            query = query.gte("created_at", after[0]).or_(_after("created_at", *after))
+        return _execute(query.order("created_at").order("id").limit(limit)).data
+    except Exception as e:
+        log.error("Error scanning sessions", extra={"error": str(e)})
+        return None
+
+@timed("db_select")
+def scan_message_times(before: str, limit: int, after_id=None) -> list[dict] | None:
+    """Up to `limit` messages sent before `before`, as id and timestamp in id order."""
+    if not connect(): return None
+    try:
+        query = supabase_client.table("ai_messages").select("id, timestamp").lt("timestamp", before)
+        if after_id is not None:
+            query = query.gt("id", after_id)
+        return _execute(query.order("id").limit(limit)).data
+    except Exception as e:
+        log.error("Error scanning messages", extra={"error": str(e)})
+        return None
+
+@timed("db_select")
+def get_bot_messages(session_ids: list[str]) -> list[dict] | None:
+    """The bot's messages in these sessions (session_id, message_content, timestamp), oldest first."""
+    if not connect(): return None
+    try:
+        rows = []
+        while True:
+            page = _execute(supabase_client.table("ai_messages").select("session_id, message_content, timestamp")
+                            .in_("session_id", session_ids).eq("sender", "bot")
+                            .order("timestamp").order("id").range(len(rows), len(rows) + _PAGE_SIZE - 1)).data
+            rows.extend(page)
+            if len(page) < _PAGE_SIZE:
+                return rows
+    except Exception as e:
+        log.error("Error fetching bot messages", extra={"error": str(e)})
+        return None
+
+# --- Async API ---
+# The Supabase client is synchronous. These wrappers run each call on a bounded
+# thread pool so a slow round-trip never blocks the event loop for other users.
+
+_db_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="supabase")
+
+async def _run_in_pool(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(func, *args, **kwargs))
+
+async def create_session_async(user_id: str) -> str | None:
+    return await _run_in_pool(create_session, user_id)
+
+async def log_message_async(session_id: str, sender: str, message_content: str, image_url: str | None = None):
+    await _run_in_pool(log_message, session_id, sender, message_content, image_url)
+
+async def log_messages_async(rows: list[dict]) -> bool:
+    return await _run_in_pool(log_messages, rows)
+
+async def update_session_esi_level_async(session_id: str, esi_level: int) -> bool:
+    return await _run_in_pool(update_session_esi_level, session_id, esi_level)
+
+async def reopen_session_triage_async(session_id: str) -> bool:
+    return await _run_in_pool(reopen_session_triage, session_id)
+
+async def update_session_summary_async(session_id: str, summary_text: str) -> bool:
+    return await _run_in_pool(update_session_summary, session_id, summary_text)
+
+async def update_session_title_async(session_id: str, title: str):
+    await _run_in_pool(update_session_title, session_id, title)
+
+async def update_session_context_async(session_id: str, summary: str, summarized_turns: int):
+    await _run_in_pool(update_session_context, session_id, summary, summarized_turns)
+
+async def update_session_usage_async(session_id: str, usage: dict) -> bool:
+    return await _run_in_pool(update_session_usage, session_id, usage)
+
+async def get_top_usage_sessions_async(order: str, limit: int) -> list[dict] | None:
+    return await _run_in_pool(get_top_usage_sessions, order, limit)
+
+async def get_session_details_async(session_id: str, limit: int | None = None, cursor: str | None = None) -> dict | None:
+    return await _run_in_pool(get_session_details, session_id, limit, cursor)
+
+async def get_session_summary_async(session_id: str) -> dict | None:
+    return await _run_in_pool(get_session_summary, session_id)
+
+async def get_session_summaries_async(user_id: str | None = None, session_ids: list[str] | None = None,
+                                      created_from: str | None = None, created_to: str | None = None) -> list[dict] | None:
+    return await _run_in_pool(get_session_summaries, user_id, session_ids, created_from, created_to)
+
+async def get_sessions_for_user_async(user_id: str, limit: int | None, cursor: str | None = None) -> dict | None:
+    return await _run_in_pool(get_sessions_for_user, user_id, limit, cursor)
+
+async def delete_session_from_db_async(session_id: str) -> bool:
+    return await _run_in_pool(delete_session_from_db, session_id)
+
+async def upload_image_async(file_bytes: bytes, content_type: str, file_name: str | None = None) -> str | None:
+    return await _run_in_pool(upload_image, file_bytes, content_type, file_name)
+
+async def get_analytics_days_async(first_day: str, last_day: str) -> list[dict] | None:
+    return await _run_in_pool(get_analytics_days, first_day, last_day)
+
+async def save_analytics_day_async(day: str, counters: dict, version: int) -> bool:
+    return await _run_in_pool(save_analytics_day, day, counters, version)
+
+async def scan_sessions_async(before: str, limit: int, after: tuple[str, str] | None = None) -> list[dict] | None:
+    return await _run_in_pool(scan_sessions, before, limit, after)
+
+async def scan_message_times_async(before: str, limit: int, after_id=None) -> list[dict] | None:
+    return await _run_in_pool(scan_message_times, before, limit, after_id)
+
+async def get_bot_messages_async(session_ids: list[str]) -> list[dict] | None:
+    return await _run_in_pool(get_bot_messages, session_ids)
+
+def shutdown_pool():
+    """Waits for in-flight database calls to finish. Called when the app stops."""
+    _db_executor.shutdown(wait=True)
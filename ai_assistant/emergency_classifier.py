@@ -0,0 +1,242 @@
+# ai_assistant/emergency_classifier.py
+
+import re
+import unicodedata
+from collections import deque
+from typing import NamedTuple
+
+# Phrases that mean an ESI Level 1 emergency, per the concepts in TRIAGE_SYSTEM_PROMPT,
+# in English, Filipino and Cebuano (plus the code-switched forms patients actually type).
+# Phrases are written the way `normalize` leaves text: lowercase, no apostrophes, no
+# punctuation. A trailing `*` matches any word that starts with the phrase. A match
+# ends triage at ESI 1, so words that also have everyday meanings ("seizing up",
+# "stabbed my finger", "phone is unresponsive") only appear in phrases whose
+# wording rules those out; whatever they miss still goes to Gemini.
+EMERGENCY_PHRASES: dict[str, list[str]] = {
+    "trauma": [
+        "been stabbed", "got stabbed", "stabbed with a knife", "stabbed in the chest", "stabbed in the stomach",
+        "stabbed in the belly", "stabbed in the back", "stabbed in the neck", "stabbed in the abdomen",
+        "stab wound*", "knife wound*", "gunshot*", "been shot", "got shot", "was shot", "bullet wound*",
+        "sinaksak", "nasaksak", "binaril", "nabaril", "tinamaan ng bala",
+        "gidunggab", "nadunggab", "gipusil", "napusil", "naigo sa bala",
+    ],
+    "breathing": [
+        "not breathing", "stopped breathing", "cant breathe", "cannot breathe", "can not breathe",
+        "unable to breathe", "isnt breathing", "is choking", "im choking", "am choking", "hes choking",
+        "shes choking", "are choking", "started choking", "turning blue", "lips are blue",
+        "hindi makahinga", "di makahinga", "hindi humihinga", "nabubulunan", "nabulunan", "nasasakal",
+        "dili makaginhawa", "di makaginhawa", "dili moginhawa", "wala nay ginhawa", "natuk an", "nakatuk an",
+    ],
+    "unconscious": [
+        "unconscious", "he is unresponsive", "she is unresponsive", "hes unresponsive", "shes unresponsive",
+        "baby is unresponsive", "they are unresponsive", "became unresponsive", "collapsed and is unresponsive",
+        "collapsed and unresponsive", "wont wake up", "will not wake up", "not waking up",
+        "cant wake him", "cant wake her", "cant wake them", "is passed out", "still passed out",
+        "walang malay", "wala siyang malay", "wala nang malay", "nawalan ng malay", "hindi magising",
+        "ayaw magising",
+        "walay panimuot", "wala siyay panimuot", "wala nay panimuot", "wala na siyay panimuot",
+        "nawad an og panimuot", "nawad an ug panimuot", "dili makamata", "dili mamata",
+    ],
+    "seizure": [
+        "having a seizure", "having seizures", "he is seizing", "she is seizing", "hes seizing", "shes seizing",
+        "baby is seizing", "started seizing", "convulsing", "having convulsions",
+        "nag seizure", "nangingisay", "kinukumbulsyon", "nagkukumbulsyon",
+        "gikombulsyon", "nagkombulsyon", "gi seizure",
+    ],
+    "bleeding": [
+        "bleeding heavily", "heavy bleeding", "severe bleeding", "uncontrolled bleeding",
+        "bleeding profusely", "wont stop bleeding", "cant stop the bleeding", "cant stop bleeding",
+        "bleeding wont stop", "blood everywhere", "spurting blood", "blood is spurting", "losing a lot of blood",
+        "malakas ang dugo", "hindi tumitigil ang dugo", "ayaw tumigil ang dugo", "dumudugo nang malakas",
+        "dumudugo ng malakas",
+        "grabe ang dugo", "dili mohunong ang dugo", "dili muhunong ang dugo", "grabe ang pagdugo",
+        "nagdugo pag ayo",
+    ],
+    "chest_pain": [
+        "crushing chest pain", "crushing pain in my chest", "severe chest pain", "chest pain spreading",
+        "chest pain radiating", "pain radiating to my left arm", "pain in my chest and left arm",
+        "having a heart attack", "elephant on my chest",
+        "inaatake sa puso", "inatake sa puso", "sobrang sakit ng dibdib",
+        "giatake sa kasingkasing", "grabe ang sakit sa dughan", "grabe ang sakit sa akong dughan",
+    ],
+    "stroke": [
+        "face drooping", "face is drooping", "drooping face", "face droop*", "slurred speech",
+        "slurring his words", "slurring her words", "slurring words", "slurring their words",
+        "having a stroke", "weakness on one side", "numb on one side", "cant move one side",
+        "tumabingi ang mukha", "ngumiwi ang mukha", "bulol magsalita", "inistroke", "na stroke", "nastroke",
+        "nahiwi ang nawong", "ngiwi ang nawong", "dili makasulti tarong",
+    ],
+    "anaphylaxis": [
+        "anaphylaxis", "anaphylactic", "throat is closing", "throat closing", "throat is swelling",
+        "throat swelling", "swollen throat", "tongue is swelling", "tongue swelling",
+        "namamaga ang lalamunan", "sumasara ang lalamunan", "namamaga ang dila",
+        "nanghubag ang tutunlan", "nanghubag ang dila", "nagsira ang tutunlan",
+    ],
+    "self_harm": [
+        "kill myself", "end my life", "take my own life", "commit suicide", "going to suicide",
+        "want to die tonight", "took all my pills", "overdosed on",
+        "magpapakamatay", "magpakamatay", "papatayin ko ang sarili ko", "gusto ko nang mamatay",
+        "tapusin ang buhay ko", "wakasan ang buhay ko",
+        "maghikog", "mohikog", "patyon nako akong kaugalingon", "tapuson nako akong kinabuhi",
+        "gusto na ko mamatay",
+    ],
+}
+
+# Words that negate a phrase when they appear shortly before it ("no chest pain",
+# "wala siyang seizure", "dili man siya..."). The scope stops at a sentence end or "but".
+NEGATION_CUES = frozenset({
+    "no", "not", "never", "without", "denies", "dont", "doesnt", "didnt", "isnt", "wasnt", "arent", "wont",
+    "hindi", "di", "wala", "walang",
+    "dili", "wa", "walay",
+})
+NEGATION_WINDOW = 3
+SCOPE_BREAKS = frozenset({".", "but", "however", "pero", "peru", "apan"})
+
+# Phrases that make a mention in the same sentence hypothetical, historical (or
+# already over), a question about an emergency, or about a blocked nose, bleeding
+# gums or a period rather than the airway or a wound.
+HEDGES = (
+    "ago", "last year", "last month", "last week", "years back", "history of", "in the past",
+    "fine now", "ok now", "okay now", "better now",
+    "what if", "signs of", "symptoms of", "what are", "what is", "how do i know", "how to", "risk of",
+    "dati", "noong", "kaniadto", "niadtong", "unsa ang", "ano ang", "paano", "unsaon",
+    "nose", "stuffy", "ilong", "barado", "gums", "gilagid", "period", "regla",
+)
+
+# Hedges for one category only: someone else's words or a joke are worth asking
+# about, not a crisis handover, while "he said he cant breathe" still is an emergency.
+CATEGORY_HEDGES = {
+    "self_harm": ("said", "says", "joke", "joking", "jokingly", "kidding", "lol", "biro", "nagbibiro", "sabi"),
+}
+
+class EmergencyMatch(NamedTuple):
+    category: str
+    phrase: str
+
+_SENTENCE_END = re.compile(r"[.!?;\n]+")
+_NON_WORD = re.compile(r"[^a-z0-9 .]+")
+
+def normalize(text: str) -> str:
+    """
+    Lowercases, folds accents, drops apostrophes ("can't" -> "cant"), turns sentence
+    ends into a " . " token and every other non-alphanumeric run into one space. The
+    result is padded with spaces so phrases can be matched on word boundaries.
+    """
+    text = text.lower()
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode()
+    text = _SENTENCE_END.sub(" . ", text.replace("'", ""))
+    text = _NON_WORD.sub(" ", text)
+    return " " + " ".join(text.split()) + " "
+
+class PhraseMatcher:
+    """
+    Aho-Corasick automaton over a fixed set of phrases: one pass over the text finds
+    every occurrence of every phrase, however many phrases there are.
+    """
+
+    __slots__ = ("_goto", "_fail", "_out", "_lengths")
+
+    def __init__(self, patterns: list[str]):
+        goto: list[dict[str, int]] = [{}]
+        out: list[tuple[int, ...]] = [()]
+        for index, pattern in enumerate(patterns):
+            node = 0
+            for ch in pattern:
+                child = goto[node].get(ch)
+                if child is None:
+                    child = len(goto)
+                    goto[node][ch] = child
+                    goto.append({})
+                    out.append(())
+                node = child
+            out[node] += (index,)
+
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in goto[node].items():
+                queue.append(child)
+                state = fail[node]
+                while state and ch not in goto[state]:
+                    state = fail[state]
+                fail[child] = goto[state].get(ch, 0)
+                out[child] += out[fail[child]]
+
+        self._goto, self._fail, self._out = goto, fail, out
+        self._lengths = [len(pattern) for pattern in patterns]
+
+    def find(self, text: str):
+        """Yields `(start, pattern_index)` for every match, in order of where they end."""
+        goto, fail, out, lengths = self._goto, self._fail, self._out, self._lengths
+        node = 0
+        for end, ch in enumerate(text, 1):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for index in out[node]:
+                yield end - lengths[index], index
+
+def _pattern(phrase: str) -> str:
+    # Word boundaries are the spaces `normalize` puts around every word.
+    if phrase.endswith("*"):
+        return " " + phrase[:-1]
+    return " " + phrase + " "
+
+_phrases = [(category, phrase) for category, phrases in EMERGENCY_PHRASES.items() for phrase in phrases]
+_matcher = PhraseMatcher([_pattern(phrase) for _, phrase in _phrases])
+
+def _is_negated(text: str, start: int) -> bool:
+    for word in reversed(text[:start].split()[-NEGATION_WINDOW:]):
+        if word in SCOPE_BREAKS:
+            return False
+        if word in NEGATION_CUES:
+            return True
+    return False
+
+def _is_hedged(text: str, start: int, category: str) -> bool:
+    sentence_start = text.rfind(" . ", 0, start) + 1
+    sentence_end = text.find(" . ", start)
+    sentence = text[sentence_start:sentence_end if sentence_end != -1 else len(text)]
+    hedges = HEDGES + CATEGORY_HEDGES.get(category, ())
+    return any(f" {hedge} " in sentence for hedge in hedges)
+
+class FastPathStats:
+    """
+    How often the fast path answered, how often Gemini agreed with it afterwards, and how
+    often a disputed answer was replaced with Gemini's.
+    """
+
+    def __init__(self):
+        self.matches: dict[str, int] = {}
+        self.confirmed = 0
+        self.disputed = 0
+        self.revised = 0
+
+    def record_match(self, match: EmergencyMatch):
+        self.matches[match.category] = self.matches.get(match.category, 0) + 1
+
+    def stats(self) -> dict:
+        return {
+            "matches": sum(self.matches.values()),
+            "by_category": dict(self.matches),
+            "confirmed": self.confirmed,
+            "disputed": self.disputed,
+            "revised": self.revised,
+        }
+
+fast_path_stats = FastPathStats()
+
+def classify_emergency(message: str) -> EmergencyMatch | None:
+    """
+    Returns the first emergency phrase in `message` that is neither negated nor
+    hedged, or None. A None is not an all-clear: the message still goes to Gemini,
+    which applies the full emergency check. This only answers the clear-cut cases early.
+    """
+    text = normalize(message)
+    for start, index in _matcher.find(text):
+        category, phrase = _phrases[index]
+        if not _is_negated(text, start) and not _is_hedged(text, start, category):
+            return EmergencyMatch(category, phrase)
+    return None
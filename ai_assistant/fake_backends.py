@@ -0,0 +1,548 @@
+# ai_assistant/fake_backends.py
+#
+# Offline stand-ins for Supabase and Gemini, switched on with USE_FAKE_BACKENDS.
+# They implement just the client surface this service calls, with configurable
+# latency, so the app can be run and load-tested without keys or network.
+
+import asyncio
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+# --- Fault injection ---
+
+class FakeUnavailable(Exception):
+    """An injected failure, carrying an HTTP status like the real clients' errors do."""
+
+    def __init__(self, backend: str, code: int = 503):
+        super().__init__(f"{code} {backend} unavailable (injected fault)")
+        self.code = code
+
+class FaultInjector:
+    """
+    Decides the fate of each fake call: a share `error_rate` fail, `hang_rate` hang for
+    `hang_seconds`, and `slow_rate` take `slow_factor` times their usual latency. Setting
+    `down` fails every call, for simulating an outage.
+    """
+
+    def __init__(self, backend: str, error_rate: float = 0.0, hang_rate: float = 0.0, slow_rate: float = 0.0,
+                 slow_factor: float = 10.0, hang_seconds: float = 120.0):
+        self.backend = backend
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.hang_seconds = hang_seconds
+        self.down = False
+        self.injected = {"error": 0, "hang": 0, "slow": 0}
+
+    def delay(self, latency: float) -> float:
+        """How long this call should take; raises FakeUnavailable if it should fail."""
+        roll = random.random()
+        if self.down or roll < self.error_rate:
+            self.injected["error"] += 1
+            raise FakeUnavailable(self.backend)
+        roll -= self.error_rate
+        if roll < self.hang_rate:
+            self.injected["hang"] += 1
+            return self.hang_seconds
+        if roll - self.hang_rate < self.slow_rate:
+            self.injected["slow"] += 1
+            return latency * self.slow_factor
+        return latency
+
+# --- Supabase ---
+
+class FakeStorageError(Exception):
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+class FakeResponse:
+    def __init__(self, data, count: int | None = None):
+        self.data = data
+        self.count = count
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+def _split_top_level(text: str) -> list[str]:
+    """Splits on commas that are not inside parentheses or double quotes."""
+    parts, depth, quoted, current = [], 0, False, []
+    for ch in text:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        elif not quoted and ch == "," and depth == 0:
+            parts.append("".join(current).strip())
+            current = []
+            continue
+        current.append(ch)
+    if current:
+        parts.append("".join(current).strip())
+    return [part for part in parts if part]
+
+def _coerce(value, like):
+    """Converts a filter value from a query string to the type of the column it is compared with."""
+    if isinstance(like, bool):
+        return value in (True, "true")
+    if isinstance(like, int) and not isinstance(value, int):
+        return int(value)
+    return value
+
+_COMPARATORS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "lt": lambda a, b: a < b,
+    "lte": lambda a, b: a <= b,
+    "gt": lambda a, b: a > b,
+    "gte": lambda a, b: a >= b,
+}
+
+def _compile_logic(expression: str, conjunction=any):
+    """
+    Compiles a PostgREST logic filter such as `a.lt."x",and(a.eq."x",id.lt."y")` into
+    a row predicate. Only the operators the service uses are supported.
+    """
+    predicates = []
+    for part in _split_top_level(expression):
+        if part.startswith(("and(", "or(")) and part.endswith(")"):
+            inner = part[part.index("(") + 1:-1]
+            predicates.append(_compile_logic(inner, all if part.startswith("and(") else any))
+        else:
+            column, op, value = part.split(".", 2)
+            predicates.append(_column_predicate(column, op, value.strip('"')))
+    return lambda row: conjunction(predicate(row) for predicate in predicates)
+
+def _column_predicate(column: str, op: str, value):
+    compare = _COMPARATORS[op]
+
+    def predicate(row):
+        current = row.get(column)
+        return current is not None and compare(current, _coerce(value, current))
+    return predicate
+
+class FakeQuery:
+    """A chainable PostgREST-style query over one in-memory table."""
+
+    def __init__(self, client: "FakeSupabaseClient", table: str):
+        self._client = client
+        self._table = table
+        self._action = "select"
+        self._payload = None
+        self._columns: list[str] | None = None
+        self._embedded: dict[str, list[str]] = {}
+        self._filters = []
+        self._orders = []
+        self._limit: int | None = None
+        self._offset = 0
+        self._single = None
+        self._count = None
+        self._returning = "representation"
+        self._negate = False
+        # Per embedded table: filters, orders, limit.
+        self._embedded_filters: dict[str, list] = {}
+        self._embedded_orders: dict[str, list] = {}
+        self._embedded_limits: dict[str, int] = {}
+
+    # Actions
+
+    def select(self, columns: str = "*", count: str | None = None, head: bool = False, **kwargs):
+        self._action, self._count = "select", count
+        self._returning = "minimal" if head else "representation"
+        self._columns, self._embedded = [], {}
+        for part in _split_top_level(columns):
+            if "(" in part:
+                name, inner = part.split("(", 1)
+                self._embedded[name.strip()] = [c.strip() for c in inner.rstrip(")").split(",")]
+            else:
+                self._columns.append(part)
+        if self._columns == ["*"]:
+            self._columns = None
+        return self
+
+    def insert(self, payload):
+        self._action, self._payload = "insert", payload
+        return self
+
+    def update(self, payload):
+        self._action, self._payload = "update", payload
+        return self
+
+    def delete(self, count: str | None = None, returning: str = "representation", **kwargs):
+        self._action, self._count, self._returning = "delete", count, returning
+        return self
+
+    # Filters and modifiers
+
+    def eq(self, column, value):
+        self._where(_column_predicate(column, "eq", value))
+        return self
+
+    def neq(self, column, value):
+        self._where(_column_predicate(column, "neq", value))
+        return self
+
+    def gte(self, column, value):
+        self._where(_column_predicate(column, "gte", value))
+        return self
+
+    def lt(self, column, value):
+        self._where(_column_predicate(column, "lt", value))
+        return self
+
+    def gt(self, column, value):
+        self._where(_column_predicate(column, "gt", value))
+        return self
+
+    def lte(self, column, value):
+        self._where(_column_predicate(column, "lte", value))
+        return self
+
+    def in_(self, column, values):
+        allowed = set(values)
+        self._where(lambda row: row.get(column) in allowed)
+        return self
+
+    def is_(self, column, value):
+        self._where(lambda row: row.get(column) is None if value in (None, "null") else row.get(column) is value)
+        return self
+
+    @property
+    def not_(self):
+        """Negates the filter that follows."""
+        self._negate = True
+        return self
+
+    def _where(self, predicate):
+        if self._negate:
+            self._negate, inner = False, predicate
+            predicate = lambda row: not inner(row)
+        self._filters.append(predicate)
+
+    def or_(self, filters: str, reference_table: str | None = None):
+        predicate = _compile_logic(filters)
+        if reference_table:
+            self._embedded_filters.setdefault(reference_table, []).append(predicate)
+        else:
+            self._where(predicate)
+        return self
+
+    def order(self, column, desc=False, foreign_table: str | None = None, **kwargs):
+        if foreign_table:
+            self._embedded_orders.setdefault(foreign_table, []).append((column, desc))
+        else:
+            self._orders.append((column, desc))
+        return self
+
+    def limit(self, size: int, foreign_table: str | None = None, **kwargs):
+        if foreign_table:
+            self._embedded_limits[foreign_table] = size
+        else:
+            self._limit = size
+        return self
+
+    def range(self, start: int, end: int, **kwargs):
+        self._offset, self._limit = start, end - start + 1
+        return self
+
+    def single(self):
+        self._single = "single"
+        return self
+
+    def maybe_single(self):
+        self._single = "maybe_single"
+        return self
+
+    def execute(self):
+        self._client.simulate_latency()
+        with self._client.lock:
+            return getattr(self, f"_execute_{self._action}")()
+
+    # Execution
+
+    def _matching(self, rows):
+        return [row for row in rows if all(predicate(row) for predicate in self._filters)]
+
+    def _execute_insert(self):
+        payload = self._payload if isinstance(self._payload, list) else [self._payload]
+        inserted = [self._client.insert_row(self._table, dict(row)) for row in payload]
+        return FakeResponse([dict(row) for row in inserted])
+
+    def _execute_update(self):
+        rows = self._matching(self._client.tables[self._table])
+        for row in rows:
+            row.update(self._payload)
+        return FakeResponse([dict(row) for row in rows])
+
+    def _execute_delete(self):
+        rows = self._matching(self._client.tables[self._table])
+        self._client.delete_rows(self._table, rows)
+        data = [dict(row) for row in rows] if self._returning == "representation" else []
+        return FakeResponse(data, len(rows) if self._count else None)
+
+    def _execute_select(self):
+        rows = _sorted(self._matching(self._client.tables[self._table]), self._orders)
+        count = len(rows) if self._count else None
+        if self._limit is not None:
+            rows = rows[self._offset:self._offset + self._limit]
+        data = [self._project(row) for row in rows] if self._returning == "representation" else []
+        if self._single is None:
+            return FakeResponse(data, count)
+        if not data:
+            if self._single == "maybe_single":
+                return None
+            raise ValueError("JSON object requested, multiple (or no) rows returned")
+        return FakeResponse(data[0])
+
+    def _project(self, row):
+        result = {column: row.get(column) for column in self._columns} if self._columns is not None else dict(row)
+        for table, columns in self._embedded.items():
+            children = [
+                child for child in self._client.children(table, row["id"])
+                if all(predicate(child) for predicate in self._embedded_filters.get(table, []))
+            ]
+            children = _sorted(children, self._embedded_orders.get(table, []))
+            if table in self._embedded_limits:
+                children = children[:self._embedded_limits[table]]
+            result[table] = [{column: child.get(column) for column in columns} for child in children]
+        return result
+
+def _sorted(rows, orders):
+    # Stable sorts applied last-key-first give a multi-column order.
+    for column, desc in reversed(orders):
+        rows = sorted(rows, key=lambda row: (row.get(column) is None, row.get(column)), reverse=desc)
+    return rows
+
+class FakeBucket:
+    def __init__(self, client: "FakeSupabaseClient", name: str):
+        self._client = client
+        self._objects = client.buckets.setdefault(name, {})
+        self._created = client.bucket_created.setdefault(name, {})
+        self._updated = client.bucket_updated.setdefault(name, {})
+        self._name = name
+
+    def upload(self, file, path, file_options=None):
+        self._client.simulate_latency()
+        with self._client.lock:
+            if path in self._objects:
+                if str((file_options or {}).get("upsert", "false")).lower() != "true":
+                    raise FakeStorageError("The resource already exists", 409)
+            else:
+                self._created[path] = _now()
+            self._objects[path] = bytes(file)
+            self._updated[path] = _now()
+        return FakeResponse({"Key": f"{self._name}/{path}"})
+
+    def download(self, path):
+        self._client.simulate_latency()
+        return self._objects[path]
+
+    def remove(self, paths):
+        self._client.simulate_latency()
+        with self._client.lock:
+            removed = [path for path in paths if self._objects.pop(path, None) is not None]
+            for path in removed:
+                self._created.pop(path, None)
+                self._updated.pop(path, None)
+            return [{"name": path} for path in removed]
+
+    def list(self, path=None, options=None):
+        """Objects sorted by name, paged with the `limit` and `offset` options like the storage API."""
+        self._client.simulate_latency()
+        options = options or {}
+        offset = options.get("offset", 0)
+        with self._client.lock:
+            names = sorted(self._objects)[offset:offset + options.get("limit", 100)]
+            return [{"name": name, "created_at": self._created.get(name), "updated_at": self._updated.get(name)}
+                    for name in names]
+
+    def get_public_url(self, path):
+        return f"https://fake.supabase.local/storage/v1/object/public/{self._name}/{path}"
+
+class FakeStorage:
+    def __init__(self, client: "FakeSupabaseClient"):
+        self._client = client
+
+    def from_(self, bucket: str) -> FakeBucket:
+        return FakeBucket(self._client, bucket)
+
+class FakeSupabaseClient:
+    """
+    In-memory stand-in for the Supabase client with the ai_sessions, ai_messages and
+    ai_analytics_daily tables and the symptom-images bucket. Every request sleeps
+    `latency` seconds, like a round-trip would, and is thread-safe so it works from
+    the DB thread pool. `faults` can make requests fail or hang.
+    """
+
+    # Column defaults applied on insert, as the real schema's defaults would be.
+    DEFAULTS = {
+        "ai_sessions": lambda: {
+            "id": str(uuid.uuid4()), "created_at": _now(), "title": None, "final_esi_level": None,
+            "session_summary": None, "has_summary": False, "context_summary": None, "context_summary_turns": 0,
+            "llm_usage": None, "llm_tokens": 0, "llm_seconds": 0.0,
+        },
+        "ai_messages": lambda: {"image_url": None, "timestamp": _now()},
+        "ai_analytics_daily": lambda: {"version": 1},
+    }
+
+    def __init__(self, latency: float = 0.0, faults: FaultInjector | None = None):
+        self.latency = latency
+        self.faults = faults or FaultInjector("supabase")
+        self.lock = threading.Lock()
+        self.tables: dict[str, list[dict]] = {name: [] for name in self.DEFAULTS}
+        self.buckets: dict[str, dict[str, bytes]] = {}
+        self.bucket_created: dict[str, dict[str, str]] = {}
+        self.bucket_updated: dict[str, dict[str, str]] = {}
+        self.storage = FakeStorage(self)
+        self._message_ids = itertools.count(1)
+        # ai_messages rows by session_id, the index embedded reads use.
+        self._messages_by_session: dict[str, list[dict]] = {}
+
+    def simulate_latency(self):
+        delay = self.faults.delay(self.latency)
+        if delay:
+            time.sleep(delay)
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def insert_row(self, table: str, row: dict) -> dict:
+        full_row = self.DEFAULTS[table]()
+        if table == "ai_messages":
+            full_row["id"] = next(self._message_ids)
+        full_row.update(row)
+        self.tables[table].append(full_row)
+        if table == "ai_messages":
+            self._messages_by_session.setdefault(full_row["session_id"], []).append(full_row)
+        return full_row
+
+    def children(self, table: str, session_id: str) -> list[dict]:
+        """Rows of an embedded table that belong to one session (only ai_messages embeds)."""
+        return self._messages_by_session.get(session_id, []) if table == "ai_messages" else []
+
+    def delete_rows(self, table: str, rows: list[dict]):
+        doomed = {id(row) for row in rows}
+        self.tables[table] = [row for row in self.tables[table] if id(row) not in doomed]
+        if table == "ai_sessions":
+            # ai_messages.session_id is ON DELETE CASCADE.
+            session_ids = {row["id"] for row in rows}
+            self.tables["ai_messages"] = [
+                row for row in self.tables["ai_messages"] if row["session_id"] not in session_ids
+            ]
+            for session_id in session_ids:
+                self._messages_by_session.pop(session_id, None)
+        elif table == "ai_messages":
+            for row in rows:
+                self._messages_by_session[row["session_id"]].remove(row)
+
+# --- Gemini ---
+
+FAKE_QUESTION = "I'm sorry to hear that. Could you tell me when it started and how severe it feels on a scale of 1 to 10?"
+FAKE_HANDOVER = ("Thank you for sharing that information. Based on what you've described, "
+                 "I recommend that you speak with a doctor soon. You can use the options below to book a consultation.")
+
+class FakeUsage:
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+class FakeGenerateResponse:
+    def __init__(self, text: str, usage: FakeUsage | None = None):
+        self.text = text
+        self.usage_metadata = usage
+
+class FakeStreamedResponse:
+    """Async-iterable reply that yields one word per token interval; usage is set once it is consumed."""
+
+    def __init__(self, model: "FakeGenerativeModel", text: str, prompt_tokens: int):
+        self._model = model
+        self._text = text
+        self._prompt_tokens = prompt_tokens
+        self.usage_metadata = None
+
+    async def __aiter__(self):
+        words = self._text.split(" ")
+        await asyncio.sleep(self._model.faults.delay(self._model.latency))
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self._model.token_interval)
+            yield FakeGenerateResponse(word if i == 0 else " " + word)
+        self.usage_metadata = FakeUsage(self._prompt_tokens, len(words))
+
+def _estimate_tokens(parts) -> int:
+    return sum(len(part) for part in parts if isinstance(part, str)) // 4
+
+class FakeChatSession:
+    def __init__(self, model: "FakeGenerativeModel", history: list[dict] | None):
+        self._model = model
+        self.history = list(history or [])
+
+    def _reply(self, content) -> tuple[str, int]:
+        parts = [part for entry in self.history for part in entry["parts"]] + list(content)
+        prompt_tokens = _estimate_tokens([self._model.system_instruction or ""] + parts)
+        user_turns = sum(1 for entry in self.history if entry["role"] == "user") + 1
+        if self._model.esi_level and user_turns >= self._model.esi_after_turns:
+            text = f"{FAKE_HANDOVER}\nFinal ESI Level: {self._model.esi_level}"
+        else:
+            text = FAKE_QUESTION
+        return text, prompt_tokens
+
+    async def send_message_async(self, content, stream: bool = False, **kwargs):
+        text, prompt_tokens = self._reply(content)
+        if stream:
+            return FakeStreamedResponse(self._model, text, prompt_tokens)
+        words = len(text.split(" "))
+        await asyncio.sleep(self._model.faults.delay(self._model.latency) + self._model.token_interval * (words - 1))
+        return FakeGenerateResponse(text, FakeUsage(prompt_tokens, words))
+
+class FakeGenerativeModel:
+    """
+    Simulated Gemini model. Replies after `latency` seconds plus one interval per word
+    at `tokens_per_second`, and ends the reply with `Final ESI Level: <esi_level>` from
+    the `esi_after_turns`-th patient message on (never, if `esi_level` is 0).
+    JSON-mode calls return a summary and title. `faults` can make calls fail, hang or
+    straggle; a streamed reply's fault hits its first chunk.
+    """
+
+    def __init__(self, model_name: str, system_instruction: str | None = None, latency: float = 0.8,
+                 tokens_per_second: float = 80.0, esi_level: int = 4, esi_after_turns: int = 3,
+                 faults: FaultInjector | None = None):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.latency = latency
+        self.token_interval = 1 / tokens_per_second if tokens_per_second else 0.0
+        self.esi_level = esi_level
+        self.esi_after_turns = esi_after_turns
+        self.faults = faults or FaultInjector("gemini")
+
+    def start_chat(self, history: list[dict] | None = None) -> FakeChatSession:
+        return FakeChatSession(self, history)
+
+    def _generate(self, prompt, generation_config) -> FakeGenerateResponse:
+        if (generation_config or {}).get("response_mime_type") == "application/json":
+            text = json.dumps({
+                "summary": "The patient reported a headache of moderate severity that began two days ago. "
+                           f"Assessed as ESI Level {self.esi_level or 4}.",
+                "title": "Moderate Headache",
+            })
+        else:
+            text = "Moderate Headache"
+        prompt_tokens = _estimate_tokens([prompt] if isinstance(prompt, str) else prompt)
+        return FakeGenerateResponse(text, FakeUsage(prompt_tokens, len(text.split(" "))))
+
+    def generate_content(self, prompt, generation_config=None, **kwargs):
+        time.sleep(self.faults.delay(self.latency))
+        return self._generate(prompt, generation_config)
+
+    async def generate_content_async(self, prompt, generation_config=None, **kwargs):
+        await asyncio.sleep(self.faults.delay(self.latency))
+        return self._generate(prompt, generation_config)
@@ -0,0 +1,182 @@
+# ai_assistant/image_pipeline.py
+
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+
+from config import IMAGE_MAX_DIMENSION, IMAGE_FORMAT, IMAGE_QUALITY, IMAGE_WORKERS
+from structured_log import get_logger
+
+log = get_logger(__name__)
+
+# Formats that can be sent to Gemini and stored as-is when re-encoding would not help.
+_PASSTHROUGH_FORMATS = {"JPEG", "PNG", "WEBP"}
+
+_EXIF_ORIENTATION = 0x0112
+
+@dataclass
+class ProcessedImage:
+    data: bytes
+    content_type: str
+    storage_key: str
+    original_bytes: int
+    stage_ms: dict = field(default_factory=dict)
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - len(self.data)
+
+def _process(image_bytes: bytes, max_dimension: int, image_format: str, quality: int) -> ProcessedImage:
+    """Runs in a worker process: decode, fix orientation, downscale, re-encode and hash."""
+    from PIL import Image, ImageOps
+
+    stage_ms = {}
+    started = time.perf_counter()
+
+    def lap(stage):
+        nonlocal started
+        now = time.perf_counter()
+        stage_ms[stage] = round((now - started) * 1000, 2)
+        started = now
+
+    image = Image.open(io.BytesIO(image_bytes))
+    original_format = image.format
+    image.load()
+    lap("decode")
+
+    rotated = image.getexif().get(_EXIF_ORIENTATION, 1) != 1
+    oriented = ImageOps.exif_transpose(image)
+    lap("orient")
+
+    resized = oriented.width > max_dimension or oriented.height > max_dimension
+    if resized:
+        oriented.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+    lap("resize")
+
+    if oriented.mode not in ("RGB", "RGBA"):
+        oriented = oriented.convert("RGBA" if "A" in oriented.getbands() or "transparency" in oriented.info else "RGB")
+    options = {"quality": quality}
+    if image_format == "WEBP":
+        options["method"] = 4
+    buffer = io.BytesIO()
+    oriented.save(buffer, format=image_format, **options)
+    data, out_format = buffer.getvalue(), image_format
+    # A small, upright photo may already be smaller than our re-encode; keep it then.
+    if not resized and not rotated and original_format in _PASSTHROUGH_FORMATS and len(image_bytes) <= len(data):
+        data, out_format = image_bytes, original_format
+    lap("encode")
+
+    digest = hashlib.sha256(data).hexdigest()
+    lap("hash")
+
+    extension = out_format.lower().replace("jpeg", "jpg")
+    return ProcessedImage(
+        data=data,
+        content_type=Image.MIME[out_format],
+        storage_key=f"img_{digest}.{extension}",
+        original_bytes=len(image_bytes),
+        stage_ms=stage_ms,
+    )
+
+def _preload():
+    # Imported in the workers only; the web process never touches Pillow.
+    import PIL.Image, PIL.ImageOps
+
+class ImagePipeline:
+    """
+    Preprocesses uploaded images in a process pool so decoding and re-encoding
+    never hold the GIL on the event loop. If a worker dies (e.g. killed for running
+    out of memory on a huge image), the broken pool is replaced and the image tried
+    once more. Keeps running totals for /internal/stats.
+    """
+
+    def __init__(self, workers: int = IMAGE_WORKERS, max_dimension: int = IMAGE_MAX_DIMENSION,
+                 image_format: str = IMAGE_FORMAT, quality: int = IMAGE_QUALITY):
+        self.workers = workers
+        self.max_dimension = max_dimension
+        self.image_format = image_format.upper()
+        self.quality = quality
+        self._pool: ProcessPoolExecutor | None = None
+        self.images = 0
+        self.failures = 0
+        self.pool_restarts = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.stage_ms_total: dict[str, float] = {}
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # "spawn" avoids forking a process that already runs database threads.
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def _replace_pool(self, broken: ProcessPoolExecutor):
+        """Drops a broken pool so the next call starts a new one; concurrent callers replace it only once."""
+        if self._pool is broken:
+            self._pool = None
+            self.pool_restarts += 1
+            log.warning("Image worker pool broke; starting a new one")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    async def _run(self, *args):
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            pool = self._get_pool()
+            try:
+                return await loop.run_in_executor(pool, *args)
+            except BrokenProcessPool:
+                self._replace_pool(pool)
+                if attempt:
+                    raise
+
+    def warm_up(self):
+        """Starts the worker processes now so the first uploaded image doesn't pay for spawning them."""
+        pool = self._get_pool()
+        for _ in range(self.workers):
+            pool.submit(_preload)
+
+    async def process(self, image_bytes: bytes) -> ProcessedImage | None:
+        """Returns the processed image, or None if the bytes are not a readable image."""
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            result = await self._run(_process, image_bytes, self.max_dimension, self.image_format, self.quality)
+        except Exception as e:
+            self.failures += 1
+            log.error("Could not process image file", extra={"error": str(e)})
+            return None
+
+        # Time spent queueing for a worker and shipping bytes between processes.
+        result.stage_ms["transfer"] = round((time.perf_counter() - started) * 1000 - sum(result.stage_ms.values()), 2)
+        self.images += 1
+        self.bytes_in += result.original_bytes
+        self.bytes_out += len(result.data)
+        for stage, ms in result.stage_ms.items():
+            self.stage_ms_total[stage] = self.stage_ms_total.get(stage, 0.0) + ms
+        log.info("Image preprocessed", extra={
+            "bytes_in": result.original_bytes, "bytes_out": len(result.data), "stage_ms": result.stage_ms,
+        })
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "images": self.images,
+            "failures": self.failures,
+            "pool_restarts": self.pool_restarts,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+            "avg_stage_ms": {stage: round(total / self.images, 2) for stage, total in self.stage_ms_total.items()} if self.images else {},
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+image_pipeline = ImagePipeline()
@@ -0,0 +1,126 @@
+# ai_assistant/job_queue.py
+
+import asyncio
+from typing import Awaitable, Callable
+
+from config import JOB_WORKERS, JOB_MAX_RETRIES
+from structured_log import get_logger
+
+log = get_logger(__name__)
+
+class JobQueue:
+    """
+    In-process async job queue with a fixed worker pool. Jobs are identified by a
+    key (e.g. "summary:<session_id>"), and a key is queued at most once: enqueuing
+    it again replaces the queued job with the newer one, which may have captured
+    newer values. A key enqueued while its job is running runs once more after
+    it, since the running job may have read the state before the change that
+    asked for it. Failed jobs are retried with exponential backoff.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, max_retries: int = JOB_MAX_RETRIES):
+        self.workers = workers
+        self.max_retries = max_retries
+        self._queue: asyncio.Queue | None = None
+        # Keys queued or running, the newest job per queued key, the keys running, and
+        # the newest job to run again per running key. The queue itself holds keys.
+        self._keys: set[str] = set()
+        self._jobs: dict[str, tuple] = {}
+        self._running: set[str] = set()
+        self._reruns: dict[str, tuple] = {}
+        self._tasks: list[asyncio.Task] = []
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def enqueue(self, key: str, job: Callable[[], Awaitable], on_give_up: Callable[[], Awaitable] | None = None) -> bool:
+        """
+        Schedules `job` to run in the background. If a job with the same key is already
+        queued, `job` takes its place and False is returned; if one is running, `job`
+        runs after it instead. `on_give_up` is awaited if every retry fails.
+        """
+        self._ensure_started()
+        if key in self._running:
+            self._reruns[key] = (job, on_give_up)
+            return True
+        if key in self._jobs:
+            self._jobs[key] = (job, on_give_up)
+            return False
+        self._keys.add(key)
+        self._jobs[key] = (job, on_give_up)
+        self._queue.put_nowait(key)
+        return True
+
+    def is_pending(self, key: str) -> bool:
+        return key in self._keys
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._keys),
+            "queued": self._queue.qsize() if self._queue else 0,
+            "running": len(self._running),
+            "reruns_waiting": len(self._reruns),
+        }
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._keys.clear()
+            self._jobs.clear()
+            self._running.clear()
+            self._reruns.clear()
+            self._tasks = []
+        if not self._tasks:
+            self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _worker(self):
+        while True:
+            key = await self._queue.get()
+            job, on_give_up = self._jobs.pop(key)
+            self._running.add(key)
+            try:
+                await self._run_with_retry(key, job, on_give_up)
+            finally:
+                self._running.discard(key)
+                rerun = self._reruns.pop(key, None)
+                if rerun:
+                    # Queued before task_done, so stop() still waits for it.
+                    self._jobs[key] = rerun
+                    self._queue.put_nowait(key)
+                else:
+                    self._keys.discard(key)
+                self._queue.task_done()
+
+    async def _run_with_retry(self, key: str, job: Callable[[], Awaitable], on_give_up):
+        for attempt in range(self.max_retries):
+            try:
+                await job()
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("Background job failed", extra={
+                    "job": key, "attempt": attempt + 1, "max_attempts": self.max_retries, "error": str(e),
+                })
+                if attempt + 1 < self.max_retries:
+                    await asyncio.sleep(2 ** attempt)
+        if on_give_up:
+            try:
+                await on_give_up()
+            except Exception as e:
+                log.error("Error in give-up handler for background job", extra={"job": key, "error": str(e)})
+
+    async def stop(self, timeout: float = 30.0):
+        """Waits up to `timeout` seconds for queued jobs to finish, then cancels the workers."""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            log.warning("Stopping with background jobs still queued", extra={"queued": self._queue.qsize()})
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+background_jobs = JobQueue()
@@ -0,0 +1,109 @@
+# ai_assistant/llm_usage.py
+
+import config
+from model_registry import estimate_cost, model_for
+
+_FIELDS = ("calls", "prompt_tokens", "output_tokens", "seconds", "cost_usd")
+
+def _add(totals: dict, key: str, call: dict):
+    entry = totals.setdefault(key, dict.fromkeys(_FIELDS, 0))
+    for field in _FIELDS:
+        entry[field] += call[field]
+
+def _rounded(entry: dict) -> dict:
+    return {**entry, "seconds": round(entry["seconds"], 3), "cost_usd": round(entry["cost_usd"], 6)}
+
+class SessionUsage:
+    """
+    One session's Gemini usage per task: calls, prompt and output tokens, seconds spent
+    waiting on Gemini, and the estimated cost. It travels with the session's state and is
+    saved to ai_sessions.llm_usage.
+
+    `unsaved` lists the calls recorded since the state was last saved, so they can be
+    added on top when another worker's newer state is taken instead.
+    """
+
+    __slots__ = ("tasks", "unsaved")
+
+    def __init__(self, tasks: dict | None = None):
+        self.tasks: dict[str, dict] = tasks if tasks is not None else {}
+        self.unsaved: list[tuple[str, dict]] = []
+
+    @classmethod
+    def from_dict(cls, data: dict | None) -> "SessionUsage":
+        """Rebuilds the usage from `to_dict`'s output, e.g. the llm_usage column."""
+        return cls({task: dict(entry) for task, entry in ((data or {}).get("tasks") or {}).items()})
+
+    def record(self, task: str, response, seconds: float) -> bool:
+        """
+        Adds one Gemini call for `task` that took `seconds`, with the token counts Gemini
+        reported. Returns True if this call took the session over its token budget.
+        """
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = (getattr(usage, "prompt_token_count", None) or 0) if usage else 0
+        output_tokens = (getattr(usage, "candidates_token_count", None) or 0) if usage else 0
+        model_name = model_for(task)
+        call = {
+            "calls": 1, "prompt_tokens": prompt_tokens, "output_tokens": output_tokens, "seconds": seconds,
+            "cost_usd": estimate_cost(model_name, prompt_tokens, output_tokens),
+        }
+        was_over_budget = self.over_budget
+        _add(self.tasks, task, call)
+        self.unsaved.append((task, call))
+        crossed_budget = self.over_budget and not was_over_budget
+        usage_stats.record(model_name, call, crossed_budget)
+        return crossed_budget
+
+    def rebase(self, stored: dict | None):
+        """Takes the stored per-task totals and adds the unsaved calls on top."""
+        self.tasks = stored if stored is not None else {}
+        for task, call in self.unsaved:
+            _add(self.tasks, task, call)
+
+    def mark_saved(self, calls: int):
+        """Forgets the first `calls` unsaved calls, now that a saved state includes them."""
+        del self.unsaved[:calls]
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(entry["prompt_tokens"] + entry["output_tokens"] for entry in self.tasks.values())
+
+    @property
+    def seconds(self) -> float:
+        return sum(entry["seconds"] for entry in self.tasks.values())
+
+    @property
+    def over_budget(self) -> bool:
+        return bool(config.SESSION_TOKEN_BUDGET) and self.total_tokens >= config.SESSION_TOKEN_BUDGET
+
+    def to_dict(self) -> dict:
+        totals = {}
+        for entry in self.tasks.values():
+            _add(totals, "all", entry)
+        return {
+            **_rounded(totals.get("all", dict.fromkeys(_FIELDS, 0))),
+            "total_tokens": self.total_tokens,
+            "token_budget": config.SESSION_TOKEN_BUDGET or None,
+            "over_budget": self.over_budget,
+            "tasks": {task: _rounded(entry) for task, entry in self.tasks.items()},
+        }
+
+class UsageStats:
+    """Gemini usage across every session this worker served, per model, for /internal/stats."""
+
+    def __init__(self):
+        self.models: dict[str, dict] = {}
+        self.sessions_over_budget = 0
+
+    def record(self, model_name: str, call: dict, crossed_budget: bool = False):
+        _add(self.models, model_name, call)
+        if crossed_budget:
+            self.sessions_over_budget += 1
+
+    def stats(self) -> dict:
+        return {
+            "by_model": {name: _rounded(entry) for name, entry in self.models.items()},
+            "sessions_over_budget": self.sessions_over_budget,
+        }
+
+usage_stats = UsageStats()
@@ -1,18 +1,92 @@
 # ai_assistant/main.py
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
-from fastapi.responses import StreamingResponse, Response
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, UploadFile, File, Form, Header, Query, WebSocket
+from fastapi.responses import StreamingResponse, Response, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import uvicorn
-from ai_service import AIService
-import pdf_service
+import asyncio
+import hmac
+import json
+import math
+from datetime import date, datetime, timedelta, timezone
+from contextlib import asynccontextmanager
+from ai_service import AIService, ERROR_REPLY, on_session_event
+from admission import admission, Overloaded
+from resilience import CircuitOpen
 import database_service as db
+import resilience
+import metrics
+import structured_log
+from message_buffer import message_log
+from job_queue import background_jobs
+from session_cache import SessionCache
+from session_store import session_store
+from request_dedup import chat_requests, fingerprint
+from image_pipeline import image_pipeline
+from timing import StageTimer, turn_stats
+from emergency_classifier import fast_path_stats
+from pdf_cache import pdf_cache, summary_etag
+from pdf_export import pdf_renderer, stream_summaries_zip
+from model_registry import get_model, load_client, model_for
+from llm_usage import SessionUsage, usage_stats
+from prompts import TRIAGE_SYSTEM_PROMPT
+from warmup import warmup
+from retention import retention
+from analytics import triage_analytics
+from chat_socket import chat_channels, CLOSE_NOT_FOUND
+from config import (SESSION_PAGE_SIZE, MESSAGE_PAGE_SIZE, MAX_PAGE_SIZE, STARTUP_WARMUP_BLOCKING,
+                    RETENTION_INTERVAL_HOURS, INTERNAL_API_TOKEN, USE_FAKE_BACKENDS)
+
+# ESI levels, summaries and revised replies reach the patient's WebSocket, if it has one here.
+on_session_event(chat_channels.publish)
+
+def _warm_gemini():
+    load_client()
+    get_model(model_for("triage"), TRIAGE_SYSTEM_PROMPT)
+
+def _warm_supabase():
+    if db.connect() is None:
+        raise RuntimeError("Supabase client could not be created")
+
+async def _warm_pools():
+    image_pipeline.warm_up()
+    pdf_renderer.warm_up()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    active_sessions.start_reaper()
+    chat_channels.start_reaper()
+    warmup.add("gemini", lambda: asyncio.to_thread(_warm_gemini))
+    warmup.add("supabase", lambda: asyncio.to_thread(_warm_supabase))
+    warmup.add("session_store", lambda: session_store.version("warmup-probe"))
+    warmup.add("worker_pools", _warm_pools)
+    warmup.start()
+    if STARTUP_WARMUP_BLOCKING:
+        await warmup.wait()
+    triage_analytics.start()
+    if RETENTION_INTERVAL_HOURS > 0:
+        retention.schedule(RETENTION_INTERVAL_HOURS * 3600)
+    yield
+    await chat_channels.stop()
+    await warmup.stop()
+    await retention.stop()
+    await triage_analytics.stop()
+    await active_sessions.stop_reaper()
+    # Finish queued summaries, write out buffered chat messages, then let in-flight database calls finish.
+    await background_jobs.stop()
+    await message_log.stop()
+    await session_store.close()
+    image_pipeline.shutdown()
+    pdf_renderer.shutdown()
+    db.shutdown_pool()
+    structured_log.stop()
 
 app = FastAPI(
     title="MediBridge AI Health Assistant API",
     description="API endpoints for the AI-powered virtual nurse.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 origins = [
@@ -28,9 +102,37 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing", "ETag", "Idempotent-Replayed"],
 )
+# Outermost, so request latency covers the whole stack.
+app.add_middleware(metrics.MetricsMiddleware)
+
+log = structured_log.get_logger(__name__)
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc: Overloaded):
+    # Gemini is at capacity: tell the client when to try again instead of queueing without bound.
+    return JSONResponse(
+        {"detail": "The assistant is busy right now. Please try again shortly."},
+        status_code=429, headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+    )
+
+@app.exception_handler(CircuitOpen)
+async def circuit_open_handler(request, exc: CircuitOpen):
+    # A backend is failing; answer at once rather than make the patient wait for a doomed call.
+    return JSONResponse(
+        {"detail": "The assistant is temporarily unavailable. Please try again shortly."},
+        status_code=503, headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+    )
 
-active_sessions = {}
+# Live chats, bounded by size and idle time. This is only a local copy of the session
+# store: a chat another worker has moved on is rebuilt from the store, and one that is
+# in neither is restored from the DB.
+active_sessions = SessionCache()
+session_restores = {"store": 0, "database": 0}
+# Lookups in progress, so concurrent requests for an evicted chat share one restored
+# AIService (and so its turn lock) instead of each building their own.
+_session_lookups: dict[str, asyncio.Task] = {}
 
 class StartChatRequest(BaseModel):
     user_id: str
@@ -45,81 +147,292 @@ class SendMessageResponse(BaseModel):
 class EndChatRequest(BaseModel):
     session_id: str
 
+class ExportSummariesRequest(BaseModel):
+    user_id: str | None = None
+    session_ids: list[str] | None = None
+    created_from: datetime | None = None
+    created_to: datetime | None = None
+
 @app.post("/chat/start", response_model=StartChatResponse)
 async def start_chat(request: StartChatRequest):
-    service = AIService(user_id=request.user_id)
+    service = await AIService.create(user_id=request.user_id)
     if not service.session_id:
         raise HTTPException(status_code=500, detail="Failed to create a new session in the database.")
     active_sessions[service.session_id] = service
     return StartChatResponse(session_id=service.session_id)
 
-@app.post("/chat/message")
-async def send_message(
-    session_id: str = Form(...),
-    user_message: str = Form(...),
-    image: UploadFile = File(None)
-):
+async def get_or_restore_session(session_id: str) -> AIService:
+    lookup = _session_lookups.get(session_id)
+    if lookup is None:
+        lookup = _session_lookups[session_id] = asyncio.ensure_future(_lookup_session(session_id))
+        lookup.add_done_callback(lambda _: _session_lookups.pop(session_id, None))
+    return await asyncio.shield(lookup)
+
+async def _lookup_session(session_id: str) -> AIService:
     service = active_sessions.get(session_id)
+    if service and not session_store.shared:
+        # One process: the cached object is the only copy of the chat, so it is always current.
+        return service
+    try:
+        stored_version = await session_store.version(session_id)
+        if service and service.version == stored_version:
+            return service
+        # Not here, or another worker has served a turn since: take the stored state if there is one.
+        stored = await session_store.load(session_id) if stored_version is not None else None
+        if stored:
+            service = AIService.from_state(*stored)
+            active_sessions[session_id] = service
+            session_restores["store"] += 1
+            return service
+        service = None
+    except Exception as e:
+        # Without the store, the local copy (if any) is the best there is.
+        log.error("Session store unavailable", extra={"session_id": session_id, "error": str(e)})
 
     if not service:
-        # ... (the code for restoring a session remains the same)
-        print(f"Session {session_id} not in memory. Attempting to restore from DB.")
-        session_details = db.get_session_details(session_id)
+        log.info("Session not in memory or the session store. Attempting to restore from DB.", extra={"session_id": session_id})
+        if message_log.has_pending(session_id):
+            await message_log.flush()
+        session_details = await db.get_session_details_async(session_id)
         if session_details and 'messages' in session_details:
             user_id = str(session_details["user_id"])
-            service = AIService.from_existing_session(user_id, session_id, session_details['messages'])
+            service = AIService.from_existing_session(
+                user_id, session_id, session_details['messages'],
+                session_details.get('context_summary'), session_details.get('context_summary_turns') or 0,
+                session_details.get('final_esi_level'), session_details.get('created_at'),
+                session_details.get('llm_usage'),
+            )
+            await service.persist()
             active_sessions[session_id] = service
+            session_restores["database"] += 1
         else:
             raise HTTPException(status_code=404, detail="Session not found in memory or database.")
+    return service
 
+@app.post("/chat/message")
+async def send_message(
+    session_id: str = Form(...),
+    user_message: str = Form(...),
+    image: UploadFile = File(None),
+    idempotency_key: str | None = Header(None),
+):
+    """
+    Sends a patient message and returns the complete reply. Turns of one session run
+    in arrival order. A retry that carries the same Idempotency-Key header as a request
+    still in flight, or answered in the last IDEMPOTENCY_TTL_SECONDS, gets that reply
+    (marked `Idempotent-Replayed: true`) without another Gemini call. Without a key,
+    an identical message to the same session joins one that is still in flight.
+    """
     image_bytes = await image.read() if image else None # Use await for reading the file
     image_content_type = image.content_type if image else None
 
-    # Use await to call the new async service function
-    return await service.get_non_streamed_response(user_message, image_bytes, image_content_type)
+    async def turn():
+        service = await get_or_restore_session(session_id)
+        timer = StageTimer()
+        result = await service.get_non_streamed_response(user_message, image_bytes, image_content_type, timer)
+        active_sessions.refresh_size(session_id)
+        return result, timer.server_timing_header()
+
+    if idempotency_key:
+        key = (session_id, "key", idempotency_key)
+    else:
+        key = (session_id, "message", fingerprint(user_message, image_bytes))
+    (result, server_timing), shared = await chat_requests.run(
+        key, turn, remember=bool(idempotency_key), keep=lambda outcome: outcome[0]["response_text"] != ERROR_REPLY,
+    )
+    headers = {"Server-Timing": server_timing}
+    if shared:
+        headers["Idempotent-Replayed"] = "true"
+    return JSONResponse(result, headers=headers)
+
+@app.post("/chat/message/stream")
+async def send_message_stream(
+    session_id: str = Form(...),
+    user_message: str = Form(...),
+    image: UploadFile = File(None)
+):
+    """
+    Same as /chat/message, but streams the reply as Server-Sent Events: `token`
+    events as Gemini produces text, then a final `done` (or `error`) event with
+    the full response text, ESI level and completion status.
+    """
+    service = await get_or_restore_session(session_id)
+
+    image_bytes = await image.read() if image else None
+    image_content_type = image.content_type if image else None
+
+    events = service.stream_response(user_message, image_bytes, image_content_type)
+    # Wait for the first event before answering, so a message Gemini can't take yet still gets a 429.
+    first_event = await anext(events)
+
+    async def event_stream():
+        yield f"data: {json.dumps(first_event)}\n\n"
+        async for event in events:
+            yield f"data: {json.dumps(event)}\n\n"
+        active_sessions.refresh_size(session_id)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/chat/ws")
+async def chat_socket(websocket: WebSocket, session_id: str, stream: str | None = None, last_seq: int | None = None):
+    """
+    One connection for a whole chat. The session is looked up once, when the client
+    connects, and every turn on the connection goes straight to it.
+
+    Client frames are JSON: `{"type": "message", "id": ..., "text": ...}` sends a patient
+    message (add `"image_content_type"` and send the photo as the next, binary, frame),
+    and `{"type": "ping"}` is answered with `{"type": "pong"}`. The server sends `ready`
+    on connect, then for each message the same `token` / `done` / `error` events as
+    /chat/message/stream (tagged with its `id`; only `done` if the message had
+    `"stream": false`), plus `esi` when a level is recorded and
+    `summary_ready` once the summary and title are saved. Every one of these carries a
+    `seq`. The server pings after WS_HEARTBEAT_SECONDS without sending anything and
+    closes a connection that has been silent for WS_IDLE_TIMEOUT_SECONDS.
+
+    To resume after a drop, reconnect with the `stream` from `ready` and the last `seq`
+    received: missed events are replayed, and a message resent with the same `id` is not
+    answered twice. If `ready` says `resync`, they could not be, so reload the chat from
+    GET /session/{session_id}.
+    """
+    await websocket.accept()
+    try:
+        service = await get_or_restore_session(session_id)
+    except HTTPException as e:
+        await websocket.close(CLOSE_NOT_FOUND, reason=e.detail)
+        return
+    channel = chat_channels.open(session_id, service, after_turn=lambda: active_sessions.refresh_size(session_id))
+    await chat_channels.serve(websocket, channel, stream, last_seq)
 
 @app.post("/chat/end", status_code=204)
 async def end_chat(request: EndChatRequest):
-    service = active_sessions.get(request.session_id)
-    if service:
-        del active_sessions[request.session_id]
-        print(f"Session {request.session_id} ended and cleaned up from memory.")
+    await chat_channels.close(request.session_id)
+    await message_log.flush()
+    await session_store.delete(request.session_id)
+    if active_sessions.pop(request.session_id):
+        log.info("Session ended and cleaned up from memory", extra={"session_id": request.session_id})
     return Response(status_code=204)
 
 @app.get("/session/{session_id}", response_model=dict)
-async def get_session(session_id: str):
-    details = db.get_session_details(session_id)
+async def get_session(
+    session_id: str,
+    response: Response,
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None
+):
+    """
+    The session with its latest `limit` messages (oldest first). To load older
+    messages, pass the returned `next_cursor` (also sent as X-Next-Cursor) as `cursor`;
+    a cursor without a limit gets MESSAGE_PAGE_SIZE messages. With neither, the whole
+    history is returned, as clients that don't paginate expect.
+    """
+    if message_log.has_pending(session_id):
+        await message_log.flush()
+    if limit is None and cursor is not None:
+        limit = MESSAGE_PAGE_SIZE
+    try:
+        details = await db.get_session_details_async(session_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not details:
         raise HTTPException(status_code=404, detail="Session not found.")
+    if details["next_cursor"]:
+        response.headers["X-Next-Cursor"] = details["next_cursor"]
     return details
 
+@app.get("/session/{session_id}/usage", response_model=dict)
+async def get_session_usage(session_id: str):
+    """
+    The session's Gemini usage: calls, prompt and output tokens, seconds spent waiting on
+    Gemini and the estimated cost, in total and per task. Live while the chat is open here.
+    """
+    service = active_sessions.get(session_id)
+    if service:
+        return service.usage.to_dict()
+    details = await db.get_session_details_async(session_id, 1)
+    if not details:
+        raise HTTPException(status_code=404, detail="Session not found.")
+    return SessionUsage.from_dict(details.get("llm_usage")).to_dict()
+
 @app.get("/sessions/user/{user_id}", response_model=list[dict])
-async def get_user_sessions(user_id: str):
-    sessions = db.get_sessions_for_user(user_id)
-    if sessions is None:
+async def get_user_sessions(
+    user_id: str,
+    response: Response,
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None
+):
+    """
+    One page of the user's sessions, newest first, without summary bodies. When there
+    are more, the X-Next-Cursor header holds the `cursor` for the next page; a cursor
+    without a limit gets SESSION_PAGE_SIZE sessions. With neither, every session is
+    returned, as clients that don't paginate expect.
+    """
+    if limit is None and cursor is not None:
+        limit = SESSION_PAGE_SIZE
+    try:
+        page = await db.get_sessions_for_user_async(user_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page is None:
         return []
-    return sessions
+    if page["next_cursor"]:
+        response.headers["X-Next-Cursor"] = page["next_cursor"]
+    return page["sessions"]
 
 @app.get("/session/{session_id}/summary/pdf")
-async def get_pdf_summary(session_id: str):
-    session_details = db.get_session_details(session_id)
+async def get_pdf_summary(session_id: str, if_none_match: str | None = Header(None)):
+    session_details = await db.get_session_summary_async(session_id)
     if not session_details or not session_details.get("session_summary"):
         raise HTTPException(status_code=404, detail="Summary not found for this session. Complete the assessment first.")
-    
-    pdf_bytes = pdf_service.create_summary_pdf(
-        summary_text=session_details["session_summary"],
-        session_id=session_id,
-        user_id=str(session_details["user_id"])
-    )
-    headers = {'Content-Disposition': f'attachment; filename="summary_{session_id}.pdf"'}
+
+    user_id = str(session_details["user_id"])
+    summary_text = session_details["session_summary"]
+    # Browsers revalidate with the ETag; an unchanged summary costs one narrow query and no rendering.
+    headers = {"ETag": summary_etag(session_id, user_id, summary_text), "Cache-Control": "private, no-cache"}
+    if if_none_match and headers["ETag"] in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    pdf_bytes, _ = await pdf_cache.get_or_render(session_id, user_id, summary_text)
+    headers['Content-Disposition'] = f'attachment; filename="summary_{session_id}.pdf"'
     return Response(content=pdf_bytes, media_type='application/pdf', headers=headers)
 
+@app.post("/sessions/export")
+async def export_summaries(request: ExportSummariesRequest):
+    """
+    Streams a ZIP with the summary PDF of every summarized session for a patient,
+    a list of sessions and/or a created_at range. PDFs are rendered in parallel and
+    added to the archive as they finish.
+    """
+    if not request.user_id and not request.session_ids:
+        raise HTTPException(status_code=400, detail="Provide a user_id or a list of session_ids.")
+
+    rows = await db.get_session_summaries_async(
+        request.user_id, request.session_ids,
+        request.created_from.isoformat() if request.created_from else None,
+        request.created_to.isoformat() if request.created_to else None,
+    )
+    if not rows:
+        raise HTTPException(status_code=404, detail="No summaries found for this export.")
+
+    file_name = f"summaries_{request.user_id or 'sessions'}.zip"
+    return StreamingResponse(
+        stream_summaries_zip(rows),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{file_name}"'}
+    )
+
 @app.delete("/session/{session_id}", status_code=204)
 async def delete_session(session_id: str):
     if session_id in active_sessions:
         del active_sessions[session_id]
+    await session_store.delete(session_id)
+    message_log.discard(session_id)
+    pdf_cache.discard(session_id)
 
-    success = db.delete_session_from_db(session_id)
+    success = await db.delete_session_from_db_async(session_id)
 
     if not success:
         raise HTTPException(
@@ -129,11 +442,112 @@ async def delete_session(session_id: str):
     
     return Response(status_code=204)
 
+def internal_stats() -> dict:
+    return {
+        "session_cache": active_sessions.stats(),
+        "session_store": {**session_store.stats(), "restored_from": dict(session_restores)},
+        "image_pipeline": image_pipeline.stats(),
+        "chat_turns": turn_stats.stats(),
+        "emergency_fast_path": fast_path_stats.stats(),
+        "startup": warmup.stats(),
+        "admission": admission.stats(),
+        "duplicate_messages": chat_requests.stats(),
+        "websockets": chat_channels.stats(),
+        "resilience": {"gemini": resilience.gemini.stats(), "supabase": resilience.supabase.stats()},
+        "pdf_cache": pdf_cache.stats(),
+        "pdf_renderer": pdf_renderer.stats(),
+        "read_cache": {
+            "session_details": db.session_details_cache.stats(),
+            "user_sessions": db.user_sessions_cache.stats(),
+        },
+        "background_jobs": background_jobs.stats(),
+        "message_buffer": message_log.stats(),
+        "retention": retention.stats(),
+        "analytics": triage_analytics.stats(),
+        "llm_usage": usage_stats.stats(),
+    }
+
+# The same numbers, as gauges on /metrics.
+metrics.register_stats(internal_stats)
+
+async def require_internal_token(x_internal_token: str | None = Header(None)):
+    """Lets a request through to /internal/* only if it carries INTERNAL_API_TOKEN."""
+    if not INTERNAL_API_TOKEN:
+        if USE_FAKE_BACKENDS:
+            return
+        raise HTTPException(status_code=403, detail="Internal endpoints are disabled; set INTERNAL_API_TOKEN.")
+    if not x_internal_token or not hmac.compare_digest(x_internal_token.encode(), INTERNAL_API_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid internal token.")
+
+internal = APIRouter(prefix="/internal", dependencies=[Depends(require_internal_token)])
+
+@internal.get("/stats")
+async def get_internal_stats():
+    return internal_stats()
+
+@app.get("/analytics/triage")
+async def get_triage_analytics(start: date | None = Query(None), end: date | None = Query(None)):
+    """
+    ESI distribution, time to triage, and session and message volume for the days from
+    `start` to `end` (UTC, inclusive; the last 30 days by default), as totals and per day.
+    """
+    end = end or datetime.now(timezone.utc).date()
+    start = start or end - timedelta(days=29)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end.")
+    if (end - start).days >= 3660:
+        raise HTTPException(status_code=400, detail="The range can be at most ten years.")
+    result = await triage_analytics.query(start, end)
+    if result is None:
+        raise HTTPException(status_code=503, detail="Analytics are unavailable.")
+    return result
+
+@internal.get("/usage/sessions", response_model=list[dict])
+async def get_top_usage_sessions(
+    order: str = Query("tokens", pattern="^(tokens|seconds)$"),
+    limit: int = Query(SESSION_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    """The sessions that used the most Gemini tokens or time, heaviest first."""
+    sessions = await db.get_top_usage_sessions_async(order, limit)
+    if sessions is None:
+        raise HTTPException(status_code=503, detail="Usage is unavailable.")
+    return sessions
+
+@internal.post("/analytics/rebuild", status_code=202)
+async def rebuild_triage_analytics():
+    """Recomputes the analytics for every day before today from the sessions and messages tables, in the background."""
+    if not triage_analytics.start_rebuild():
+        raise HTTPException(status_code=409, detail="A rebuild is already in progress.")
+    return {"message": "Analytics rebuild started."}
+
+@internal.post("/retention/run", status_code=202)
+async def run_retention(dry_run: bool = Query(False)):
+    """Starts a retention run in the background; its progress is under "retention" in /internal/stats."""
+    if not retention.start(dry_run):
+        raise HTTPException(status_code=409, detail="A retention run is already in progress.")
+    return retention.stats()
+
+app.include_router(internal)
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and its event loop is responding."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 200 once every backend client and worker pool is warmed up, 503 before that and while stopping."""
+    body = {"status": "ready" if warmup.ready else ("stopping" if warmup.stopping else "warming_up"), **warmup.stats()}
+    return JSONResponse(body, status_code=200 if warmup.ready else 503)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus scrape endpoint: request and stage histograms, token and ESI counters, and the stats gauges."""
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
+
 @app.post("/session/{session_id}/generate-title", status_code=202)
 async def generate_title(session_id: str):
-    service = active_sessions.get(session_id)
-    if not service:
-        raise HTTPException(status_code=404, detail="Session not found.")
-    import asyncio
-    asyncio.create_task(service.generate_and_save_title())
+    service = await get_or_restore_session(session_id)
+    background_jobs.enqueue(f"title:{session_id}", service.generate_and_save_title)
     return {"message": "Title generation initiated."}
\ No newline at end of file
@@ -0,0 +1,207 @@
+# ai_assistant/message_buffer.py
+
+import asyncio
+import pytz
+from datetime import datetime
+
+import database_service as db
+from analytics import triage_analytics
+from structured_log import get_logger
+from config import (
+    MESSAGE_BUFFER_MAX_ROWS, MESSAGE_BUFFER_FLUSH_SECONDS,
+    MESSAGE_BUFFER_MAX_RETRIES, MESSAGE_BUFFER_MAX_PENDING, MESSAGE_BUFFER_MAX_ROW_FAILURES,
+)
+
+log = get_logger(__name__)
+
+# Bookkeeping kept on a queued row that is not an ai_messages column.
+_FAILURES = "_failed_flushes"
+
+class MessageLogBuffer:
+    """
+    Write-behind buffer for ai_messages rows. Messages are stamped when they are
+    added and written in arrival order as multi-row inserts, so the order of
+    messages within a session is kept even though the write happens later.
+
+    A batch that still fails after its retries is split in halves, down to single
+    rows, so rows the database rejects (e.g. for a session deleted meanwhile) don't
+    hold back everyone else's. If nothing in the batch could be written, the database
+    is taken to be down and every row is kept. A row that fails on its own while
+    others are written is dropped, and logged, after `max_row_failures` flushes.
+    """
+
+    def __init__(self, max_rows: int = MESSAGE_BUFFER_MAX_ROWS, flush_interval: float = MESSAGE_BUFFER_FLUSH_SECONDS,
+                 max_retries: int = MESSAGE_BUFFER_MAX_RETRIES, max_pending: int = MESSAGE_BUFFER_MAX_PENDING,
+                 max_row_failures: int = MESSAGE_BUFFER_MAX_ROW_FAILURES):
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+        self.max_row_failures = max_row_failures
+        self.rejected_rows = 0
+        self._pending: list[dict] = []
+        self._flush_lock: asyncio.Lock | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._flusher: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def add(self, session_id: str, sender: str, message_content: str, image_url: str | asyncio.Future | None = None):
+        """
+        Queues a message row. Must be called from inside the running event loop.
+
+        `image_url` may be a future for an upload still in progress. The row (and every
+        row queued after it) is written once the future resolves; a failed upload
+        leaves the row's image_url empty.
+        """
+        self._ensure_started()
+        self._pending.append({
+            "session_id": session_id, "sender": sender,
+            "message_content": message_content, "image_url": image_url,
+            "timestamp": datetime.now(pytz.utc).isoformat(),
+        })
+        if len(self._pending) >= self.max_rows:
+            self._wakeup.set()
+
+    def stats(self) -> dict:
+        return {"pending_rows": len(self._pending), "rejected_rows": self.rejected_rows}
+
+    def has_pending(self, session_id: str) -> bool:
+        return any(row["session_id"] == session_id for row in self._pending)
+
+    def discard(self, session_id: str):
+        """Drops queued rows for a session that is being deleted so they cannot fail the batch."""
+        self._pending = [row for row in self._pending if row["session_id"] != session_id]
+
+    async def flush(self):
+        """Writes every queued row. Rows that could not be written go back to the front of the queue for the next flush."""
+        self._ensure_started()
+        async with self._flush_lock:
+            unwritten = []
+            try:
+                while self._pending:
+                    batch = self._pending[:self.max_rows]
+                    del self._pending[:len(batch)]
+                    await _resolve_image_urls(batch)
+                    failed, database_up = await self._write(batch)
+                    unwritten += failed
+                    if not database_up:
+                        break
+            finally:
+                if unwritten:
+                    self._pending[0:0] = unwritten
+                    self._drop_overflow()
+
+    async def _write(self, batch: list[dict]) -> tuple[list[dict], bool]:
+        """
+        Writes a batch, isolating the rows that fail if the whole batch can't be written.
+        Returns the rows to try again at the next flush, and whether any row was written.
+        """
+        if await self._write_with_retry(batch):
+            return [], True
+        written, failed = await self._isolate(batch) if len(batch) > 1 else (0, batch)
+        if not written:
+            log.error("Message flush failed; keeping the rows for the next flush", extra={
+                "attempts": self.max_retries, "rows": len(batch),
+            })
+            return batch, False
+        retry = []
+        for row in failed:
+            row[_FAILURES] = row.get(_FAILURES, 0) + 1
+            if row[_FAILURES] < self.max_row_failures:
+                retry.append(row)
+                continue
+            self.rejected_rows += 1
+            log.error("Dropped a message the database keeps rejecting", extra={
+                "session_id": row["session_id"], "sender": row["sender"], "timestamp": row["timestamp"],
+                "flushes": row[_FAILURES],
+            })
+        return retry, True
+
+    async def _isolate(self, rows: list[dict]) -> tuple[int, list[dict]]:
+        """
+        Writes each half of `rows` once, splitting the halves that fail in turn.
+        Returns how many rows were written and the rows that failed on their own.
+        """
+        written, failed = 0, []
+        middle = len(rows) // 2
+        for half in (rows[:middle], rows[middle:]):
+            if await self._insert(half):
+                written += len(half)
+            elif len(half) == 1:
+                failed += half
+            else:
+                half_written, half_failed = await self._isolate(half)
+                written += half_written
+                failed += half_failed
+        return written, failed
+
+    async def _write_with_retry(self, batch: list[dict]) -> bool:
+        for attempt in range(self.max_retries):
+            if await self._insert(batch):
+                return True
+            await asyncio.sleep(0.2 * 2 ** attempt)
+        return False
+
+    async def _insert(self, rows: list[dict]) -> bool:
+        if not await db.log_messages_async([{k: v for k, v in row.items() if k != _FAILURES} for row in rows]):
+            return False
+        triage_analytics.record_messages(row["timestamp"] for row in rows)
+        return True
+
+    def _drop_overflow(self):
+        # Only reached while the database keeps failing; bound memory rather than grow forever.
+        overflow = len(self._pending) - self.max_pending
+        if overflow > 0:
+            del self._pending[:overflow]
+            log.error("Message buffer full; dropped the oldest unsaved messages", extra={"dropped": overflow})
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # asyncio primitives belong to one loop, so rebuild them if the app restarts on a new one.
+            self._loop = loop
+            self._flush_lock = asyncio.Lock()
+            self._wakeup = asyncio.Event()
+            self._flusher = None
+        if self._flusher is None or self._flusher.done():
+            self._flusher = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                log.error("Error flushing message buffer", extra={"error": str(e)})
+
+    async def stop(self):
+        """Stops the background flusher and writes whatever is still queued."""
+        if self._flusher and not self._flusher.done():
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+        self._flusher = None
+        if self._pending:
+            async with self._flush_lock:
+                batch, self._pending = self._pending, []
+                await _resolve_image_urls(batch)
+                for start in range(0, len(batch), self.max_rows):
+                    await self._write(batch[start:start + self.max_rows])
+
+async def _resolve_image_urls(batch: list[dict]):
+    """Replaces pending upload futures in the rows with their URL, or None if the upload failed."""
+    for row in batch:
+        if isinstance(row["image_url"], asyncio.Future):
+            try:
+                row["image_url"] = await row["image_url"]
+            except Exception as e:
+                log.error("Image upload for a message failed", extra={"session_id": row["session_id"], "error": str(e)})
+                row["image_url"] = None
+
+message_log = MessageLogBuffer()
@@ -0,0 +1,130 @@
+# ai_assistant/metrics.py
+
+import functools
+import inspect
+import re
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+# Latencies here range from sub-millisecond cache hits to multi-second Gemini replies.
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REQUEST_SECONDS = Histogram(
+    "medibridge_http_request_duration_seconds", "HTTP request latency, until the last body byte is sent.",
+    ["method", "route", "status"], buckets=_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "medibridge_stage_duration_seconds", "Time spent in one stage of a request or background job.",
+    ["stage"], buckets=_BUCKETS,
+)
+GEMINI_TOKENS = Counter(
+    "medibridge_gemini_tokens_total", "Gemini tokens reported in response usage metadata.",
+    ["purpose", "kind"],
+)
+ESI_LEVELS = Counter("medibridge_esi_level_total", "Triage results by ESI level.", ["level"])
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+@contextmanager
+def stage(name: str):
+    """Times the enclosed block as one observation of `name` in the stage histogram."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+def timed(name: str):
+    """Decorator form of `stage`, for both plain and async functions."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_usage(response, purpose: str):
+    """Adds a Gemini response's prompt and output token counts to the usage counters."""
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return
+    prompt_tokens = getattr(usage, "prompt_token_count", None)
+    output_tokens = getattr(usage, "candidates_token_count", None)
+    if prompt_tokens:
+        GEMINI_TOKENS.labels(purpose, "prompt").inc(prompt_tokens)
+    if output_tokens:
+        GEMINI_TOKENS.labels(purpose, "output").inc(output_tokens)
+
+_NON_METRIC_CHARS = re.compile(r"[^a-zA-Z0-9_]")
+
+def _numeric_fields(stats: dict, prefix: str = ""):
+    for key, value in stats.items():
+        name = _NON_METRIC_CHARS.sub("_", f"{prefix}{key}")
+        if isinstance(value, dict):
+            yield from _numeric_fields(value, f"{name}_")
+        elif isinstance(value, (int, float)):
+            yield name, float(value)
+
+class StatsCollector:
+    """
+    Publishes the numbers the components already keep for /internal/stats (session
+    cache, read caches, PDF cache, image pipeline, fast path...) as gauges. They are
+    read when Prometheus scrapes, so nothing extra happens on the request path.
+    """
+
+    def __init__(self, stats_source):
+        self._stats_source = stats_source
+
+    def collect(self):
+        for name, value in _numeric_fields(self._stats_source()):
+            yield GaugeMetricFamily(f"medibridge_{name}", f"{name.replace('_', ' ')} (from /internal/stats)", value=value)
+
+def register_stats(stats_source):
+    REGISTRY.register(StatsCollector(stats_source))
+
+def render() -> tuple[bytes, str]:
+    """The current metrics in the Prometheus text format, with its content type."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware that records every HTTP request in REQUEST_SECONDS, labelled
+    with the route template (not the raw path, so session ids don't explode the series).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            REQUEST_SECONDS.labels(
+                scope["method"], getattr(route, "path", "unmatched"), str(status)
+            ).observe(time.perf_counter() - started)
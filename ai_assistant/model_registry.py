@@ -0,0 +1,95 @@
+# ai_assistant/model_registry.py
+
+import threading
+
+import config
+from structured_log import get_logger
+
+log = get_logger(__name__)
+
+# The model every task uses unless told otherwise.
+DEFAULT_MODEL = config.GEMINI_MODEL
+# The smaller, faster and cheaper model for the tasks in LIGHT_TASKS.
+LIGHT_MODEL = config.GEMINI_LIGHT_MODEL
+# Gemini calls are named by task ("triage", "confirm", "summary", "title", "context").
+LIGHT_TASKS = frozenset(task.strip() for task in config.LIGHT_MODEL_TASKS.split(",") if task.strip())
+
+# List prices in USD per million (prompt, output) tokens, for cost estimates only.
+PRICES_PER_MILLION = {
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+}
+
+# The class models are built from. google.generativeai takes longer to import than the
+# rest of the app put together, so it is imported and configured on first use (or by the
+# start-up warm-up), not at import. Benchmarks may put a stand-in here.
+model_class = None
+_load_lock = threading.Lock()
+
+# Preconfigured models shared by every session, keyed by (model name, system prompt).
+_models: dict[tuple[str, str | None], object] = {}
+# Fault settings shared by every fake model, so a test can turn them up in one place.
+_fake_faults = None
+
+def load_client():
+    """Imports the Gemini client library and configures the API key, once. Safe to call from any thread."""
+    global model_class
+    if config.USE_FAKE_BACKENDS:
+        return
+    with _load_lock:
+        if model_class is None:
+            import google.generativeai as genai
+            genai.configure(api_key=config.GEMINI_API_KEY)
+            model_class = genai.GenerativeModel
+            log.info("Gemini API configured successfully.")
+
+def model_for(task: str) -> str:
+    """The name of the model that runs `task`."""
+    return LIGHT_MODEL if task in LIGHT_TASKS else DEFAULT_MODEL
+
+def estimate_cost(model_name: str, prompt_tokens: int, output_tokens: int) -> float:
+    """The list price of a call in USD, or 0 for a model with no known price."""
+    prompt_price, output_price = PRICES_PER_MILLION.get(model_name, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + output_tokens * output_price) / 1_000_000
+
+def get_model(model_name: str = DEFAULT_MODEL, system_instruction: str | None = None):
+    """
+    Returns the process-wide GenerativeModel for this name and system prompt,
+    creating it on first use. Models hold no conversation state, so one instance
+    serves every session; each turn starts its own lightweight ChatSession.
+    """
+    key = (model_name, system_instruction)
+    model = _models.get(key)
+    if model is None:
+        model = _models[key] = _new_model(model_name, system_instruction)
+    return model
+
+def _new_model(model_name: str, system_instruction: str | None):
+    if config.USE_FAKE_BACKENDS:
+        global _fake_faults
+        from fake_backends import FakeGenerativeModel, FaultInjector
+        if _fake_faults is None:
+            _fake_faults = FaultInjector(
+                "gemini",
+                error_rate=config.FAKE_LLM_ERROR_RATE,
+                hang_rate=config.FAKE_LLM_HANG_RATE,
+                slow_rate=config.FAKE_LLM_SLOW_RATE,
+                slow_factor=config.FAKE_SLOW_FACTOR,
+                hang_seconds=config.FAKE_HANG_SECONDS,
+            )
+        speed = config.FAKE_LLM_LIGHT_LATENCY_FACTOR if model_name == LIGHT_MODEL else 1.0
+        return FakeGenerativeModel(
+            model_name, system_instruction,
+            latency=config.FAKE_LLM_LATENCY_SECONDS * speed,
+            tokens_per_second=config.FAKE_LLM_TOKENS_PER_SECOND / speed if speed else 0.0,
+            esi_level=config.FAKE_LLM_ESI_LEVEL,
+            esi_after_turns=config.FAKE_LLM_ESI_AFTER_TURNS,
+            faults=_fake_faults,
+        )
+    if model_class is None:
+        load_client()
+    return model_class(model_name, system_instruction=system_instruction)
+
+def clear():
+    """Drops every cached model, e.g. after the API key is reconfigured."""
+    _models.clear()
@@ -0,0 +1,94 @@
+# ai_assistant/pdf_cache.py
+
+import asyncio
+import hashlib
+from collections import OrderedDict
+
+from config import PDF_CACHE_MAX_BYTES
+from pdf_export import pdf_renderer
+
+def summary_etag(session_id: str, user_id: str, summary_text: str) -> str:
+    """The ETag of a summary PDF: a hash of everything that is printed from the database."""
+    digest = hashlib.sha256(f"{session_id}\n{user_id}\n{summary_text}".encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+class PdfCache:
+    """
+    Size-bounded LRU cache of rendered summary PDFs, keyed by session id and the
+    summary's ETag. A new summary for a session gets a new ETag, so a stale PDF is
+    never served; it is simply replaced.
+    """
+
+    def __init__(self, max_bytes: int = PDF_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        # session_id -> (etag, pdf_bytes)
+        self._entries: OrderedDict[str, tuple[str, bytes]] = OrderedDict()
+        self._total_bytes = 0
+        self._rendering: dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, session_id: str, etag: str) -> bytes | None:
+        entry = self._entries.get(session_id)
+        if entry is None or entry[0] != etag:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(session_id)
+        return entry[1]
+
+    def put(self, session_id: str, etag: str, pdf_bytes: bytes):
+        self.discard(session_id)
+        if len(pdf_bytes) > self.max_bytes:
+            return
+        self._entries[session_id] = (etag, pdf_bytes)
+        self._total_bytes += len(pdf_bytes)
+        while self._total_bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._total_bytes -= len(evicted)
+            self.evictions += 1
+
+    def discard(self, session_id: str):
+        entry = self._entries.pop(session_id, None)
+        if entry:
+            self._total_bytes -= len(entry[1])
+
+    async def get_or_render(self, session_id: str, user_id: str, summary_text: str) -> tuple[bytes, str]:
+        """Returns (pdf_bytes, etag), rendering in the PDF process pool on a miss. Concurrent misses render once."""
+        etag = summary_etag(session_id, user_id, summary_text)
+        pdf_bytes = self.get(session_id, etag)
+        if pdf_bytes is not None:
+            return pdf_bytes, etag
+
+        key = f"{session_id}:{etag}"
+        rendering = self._rendering.get(key)
+        if rendering is None:
+            rendering = self._rendering[key] = asyncio.ensure_future(
+                pdf_renderer.render(summary_text, session_id, user_id)
+            )
+            try:
+                pdf_bytes = await rendering
+            finally:
+                del self._rendering[key]
+            self.put(session_id, etag, pdf_bytes)
+            return pdf_bytes, etag
+        return await asyncio.shield(rendering), etag
+
+    async def prerender(self, session_id: str, user_id: str, summary_text: str):
+        """Renders and caches a PDF ahead of the first download (run as a background job)."""
+        await self.get_or_render(session_id, user_id, summary_text)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+        }
+
+pdf_cache = PdfCache()
@@ -0,0 +1,139 @@
+# ai_assistant/pdf_export.py
+
+import asyncio
+import multiprocessing
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import PDF_WORKERS, PDF_EXPORT_WINDOW
+from metrics import timed
+from structured_log import get_logger
+
+log = get_logger(__name__)
+
+def _render(summary_text: str, session_id: str, user_id: str) -> bytes:
+    # pdf_service (and fpdf) are imported in the workers only, not in the web process.
+    import pdf_service
+    return pdf_service.create_summary_pdf(summary_text, session_id, user_id)
+
+def _preload():
+    import pdf_service
+
+class PdfRenderer:
+    """
+    Renders summary PDFs with pdf_service.create_summary_pdf in a process pool,
+    so fpdf's CPU work runs in parallel and never on the event loop thread. If a
+    worker dies, the broken pool is replaced and the PDF rendered once more.
+    """
+
+    def __init__(self, workers: int = PDF_WORKERS):
+        self.workers = workers
+        self._pool: ProcessPoolExecutor | None = None
+        self.pool_restarts = 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # "spawn" avoids forking a process that already runs database threads.
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def _replace_pool(self, broken: ProcessPoolExecutor):
+        """Drops a broken pool so the next call starts a new one; concurrent callers replace it only once."""
+        if self._pool is broken:
+            self._pool = None
+            self.pool_restarts += 1
+            log.warning("PDF worker pool broke; starting a new one")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def warm_up(self):
+        """Starts the worker processes now so the first PDF doesn't pay for spawning them."""
+        pool = self._get_pool()
+        for _ in range(self.workers):
+            pool.submit(_preload)
+
+    @timed("pdf_render")
+    async def render(self, summary_text: str, session_id: str, user_id: str) -> bytes:
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            pool = self._get_pool()
+            try:
+                return await loop.run_in_executor(pool, _render, summary_text, session_id, user_id)
+            except BrokenProcessPool:
+                self._replace_pool(pool)
+                if attempt:
+                    raise
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "pool_restarts": self.pool_restarts}
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+pdf_renderer = PdfRenderer()
+
+class _ChunkWriter:
+    """Minimal write-only file for ZipFile that hands back whatever was written since the last call."""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def export_file_name(row: dict) -> str:
+    created = str(row.get("created_at") or "")[:10]
+    return f"{created}_summary_{row['id']}.pdf" if created else f"summary_{row['id']}.pdf"
+
+async def stream_summaries_zip(rows: list[dict], renderer: PdfRenderer = pdf_renderer, window: int | None = None):
+    """
+    Yields a ZIP archive of one summary PDF per row, chunk by chunk. Each PDF is
+    added as soon as it finishes rendering, so the archive is never held in memory
+    and only `window` renders are in flight at once. Rows need `id`, `user_id`,
+    `session_summary` and optionally `created_at`.
+    """
+    window = window or renderer.workers * PDF_EXPORT_WINDOW
+    writer = _ChunkWriter()
+    # PDFs are already compressed, so storing them is as small as deflating and much cheaper.
+    archive = zipfile.ZipFile(writer, mode="w", compression=zipfile.ZIP_STORED)
+    remaining = iter(rows)
+    in_flight: dict[asyncio.Future, dict] = {}
+
+    def submit_next():
+        row = next(remaining, None)
+        if row is not None:
+            future = asyncio.ensure_future(renderer.render(row["session_summary"], str(row["id"]), str(row["user_id"])))
+            in_flight[future] = row
+
+    try:
+        for _ in range(window):
+            submit_next()
+        while in_flight:
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                row = in_flight.pop(future)
+                submit_next()
+                try:
+                    pdf_bytes = future.result()
+                except Exception as e:
+                    log.error("Error rendering PDF", extra={"session_id": row["id"], "error": str(e)})
+                    continue
+                archive.writestr(export_file_name(row), pdf_bytes)
+                yield writer.take()
+        archive.close()
+        yield writer.take()
+    finally:
+        # The client may disconnect mid-download; don't leave renders running for nobody.
+        for future in in_flight:
+            future.cancel()
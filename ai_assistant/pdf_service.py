@@ -1,18 +1,55 @@
 # ai_assistant/pdf_service.py
 
 from fpdf import FPDF
+from fpdf.image_parsing import get_img_info
 from datetime import datetime
+import functools
+import hashlib
+import io
+import os
 import pytz # Used for getting the correct timezone
+from structured_log import get_logger
+
+log = get_logger(__name__)
+
+LOGO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logo.png')
+
+@functools.cache
+def _logo_bytes() -> bytes | None:
+    """Reads the logo once per process instead of on every page of every PDF."""
+    try:
+        with open(LOGO_PATH, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        log.warning("logo.png not found. Skipping logo in PDF header.")
+        return None
+
+@functools.cache
+def _logo_image() -> tuple[str, dict] | None:
+    """
+    Decodes the logo once per process (most of a summary's render time otherwise).
+    Returns the key fpdf caches it under, the MD5 of its bytes, and its image info.
+    """
+    logo = _logo_bytes()
+    if not logo:
+        return None
+    name = hashlib.md5(logo.strip(), usedforsecurity=False).hexdigest()
+    return name, get_img_info(name, io.BytesIO(logo))
 
 class PDF(FPDF):
     def header(self):
         # --- Header with Logo and Title ---
-        try:
+        logo = _logo_image()
+        if logo:
+            name, info = logo
+            if name not in self.image_cache.images:
+                # A per-document copy: the index and usage count belong to this PDF, the decoded data is shared.
+                self.image_cache.images[name] = type(info)(
+                    info, i=len(self.image_cache.images) + 1, usages=0, iccp_i=None
+                )
             # Add the logo image. It's positioned 10mm from the left, 8mm from the top, and is 33mm wide.
             # The link points to your website, making the logo clickable.
-            self.image('logo.png', 10, 8, 33, link='https://your-medibridge-website.com')
-        except FileNotFoundError:
-            print("Warning: logo.png not found. Skipping logo in PDF header.")
+            self.image(io.BytesIO(_logo_bytes()), 10, 8, 33, link='https://your-medibridge-website.com')
         
         # Set font for the title
         self.set_font('Arial', 'B', 20)
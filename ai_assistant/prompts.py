@@ -11,6 +11,23 @@ INITIAL_GREETING = (
     "To begin, how can I help you today?"
 )
 
+# Sent straight away when the local emergency check matches, before Gemini has
+# answered. Gemini confirms the ESI level in the background.
+EMERGENCY_HANDOVER_MESSAGE = (
+    "This sounds like a medical emergency. Please call your local emergency number (911 in the Philippines) "
+    "right now, or have someone take you to the nearest emergency room. Do not wait for further advice here.\n\n"
+    "Please see the options below in the MediBridge app to find the nearest emergency care center now.\n"
+    "Final ESI Level: 1"
+)
+
+CRISIS_SUPPORT_MESSAGE = (
+    "I hear how much pain you're in, and it's incredibly brave of you to share that. "
+    "Please know that your life is valuable and help is available right now. "
+    "I strongly urge you to talk to someone immediately, whether it's a friend, family member, or a professional. "
+    "You can call the NCMH Crisis Hotline at 1553 at any time, or 911 if you are in immediate danger.\n"
+    "Final ESI Level: 1"
+)
+
 # This is the main "constitution" or system instruction for the AI model.
 TRIAGE_SYSTEM_PROMPT = """
 You are 'Villamor', a professional, empathetic, and safe AI Health Assistant from MediBridge in Cebu City, Philippines. Your primary goal is to act like a virtual triage nurse, rapidly and safely assessing medical urgency.
@@ -73,9 +90,12 @@ After you provide a `Final ESI Level:`, the user may continue the conversation.
 </follow_up_rules>
 """
 
-# This prompt is used by the _generate_and_save_summary function to create the clinical note for the PDF.
-SUMMARY_PROMPT = """
-Based on the following complete patient-AI conversation history, generate a concise and objective clinical note in the third person for a doctor to review. The note must include the patient's reported symptoms, any mentioned duration or severity, and the final ESI Triage Level that was assessed in the conversation.
+# This prompt is used by generate_and_save_summary_and_title to create both the
+# clinical note for the PDF and the sidebar title in a single call.
+SUMMARY_AND_TITLE_PROMPT = """
+Based on the following complete patient-AI conversation history, respond with a JSON object containing two fields:
+- "summary": a concise and objective clinical note in the third person for a doctor to review. The note must include the patient's reported symptoms, any mentioned duration or severity, and the final ESI Triage Level that was assessed in the conversation.
+- "title": a concise, clinical, 3-5 word title that captures the main symptom or reason for the chat. Examples: "Severe Headache and Dizziness", "Follow-up on Ankle Injury", "Questions About Medication".
 
 CONVERSATION HISTORY:
 {history}
@@ -88,4 +108,17 @@ Examples: "Severe Headache and Dizziness", "Follow-up on Ankle Injury", "Questio
 
 CONVERSATION HISTORY:
 {history}
-"""
\ No newline at end of file
+"""
+
+# Used by AIService.fold_context to keep a rolling summary of the turns that no
+# longer fit in the context window.
+CONTEXT_SUMMARY_PROMPT = """
+You are maintaining a running summary of a patient's triage chat with a nurse assistant. Update the existing summary with the new conversation excerpt below.
+Keep every clinically relevant detail: symptoms, onset, duration, severity, medications, allergies, relevant history, answers to the nurse's questions, and any ESI level already given. Drop greetings and small talk. Write plain third-person prose of at most 200 words.
+
+EXISTING SUMMARY:
+{summary}
+
+NEW CONVERSATION EXCERPT:
+{history}
+"""
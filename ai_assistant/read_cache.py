@@ -0,0 +1,81 @@
+# ai_assistant/read_cache.py
+
+import threading
+import time
+from typing import Callable
+
+from cachetools import TTLCache
+
+from config import READ_CACHE_TTL_SECONDS, READ_CACHE_MAX_ENTRIES
+
+class ReadThroughCache:
+    """
+    Thread-safe, size- and TTL-bounded read-through cache for database reads.
+
+    Loaders run on the database thread pool, so access is guarded by a lock.
+    Cached values are shared between callers and must be treated as read-only.
+    `None` results (not found or a failed query) are never cached.
+    """
+
+    def __init__(self, name: str, maxsize: int = READ_CACHE_MAX_ENTRIES, ttl: float = READ_CACHE_TTL_SECONDS):
+        self.name = name
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._load_seconds = 0.0
+        # Bumped by every invalidation, so a load that raced with a write is not stored.
+        self._generation = 0
+
+    def get_or_load(self, key, loader: Callable):
+        with self._lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            self.misses += 1
+            generation = self._generation
+
+        started = time.perf_counter()
+        value = loader()
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._load_seconds += elapsed
+            if value is not None and generation == self._generation:
+                self._cache[key] = value
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            if self._cache.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def invalidate_where(self, predicate: Callable) -> int:
+        """Drops every entry for which `predicate(key, value)` is true. Used when the exact key isn't known."""
+        with self._lock:
+            self._generation += 1
+            stale = [key for key, value in self._cache.items() if predicate(key, value)]
+            for key in stale:
+                del self._cache[key]
+            self.invalidations += len(stale)
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        avg_load_ms = self._load_seconds / self.misses * 1000 if self.misses else 0.0
+        return {
+            "entries": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "invalidations": self.invalidations,
+            "avg_load_ms": round(avg_load_ms, 2),
+            # Every hit skipped a query that costs about as much as an average miss.
+            "est_saved_ms": round(self.hits * avg_load_ms, 1),
+        }
@@ -0,0 +1,73 @@
+# ai_assistant/request_dedup.py
+
+import asyncio
+import hashlib
+from typing import Awaitable, Callable
+
+from cachetools import TTLCache
+
+from config import IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_MAX_ENTRIES
+
+def fingerprint(*parts: str | bytes | None) -> str:
+    """A digest of a request's content, for spotting an identical resubmission."""
+    digest = hashlib.sha256()
+    for part in parts:
+        data = part.encode() if isinstance(part, str) else (part or b"")
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()
+
+class RequestCoalescer:
+    """
+    Runs a request once per key. A request whose key matches one still in flight waits
+    for it and shares its result; with `remember`, one whose key matches a request that
+    completed in the last `ttl` seconds gets the stored result back. Either way the work,
+    a paid Gemini call, is not done twice.
+
+    Only results that `keep` accepts are remembered, and a request that raised is
+    forgotten, so retrying after an error really retries. The work runs in its own task,
+    so a client that gives up does not cancel it for the others waiting on it.
+    """
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL_SECONDS, max_entries: int = IDEMPOTENCY_MAX_ENTRIES):
+        self._completed = TTLCache(maxsize=max_entries, ttl=ttl)
+        self._in_flight: dict[tuple, asyncio.Task] = {}
+        self.executed = 0
+        self.joined_in_flight = 0
+        self.replayed = 0
+
+    async def run(self, key: tuple, work: Callable[[], Awaitable], remember: bool = True,
+                  keep: Callable[[object], bool] = lambda result: True) -> tuple[object, bool]:
+        """Returns `(result, shared)`, where `shared` is True if an earlier request's result was reused."""
+        if remember and key in self._completed:
+            self.replayed += 1
+            return self._completed[key], True
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.joined_in_flight += 1
+            return await asyncio.shield(task), True
+
+        task = self._in_flight[key] = asyncio.ensure_future(work())
+        self.executed += 1
+
+        def settle(task: asyncio.Task):
+            self._in_flight.pop(key, None)
+            if remember and not task.cancelled() and task.exception() is None and keep(task.result()):
+                self._completed[key] = task.result()
+
+        task.add_done_callback(settle)
+        return await asyncio.shield(task), False
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._in_flight),
+            "remembered": len(self._completed),
+            "executed": self.executed,
+            "joined_in_flight": self.joined_in_flight,
+            "replayed": self.replayed,
+            "llm_calls_saved": self.joined_in_flight + self.replayed,
+        }
+
+# Patient messages sent to /chat/message.
+chat_requests = RequestCoalescer()
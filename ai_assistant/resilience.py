@@ -0,0 +1,284 @@
+# ai_assistant/resilience.py
+
+import asyncio
+import random
+import sys
+import threading
+import time
+from typing import Awaitable, Callable
+
+from config import (
+    GEMINI_TIMEOUT_SECONDS, GEMINI_MAX_ATTEMPTS, GEMINI_HEDGE_AFTER_SECONDS, GEMINI_HEDGE_BUDGET,
+    DB_MAX_ATTEMPTS, RETRY_BASE_DELAY_SECONDS, RETRY_MAX_DELAY_SECONDS,
+    BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS,
+)
+from structured_log import get_logger
+
+log = get_logger(__name__)
+
+# HTTP statuses worth another try: timeouts, rate limits and server-side failures.
+TRANSIENT_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+def is_transient(error: Exception) -> bool:
+    """
+    Whether a failed call may succeed if repeated. Timeouts and connection errors are;
+    so are errors carrying a retryable HTTP status (Google API errors have `code`,
+    Supabase storage errors `status`). Anything else, like a bad request, is not.
+    """
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # httpx is only loaded once the Supabase client is; until then no error can be one of its.
+    httpx = sys.modules.get("httpx")
+    if httpx and isinstance(error, httpx.TransportError):
+        return True
+    for attribute in ("code", "status", "status_code"):
+        try:
+            return int(getattr(error, attribute)) in TRANSIENT_STATUSES
+        except (AttributeError, TypeError, ValueError):
+            continue
+    return False
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a backend whose breaker is open."""
+
+    def __init__(self, backend: str, retry_after: float):
+        super().__init__(f"{backend} is unavailable; retry after {retry_after:.0f}s")
+        self.backend = backend
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """
+    Stops calls to a backend after `failure_threshold` transient failures in a row.
+    Calls then fail at once with CircuitOpen for `reset_seconds`, after which one
+    probe call is let through: success closes the breaker, failure opens it again.
+    Thread-safe, since Supabase calls run on the database thread pool.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.short_circuited = 0
+
+    def _retry_after(self) -> float:
+        return max(0.0, self._opened_at + self.reset_seconds - time.monotonic())
+
+    def raise_if_open(self):
+        """Fails fast while the breaker is open or probing, without taking the probe itself."""
+        with self._lock:
+            if self.state == "open" and self._retry_after() > 0:
+                self.short_circuited += 1
+                raise CircuitOpen(self.name, self._retry_after())
+            if self.state == "half_open" and self._probing:
+                self.short_circuited += 1
+                raise CircuitOpen(self.name, 1.0)
+
+    def before_call(self):
+        """Raises CircuitOpen if the call may not go ahead; may make this call the probe."""
+        with self._lock:
+            if self.state == "open":
+                if self._retry_after() > 0:
+                    self.short_circuited += 1
+                    raise CircuitOpen(self.name, self._retry_after())
+                self.state = "half_open"
+            if self.state == "half_open":
+                if self._probing:
+                    self.short_circuited += 1
+                    raise CircuitOpen(self.name, 1.0)
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                log.info("Circuit breaker closed", extra={"backend": self.name})
+            self.state = "closed"
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == "half_open" or (self.state == "closed" and self._failures >= self.failure_threshold):
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self.opened += 1
+                log.warning("Circuit breaker opened", extra={"backend": self.name, "failures": self._failures})
+
+    def abandon(self):
+        """The call was cancelled before it told us anything; let another probe through."""
+        with self._lock:
+            self._probing = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "open": int(self.state == "open"),
+                "consecutive_failures": self._failures,
+                "opened": self.opened,
+                "short_circuited": self.short_circuited,
+                "retry_after_s": round(self._retry_after(), 1) if self.state == "open" else 0.0,
+            }
+
+class ExternalService:
+    """
+    Resilience policy for one backend: a circuit breaker, a per-attempt timeout, and
+    jittered exponential retries of transient failures for idempotent calls. Async
+    calls can also be hedged: if the first attempt is slower than `hedge_after`, a
+    second identical one is started and whichever succeeds first wins. Hedges are
+    capped at `hedge_budget` of all calls so a slow backend doesn't get twice the load.
+    """
+
+    def __init__(self, name: str, timeout: float | None, max_attempts: int, hedge_after: float = 0.0,
+                 hedge_budget: float = 0.0, base_delay: float = RETRY_BASE_DELAY_SECONDS,
+                 max_delay: float = RETRY_MAX_DELAY_SECONDS):
+        self.name = name
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.hedge_after = hedge_after
+        self.hedge_budget = hedge_budget
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = CircuitBreaker(name)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def _count(self, counter: str, amount: int = 1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": anywhere up to the exponential delay, so retries from many callers spread out.
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _after_failure(self, error: Exception, attempt: int, attempts: int) -> bool:
+        """Books a failed attempt. Returns True if it should be retried."""
+        transient = is_transient(error)
+        if isinstance(error, TimeoutError):
+            self._count("timeouts")
+        if transient:
+            self.breaker.record_failure()
+        else:
+            # The backend answered, so it is up; the request itself was at fault.
+            self.breaker.record_success()
+        if transient and attempt + 1 < attempts:
+            self._count("retries")
+            log.info("Retrying failed call", extra={
+                "backend": self.name, "attempt": attempt + 1, "max_attempts": attempts, "error": str(error),
+            })
+            return True
+        self._count("failures")
+        return False
+
+    async def call(self, make_call: Callable[[], Awaitable], idempotent: bool = True, hedge: bool = False):
+        """
+        Awaits `make_call()`, which must start a fresh request each time it is called.
+        Raises CircuitOpen without calling if the breaker is open, or the last error.
+        """
+        self._count("calls")
+        attempts = self.max_attempts if idempotent else 1
+        for attempt in range(attempts):
+            self.breaker.before_call()
+            try:
+                result = await self._attempt(make_call, hedge and idempotent)
+            except asyncio.CancelledError:
+                self.breaker.abandon()
+                raise
+            except Exception as e:
+                if not self._after_failure(e, attempt, attempts):
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def _attempt(self, make_call: Callable[[], Awaitable], hedge: bool):
+        if not hedge or not self.hedge_after:
+            return await asyncio.wait_for(make_call(), self.timeout)
+
+        primary = asyncio.ensure_future(asyncio.wait_for(make_call(), self.timeout))
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_after)
+        if done or self.hedges >= self.hedge_budget * self.calls:
+            return await primary
+
+        self._count("hedges")
+        backup = asyncio.ensure_future(asyncio.wait_for(make_call(), self.timeout))
+        pending = {primary, backup}
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self._count("hedge_wins")
+                        return task.result()
+                if not pending:
+                    # Both failed; report the primary's error.
+                    return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def call_sync(self, func: Callable, idempotent: bool = True):
+        """
+        Blocking form of `call` for the Supabase client, run on the database thread pool.
+        There is no timeout here: the client's own HTTP timeout bounds each attempt.
+        """
+        self._count("calls")
+        attempts = self.max_attempts if idempotent else 1
+        for attempt in range(attempts):
+            self.breaker.before_call()
+            try:
+                result = func()
+            except Exception as e:
+                if not self._after_failure(e, attempt, attempts):
+                    raise
+                time.sleep(self._backoff(attempt))
+                continue
+            self.breaker.record_success()
+            return result
+
+    def note_failure(self, error: Exception):
+        """Books a failure that happened outside `call`, e.g. partway through a streamed reply."""
+        self._after_failure(error, 0, 1)
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "retries": self.retries,
+            "timeouts": self.timeouts,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "breaker": self.breaker.stats(),
+        }
+
+async def with_idle_timeout(stream, timeout: float | None):
+    """Iterates an async stream, raising TimeoutError if any item takes longer than `timeout` to arrive."""
+    iterator = stream.__aiter__()
+    while True:
+        try:
+            item = await asyncio.wait_for(iterator.__anext__(), timeout)
+        except StopAsyncIteration:
+            return
+        yield item
+
+gemini = ExternalService(
+    "gemini", GEMINI_TIMEOUT_SECONDS, GEMINI_MAX_ATTEMPTS,
+    hedge_after=GEMINI_HEDGE_AFTER_SECONDS, hedge_budget=GEMINI_HEDGE_BUDGET,
+)
+# Each Supabase attempt is bounded by the client's DB_TIMEOUT_SECONDS.
+supabase = ExternalService("supabase", None, DB_MAX_ATTEMPTS)
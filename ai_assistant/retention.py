@@ -0,0 +1,294 @@
+# ai_assistant/retention.py
+
+import argparse
+import asyncio
+import functools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import database_service as db
+from config import (SESSION_RETENTION_DAYS, RETENTION_BATCH_SIZE, RETENTION_MAX_ROWS_PER_SECOND,
+                    RETENTION_STORAGE_CONCURRENCY, RETENTION_IMAGE_GRACE_HOURS)
+from session_store import SessionStore, VersionConflict, session_store
+from structured_log import get_logger
+
+log = get_logger(__name__)
+
+# A run's progress is saved here in the session store after every batch.
+CHECKPOINT_KEY = "retention:checkpoint"
+# Objects per storage listing page, and image URLs per reference check or remove call.
+LIST_PAGE_SIZE = 1000
+IMAGE_CHUNK_SIZE = 50
+
+class Superseded(Exception):
+    """Another worker has taken over the run."""
+
+class _Pacer:
+    """Spaces out batches so that on average at most `rate` units of work are done a second."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._mark = time.monotonic()
+
+    async def spend(self, units: int):
+        if self.rate and units:
+            delay = self._mark + units / self.rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        self._mark = time.monotonic()
+
+def _parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+def _written_before(obj: dict, moment: datetime) -> bool:
+    """Whether a storage object was last written before `moment` (objects that were never overwritten only have created_at)."""
+    written = obj.get("updated_at") or obj.get("created_at")
+    return bool(written) and _parse_time(written) < moment
+
+class RetentionJob:
+    """
+    Deletes what the service no longer needs to keep, in two phases:
+
+    1. sessions: sessions created more than `retention_days` ago, `batch_size` at a
+       time, oldest first. Each batch is one keyset range scan and two bulk deletes
+       (messages, then sessions).
+    2. images: a sweep of the whole image bucket for objects no message references,
+       such as those of the sessions just deleted or deleted through the API. Objects
+       written to storage within the grace period are skipped: content-addressed images
+       are shared, and a worker reusing one writes it again (see
+       database_service.upload_image), so a chat may have just reused an old object
+       while its message row is still in that worker's write-behind buffer.
+
+    After every batch the position is saved to the session store, so a run that is
+    interrupted (a deploy, an outage) resumes where it stopped; saves are a
+    compare-and-set, so if a second worker starts a run the first one stops. Work is
+    paced to `rows_per_second` and done on the job's own small thread pool, leaving the
+    database pool and most of the database's capacity to live traffic. With `dry_run`
+    nothing is deleted and the counts are what would have been, except that an image
+    shared by expired sessions in different batches is not counted.
+    """
+
+    def __init__(self, retention_days: int = SESSION_RETENTION_DAYS, batch_size: int = RETENTION_BATCH_SIZE,
+                 rows_per_second: float = RETENTION_MAX_ROWS_PER_SECOND,
+                 concurrency: int = RETENTION_STORAGE_CONCURRENCY,
+                 image_grace_hours: float = RETENTION_IMAGE_GRACE_HOURS, store: SessionStore = session_store):
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.rows_per_second = rows_per_second
+        self.image_grace_hours = image_grace_hours
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="retention")
+        self._task: asyncio.Task | None = None
+        self._schedule: asyncio.Task | None = None
+        self.running = False
+        self.dry_run = False
+        self.phase = "idle"
+        self.progress = self._new_progress()
+        self.runs = 0
+        self.failed_runs = 0
+        self.last_run: dict | None = None
+
+    @staticmethod
+    def _new_progress() -> dict:
+        return {"batches": 0, "sessions_deleted": 0, "messages_deleted": 0, "objects_scanned": 0, "images_deleted": 0}
+
+    def start(self, dry_run: bool = False) -> bool:
+        """Starts a run in the background. Returns False if one is already running in this process."""
+        if self.running:
+            return False
+        self.running, self.dry_run = True, dry_run
+        self._task = asyncio.create_task(self._run(dry_run))
+        return True
+
+    def schedule(self, interval_seconds: float):
+        """Starts a run every `interval_seconds`, skipping any that would overlap the previous one."""
+        async def every():
+            while True:
+                await asyncio.sleep(interval_seconds)
+                self.start()
+        self._schedule = asyncio.create_task(every())
+
+    async def stop(self):
+        """Cancels the schedule and any run in progress; a cancelled run resumes from its checkpoint next time."""
+        for task in (self._schedule, self._task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._executor.shutdown(wait=True)
+
+    async def run(self, dry_run: bool = False) -> dict:
+        """Runs (or resumes) a retention pass to the end and returns a summary of it."""
+        if self.running:
+            raise RuntimeError("A retention run is already in progress.")
+        self.running, self.dry_run = True, dry_run
+        return await self._run(dry_run)
+
+    async def _run(self, dry_run: bool) -> dict:
+        self.runs += 1
+        started = time.perf_counter()
+        outcome = "failed"
+        try:
+            checkpoint, version = await self._claim(dry_run)
+            self.progress = checkpoint["progress"]
+            pacer = _Pacer(self.rows_per_second)
+            if checkpoint["phase"] == "sessions":
+                self.phase = "sessions"
+                version = await self._purge_sessions(checkpoint, version, pacer)
+                checkpoint.update(phase="images", offset=0)
+                version = await self._save(checkpoint, version)
+            self.phase = "images"
+            await self._sweep_images(checkpoint, version, pacer)
+            await self.store.delete(CHECKPOINT_KEY)
+            outcome = "completed"
+        except Superseded:
+            outcome = "superseded"
+            log.warning("Retention run taken over by another worker")
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            log.error("Retention run failed; the next run resumes from its checkpoint", extra={"error": str(e)})
+        finally:
+            self.running, self.phase = False, "idle"
+            self.failed_runs += outcome == "failed"
+            self.last_run = {
+                "outcome": outcome, "dry_run": dry_run, "finished_at": datetime.now(timezone.utc).isoformat(),
+                "seconds": round(time.perf_counter() - started, 1), **self.progress,
+            }
+            log.info("Retention run finished", extra=self.last_run)
+        return self.last_run
+
+    # Checkpoints
+
+    def _new_checkpoint(self, dry_run: bool) -> dict:
+        now = datetime.now(timezone.utc)
+        return {
+            "dry_run": dry_run,
+            "phase": "sessions" if self.retention_days > 0 else "images",
+            "sessions_before": (now - timedelta(days=self.retention_days)).isoformat(),
+            "images_before": (now - timedelta(hours=self.image_grace_hours)).isoformat(),
+            "after": None,
+            "offset": 0,
+            "progress": self._new_progress(),
+        }
+
+    async def _claim(self, dry_run: bool) -> tuple[dict, int]:
+        """Loads the unfinished run of the same kind, or starts a new one, and takes it over."""
+        entry = await self.store.load(CHECKPOINT_KEY)
+        expected = entry[0] if entry else 0
+        if entry and entry[1]["dry_run"] == dry_run:
+            checkpoint = entry[1]
+            log.info("Resuming retention run", extra={"phase": checkpoint["phase"], "dry_run": dry_run})
+        else:
+            checkpoint = self._new_checkpoint(dry_run)
+        return checkpoint, await self._save(checkpoint, expected)
+
+    async def _save(self, checkpoint: dict, version: int) -> int:
+        try:
+            return await self.store.save(CHECKPOINT_KEY, checkpoint, expected_version=version)
+        except VersionConflict:
+            raise Superseded() from None
+
+    # Work
+
+    async def _call(self, func, *args):
+        """Runs a database_service call on the job's pool; those return None on errors, which ends the run."""
+        result = await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(func, *args))
+        if result is None:
+            raise RuntimeError(f"{func.__name__} failed")
+        return result
+
+    async def _purge_sessions(self, checkpoint: dict, version: int, pacer: _Pacer) -> int:
+        progress = checkpoint["progress"]
+        while True:
+            after = tuple(checkpoint["after"]) if checkpoint["after"] else None
+            rows = await self._call(db.get_expired_sessions, checkpoint["sessions_before"], self.batch_size, after)
+            if not rows:
+                return version
+            session_ids = [row["id"] for row in rows]
+            image_urls = await self._call(db.get_session_image_urls, session_ids)
+            if self.dry_run:
+                sessions, messages = len(session_ids), await self._call(db.count_session_messages, session_ids)
+                # The sweep won't see these as unreferenced while their messages are kept, so count them here.
+                images = await self._count_unreferenced(sorted(image_urls), exclude_sessions=set(session_ids))
+            else:
+                # Their images are left to the sweep, which knows when each was last written.
+                sessions, messages = await self._call(db.delete_sessions, session_ids)
+                images = 0
+
+            progress["batches"] += 1
+            progress["sessions_deleted"] += sessions
+            progress["messages_deleted"] += messages
+            progress["images_deleted"] += images
+            checkpoint["after"] = [rows[-1]["created_at"], rows[-1]["id"]]
+            version = await self._save(checkpoint, version)
+            await pacer.spend(sessions + messages + images)
+
+    async def _sweep_images(self, checkpoint: dict, version: int, pacer: _Pacer) -> int:
+        """
+        Pages through the bucket by name. The storage API pages by offset, so the
+        offset moves past what was kept, not what was removed; objects uploaded during
+        the sweep can shift it, and anything that is missed is found by the next run.
+        """
+        progress = checkpoint["progress"]
+        images_before = _parse_time(checkpoint["images_before"])
+        while True:
+            objects = await self._call(db.list_images, LIST_PAGE_SIZE, checkpoint["offset"])
+            old_enough = [obj["name"] for obj in objects if _written_before(obj, images_before)]
+            removed = await self._collect_images([db.public_image_url(name) for name in old_enough])
+
+            progress["batches"] += 1
+            progress["objects_scanned"] += len(objects)
+            progress["images_deleted"] += removed
+            checkpoint["offset"] += len(objects) - (0 if self.dry_run else removed)
+            version = await self._save(checkpoint, version)
+            if len(objects) < LIST_PAGE_SIZE:
+                return version
+            await pacer.spend(len(objects))
+
+    async def _collect_images(self, image_urls: list[str]) -> int:
+        """Removes the images that no message references, a chunk per call, concurrently."""
+        return await self._in_chunks(self._collect_chunk, image_urls)
+
+    async def _count_unreferenced(self, image_urls: list[str], exclude_sessions: set[str]) -> int:
+        """How many of the images no message outside `exclude_sessions` references."""
+        async def count_chunk(chunk):
+            return len(chunk) - len(await self._call(db.get_referenced_image_urls, chunk, exclude_sessions))
+        return await self._in_chunks(count_chunk, image_urls)
+
+    @staticmethod
+    async def _in_chunks(func, image_urls: list[str]) -> int:
+        chunks = [image_urls[i:i + IMAGE_CHUNK_SIZE] for i in range(0, len(image_urls), IMAGE_CHUNK_SIZE)]
+        return sum(await asyncio.gather(*(func(chunk) for chunk in chunks)))
+
+    async def _collect_chunk(self, image_urls: list[str]) -> int:
+        referenced = await self._call(db.get_referenced_image_urls, image_urls)
+        names = [db.image_name(url) for url in image_urls if url not in referenced]
+        if self.dry_run or not names:
+            return len(names)
+        return await self._call(db.delete_images, names)
+
+    def stats(self) -> dict:
+        return {
+            "running": int(self.running),
+            "dry_run": int(self.dry_run),
+            "phase": self.phase,
+            "runs": self.runs,
+            "failed_runs": self.failed_runs,
+            "max_rows_per_second": self.rows_per_second,
+            **self.progress,
+            "last_run": self.last_run,
+        }
+
+retention = RetentionJob()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete expired sessions and unreferenced symptom images")
+    parser.add_argument("--dry-run", action="store_true", help="count what would be deleted without deleting it")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(retention.run(args.dry_run)), indent=2))
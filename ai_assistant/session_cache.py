@@ -0,0 +1,142 @@
+# ai_assistant/session_cache.py
+
+import asyncio
+import time
+from collections import OrderedDict
+
+from config import (
+    SESSION_CACHE_MAX_ENTRIES, SESSION_CACHE_MAX_BYTES,
+    SESSION_CACHE_IDLE_TTL_SECONDS, SESSION_CACHE_REAP_SECONDS,
+)
+from structured_log import get_logger
+
+log = get_logger(__name__)
+
+class SessionCache:
+    """
+    Bounded LRU cache of live AIService objects, keyed by session id.
+
+    Entries are evicted when the cache holds too many sessions, when their
+    approximate memory use exceeds the byte budget, or when they have been idle
+    longer than the TTL. Eviction is always safe: /chat/message rebuilds a
+    missing session from the database.
+    """
+
+    def __init__(self, max_entries: int = SESSION_CACHE_MAX_ENTRIES, max_bytes: int = SESSION_CACHE_MAX_BYTES,
+                 idle_ttl: float = SESSION_CACHE_IDLE_TTL_SECONDS, reap_interval: float = SESSION_CACHE_REAP_SECONDS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.reap_interval = reap_interval
+        # session_id -> [service, last_used, approx_bytes]
+        self._entries: OrderedDict[str, list] = OrderedDict()
+        self._total_bytes = 0
+        self._reaper: asyncio.Task | None = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = {"capacity": 0, "memory": 0, "idle": 0}
+
+    def get(self, session_id: str, default=None):
+        entry = self._entries.get(session_id)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        entry[1] = time.monotonic()
+        self._entries.move_to_end(session_id)
+        return entry[0]
+
+    def __setitem__(self, session_id: str, service):
+        self.pop(session_id)
+        size = _approximate_size(service)
+        self._entries[session_id] = [service, time.monotonic(), size]
+        self._total_bytes += size
+        self._enforce_limits()
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._entries
+
+    def __delitem__(self, session_id: str):
+        if self.pop(session_id) is None:
+            raise KeyError(session_id)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def pop(self, session_id: str, default=None):
+        entry = self._entries.pop(session_id, None)
+        if entry is None:
+            return default
+        self._total_bytes -= entry[2]
+        return entry[0]
+
+    def clear(self):
+        self._entries.clear()
+        self._total_bytes = 0
+
+    def refresh_size(self, session_id: str):
+        """Re-measures a session after its history has grown (called after each turn)."""
+        entry = self._entries.get(session_id)
+        if entry is not None:
+            size = _approximate_size(entry[0])
+            self._total_bytes += size - entry[2]
+            entry[2] = size
+            self._enforce_limits()
+
+    def _evict_oldest(self, reason: str):
+        session_id, entry = self._entries.popitem(last=False)
+        self._total_bytes -= entry[2]
+        self.evictions[reason] += 1
+        log.info("Evicted session from memory", extra={"session_id": session_id, "reason": reason})
+
+    def _enforce_limits(self):
+        while len(self._entries) > self.max_entries:
+            self._evict_oldest("capacity")
+        # Always keep the most recently used session, even if it alone is over budget.
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            self._evict_oldest("memory")
+
+    def reap_idle(self) -> int:
+        """Evicts sessions idle for longer than the TTL. Returns how many were evicted."""
+        cutoff = time.monotonic() - self.idle_ttl
+        reaped = 0
+        # Entries are in least-recently-used order, so stop at the first fresh one.
+        while self._entries and next(iter(self._entries.values()))[1] < cutoff:
+            self._evict_oldest("idle")
+            reaped += 1
+        return reaped
+
+    async def _reap_forever(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            self.reap_idle()
+
+    def start_reaper(self):
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.get_running_loop().create_task(self._reap_forever())
+
+    async def stop_reaper(self):
+        if self._reaper and not self._reaper.done():
+            self._reaper.cancel()
+            try:
+                await self._reaper
+            except asyncio.CancelledError:
+                pass
+        self._reaper = None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "approx_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": dict(self.evictions),
+        }
+
+def _approximate_size(service) -> int:
+    size = getattr(service, "approximate_size", None)
+    return size() if size else 0
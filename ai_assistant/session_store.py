@@ -0,0 +1,261 @@
+# ai_assistant/session_store.py
+
+import asyncio
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import SESSION_STORE_URL, SESSION_STORE_TTL_SECONDS, SESSION_CACHE_MAX_ENTRIES
+from structured_log import get_logger
+
+log = get_logger(__name__)
+
+class VersionConflict(Exception):
+    """Raised by `save` when the stored state is no longer the version the caller loaded."""
+
+class SessionStore:
+    """
+    Shared store for serialized chat state, so any worker can serve any turn.
+
+    Every saved state has a version that starts at 1 and goes up by one per save.
+    `save` is a compare-and-set: it only succeeds if the stored version is still
+    `expected_version` (0 for "not stored yet"), and raises VersionConflict otherwise.
+    States expire `ttl` seconds after their last save; the database is the fallback.
+    Stores that aren't `shared` between processes are not used for chat state.
+    """
+
+    shared = True
+
+    def __init__(self, ttl: float = SESSION_STORE_TTL_SECONDS):
+        self.ttl = ttl
+        self.loads = 0
+        self.misses = 0
+        self.saves = 0
+        self.conflicts = 0
+        self._saved_bytes = 0
+
+    async def load(self, session_id: str) -> tuple[int, dict] | None:
+        """The stored (version, state) of a session, or None if it isn't stored."""
+        entry = await self._load(session_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.loads += 1
+        version, data = entry
+        return version, json.loads(data)
+
+    async def version(self, session_id: str) -> int | None:
+        """The stored version of a session without fetching its state, or None if it isn't stored."""
+        return await self._version(session_id)
+
+    async def save(self, session_id: str, state: dict, expected_version: int) -> int:
+        """Stores `state` if the stored version is still `expected_version`. Returns the new version."""
+        data = json.dumps(state, separators=(",", ":")).encode()
+        version = await self._save(session_id, data, expected_version)
+        if version is None:
+            self.conflicts += 1
+            raise VersionConflict(session_id)
+        self.saves += 1
+        self._saved_bytes += len(data)
+        return version
+
+    async def delete(self, session_id: str):
+        await self._delete(session_id)
+
+    async def close(self):
+        pass
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "loads": self.loads,
+            "misses": self.misses,
+            "saves": self.saves,
+            "conflicts": self.conflicts,
+            "avg_state_bytes": round(self._saved_bytes / self.saves) if self.saves else 0,
+        }
+
+class MemorySessionStore(SessionStore):
+    """
+    Keeps states in this process, least recently saved first, up to `max_entries`.
+    Nothing is shared, so it only suits a single worker. Chats don't save their state
+    here: the session cache already holds the one live copy, and serializing every
+    turn (images included) into a second copy would double their memory outside the
+    cache's byte budget. Small records such as the retention checkpoint still are.
+    """
+
+    backend = "memory"
+    shared = False
+
+    def __init__(self, ttl: float = SESSION_STORE_TTL_SECONDS, max_entries: int = SESSION_CACHE_MAX_ENTRIES):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        # session_id -> (version, data, expires_at)
+        self._entries: OrderedDict[str, tuple[int, bytes, float]] = OrderedDict()
+
+    def _live(self, session_id: str):
+        entry = self._entries.get(session_id)
+        if entry and entry[2] < time.monotonic():
+            del self._entries[session_id]
+            return None
+        return entry
+
+    async def _load(self, session_id):
+        entry = self._live(session_id)
+        return (entry[0], entry[1]) if entry else None
+
+    async def _version(self, session_id):
+        entry = self._live(session_id)
+        return entry[0] if entry else None
+
+    async def _save(self, session_id, data, expected_version):
+        entry = self._live(session_id)
+        if (entry[0] if entry else 0) != expected_version:
+            return None
+        self._entries[session_id] = (expected_version + 1, data, time.monotonic() + self.ttl)
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return expected_version + 1
+
+    async def _delete(self, session_id):
+        self._entries.pop(session_id, None)
+
+class SqliteSessionStore(SessionStore):
+    """
+    Keeps states in a SQLite file, shared by every worker process on the host. The
+    compare-and-set is a single conditional UPDATE (or INSERT), so it is atomic across
+    processes. Calls run on one dedicated thread to keep SQLite off the event loop.
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path: str, ttl: float = SESSION_STORE_TTL_SECONDS):
+        super().__init__(ttl)
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-store")
+        self._connection: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS session_state ("
+                "session_id TEXT PRIMARY KEY, version INTEGER NOT NULL, state BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._connection = connection
+        return self._connection
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _load_sync(self, session_id):
+        return self._connect().execute(
+            "SELECT version, state FROM session_state WHERE session_id = ? AND expires_at > ?", (session_id, time.time())
+        ).fetchone()
+
+    def _version_sync(self, session_id):
+        row = self._connect().execute(
+            "SELECT version FROM session_state WHERE session_id = ? AND expires_at > ?", (session_id, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def _save_sync(self, session_id, data, expected_version):
+        connection, now = self._connect(), time.time()
+        if expected_version == 0:
+            # Not stored yet, or only an expired copy is left.
+            cursor = connection.execute(
+                "INSERT INTO session_state (session_id, version, state, expires_at) VALUES (?, 1, ?, ?) "
+                "ON CONFLICT (session_id) DO UPDATE SET version = 1, state = excluded.state, "
+                "expires_at = excluded.expires_at WHERE session_state.expires_at <= ?",
+                (session_id, data, now + self.ttl, now),
+            )
+        else:
+            cursor = connection.execute(
+                "UPDATE session_state SET version = version + 1, state = ?, expires_at = ? "
+                "WHERE session_id = ? AND version = ? AND expires_at > ?",
+                (data, now + self.ttl, session_id, expected_version, now),
+            )
+        return expected_version + 1 if cursor.rowcount == 1 else None
+
+    def _delete_sync(self, session_id):
+        self._connect().execute("DELETE FROM session_state WHERE session_id = ?", (session_id,))
+
+    async def _load(self, session_id):
+        return await self._run(self._load_sync, session_id)
+
+    async def _version(self, session_id):
+        return await self._run(self._version_sync, session_id)
+
+    async def _save(self, session_id, data, expected_version):
+        return await self._run(self._save_sync, session_id, data, expected_version)
+
+    async def _delete(self, session_id):
+        await self._run(self._delete_sync, session_id)
+
+    async def close(self):
+        self._executor.shutdown(wait=True)
+
+# Compare-and-set on a hash of {v: version, state: data}. A missing key counts as version 0.
+_REDIS_SAVE = """
+local version = tonumber(redis.call('HGET', KEYS[1], 'v') or '0')
+if version ~= tonumber(ARGV[1]) then return -1 end
+redis.call('HSET', KEYS[1], 'v', version + 1, 'state', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return version + 1
+"""
+
+class RedisSessionStore(SessionStore):
+    """
+    Keeps states in Redis (or anything that speaks its protocol, e.g. Valkey), shared
+    by every worker on every node. The compare-and-set runs as one Lua script.
+    """
+
+    backend = "redis"
+
+    def __init__(self, url: str, ttl: float = SESSION_STORE_TTL_SECONDS):
+        super().__init__(ttl)
+        # Only needed when a Redis URL is configured.
+        import redis.asyncio as redis
+
+        self._client = redis.from_url(url)
+        self._save_script = self._client.register_script(_REDIS_SAVE)
+
+    @staticmethod
+    def _key(session_id: str) -> str:
+        return f"medibridge:session:{session_id}"
+
+    async def _load(self, session_id):
+        version, data = await self._client.hmget(self._key(session_id), "v", "state")
+        return (int(version), data) if version is not None else None
+
+    async def _version(self, session_id):
+        version = await self._client.hget(self._key(session_id), "v")
+        return int(version) if version is not None else None
+
+    async def _save(self, session_id, data, expected_version):
+        version = await self._save_script(keys=[self._key(session_id)], args=[expected_version, data, int(self.ttl)])
+        return version if version > 0 else None
+
+    async def _delete(self, session_id):
+        await self._client.delete(self._key(session_id))
+
+    async def close(self):
+        await self._client.aclose()
+
+def open_store(url: str = SESSION_STORE_URL) -> SessionStore:
+    """Builds the store for a URL: memory://, sqlite:///path/to/file.db or redis://host:port/db."""
+    if url.startswith("memory:"):
+        return MemorySessionStore()
+    if url.startswith("sqlite:///"):
+        return SqliteSessionStore(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisSessionStore(url)
+    raise ValueError(f"Unsupported SESSION_STORE_URL: {url}")
+
+session_store = open_store()
+log.info("Session state store ready", extra={"backend": session_store.backend})
@@ -0,0 +1,62 @@
+# ai_assistant/timing.py
+
+import time
+from contextlib import contextmanager
+
+class StageTimer:
+    """Collects wall-clock timings for the named stages of one request, plus the prompt size of its LLM call."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: dict[str, float] = {}
+        self.prompt_tokens: int | None = None
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - started) * 1000
+
+    def finish(self) -> dict[str, float]:
+        """Records the `total` stage and returns every timing in milliseconds."""
+        self.stages["total"] = (time.perf_counter() - self.started) * 1000
+        return self.as_dict()
+
+    def as_dict(self) -> dict[str, float]:
+        return {name: round(ms, 2) for name, ms in self.stages.items()}
+
+    def server_timing_header(self) -> str:
+        """Formats the timings for the standard `Server-Timing` response header."""
+        return ", ".join(f"{name};dur={ms:.1f}" for name, ms in self.stages.items())
+
+class StageStats:
+    """Running totals of stage timings across requests, for /internal/stats."""
+
+    def __init__(self):
+        self.count = 0
+        self.totals: dict[str, float] = {}
+        self.prompt_turns = 0
+        self.prompt_tokens = 0
+        self.max_prompt_tokens = 0
+
+    def observe(self, timer: StageTimer):
+        self.count += 1
+        for name, ms in timer.stages.items():
+            self.totals[name] = self.totals.get(name, 0.0) + ms
+        if timer.prompt_tokens is not None:
+            self.prompt_turns += 1
+            self.prompt_tokens += timer.prompt_tokens
+            self.max_prompt_tokens = max(self.max_prompt_tokens, timer.prompt_tokens)
+
+    def stats(self) -> dict:
+        return {
+            "turns": self.count,
+            "avg_ms": {name: round(total / self.count, 2) for name, total in self.totals.items()} if self.count else {},
+            "avg_prompt_tokens": round(self.prompt_tokens / self.prompt_turns, 1) if self.prompt_turns else None,
+            "max_prompt_tokens": self.max_prompt_tokens,
+        }
+
+# Timings of chat turns on the request path (/chat/message and its streaming variant).
+turn_stats = StageStats()
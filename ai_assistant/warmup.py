@@ -0,0 +1,89 @@
+# ai_assistant/warmup.py
+
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+from structured_log import get_logger
+
+log = get_logger(__name__)
+
+# Backoff between attempts of a failed step, in seconds.
+RETRY_DELAYS = (1, 2, 5, 10, 30)
+
+class Warmup:
+    """
+    Gets the slow-to-start parts of the service ready in the background, all at once,
+    while the server is already accepting connections. Until every step has succeeded
+    the service reports itself not ready on /readyz, so the load balancer keeps traffic
+    away; a request that arrives anyway just does the same work on demand. A failed
+    step is logged and retried with backoff rather than leaving a backend silently
+    unusable.
+    """
+
+    def __init__(self):
+        self._steps: dict[str, Callable[[], Awaitable]] = {}
+        self._status: dict[str, dict] = {}
+        self._task: asyncio.Task | None = None
+        self._started = 0.0
+        self.ready_after_ms: float | None = None
+        self.stopping = False
+
+    def add(self, name: str, step: Callable[[], Awaitable]):
+        """Registers a step: an async callable. Run blocking work with asyncio.to_thread."""
+        self._steps[name] = step
+        self._status[name] = {"state": "pending", "attempts": 0}
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._task = asyncio.create_task(self._run())
+
+    async def wait(self):
+        """Waits until every step has succeeded."""
+        if self._task is not None:
+            await asyncio.shield(self._task)
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_after_ms is not None and not self.stopping
+
+    async def stop(self):
+        """Marks the service not ready, so it is taken out of rotation while it shuts down."""
+        self.stopping = True
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        await asyncio.gather(*(self._run_step(name, step) for name, step in self._steps.items()))
+        self.ready_after_ms = round((time.perf_counter() - self._started) * 1000, 1)
+        log.info("Warm-up complete", extra={"ms": self.ready_after_ms})
+
+    async def _run_step(self, name: str, step: Callable[[], Awaitable]):
+        status = self._status[name]
+        while True:
+            status["attempts"] += 1
+            started = time.perf_counter()
+            try:
+                await step()
+            except Exception as e:
+                delay = RETRY_DELAYS[min(status["attempts"], len(RETRY_DELAYS)) - 1]
+                status.update(state="failed", error=str(e))
+                log.error("Warm-up step failed; retrying", extra={"step": name, "error": str(e), "retry_in_s": delay})
+                await asyncio.sleep(delay)
+                continue
+            status.update(state="ready", ms=round((time.perf_counter() - started) * 1000, 1))
+            status.pop("error", None)
+            return
+
+    def stats(self) -> dict:
+        return {
+            "ready": int(self.ready),
+            "ready_after_ms": self.ready_after_ms,
+            "steps": {name: dict(status) for name, status in self._status.items()},
+        }
+
+warmup = Warmup()
@@ -0,0 +1,44 @@
+-- database/migrations/0001_ai_assistant_sessions.sql
+--
+-- Columns, indexes and tables the AI assistant (ai_assistant/) reads and writes on
+-- top of the original ai_sessions and ai_messages tables. Apply it before deploying
+-- a version of the assistant that selects these columns: GET /session and restoring
+-- a chat from the database fail on a database without them. Every statement is
+-- idempotent, so it is safe to run again.
+
+begin;
+
+-- Rolling summary of the turns folded out of a chat's context window, and how many
+-- stored messages it stands in for (context_window.py, AIService.fold_context).
+alter table ai_sessions
+    add column if not exists context_summary text,
+    add column if not exists context_summary_turns integer not null default 0;
+
+-- Gemini usage per session (llm_usage.py), with its totals in their own columns so
+-- the heaviest sessions can be listed from an index (GET /internal/usage/sessions).
+alter table ai_sessions
+    add column if not exists llm_usage jsonb,
+    add column if not exists llm_tokens bigint not null default 0,
+    add column if not exists llm_seconds double precision not null default 0;
+
+create index if not exists ai_sessions_llm_tokens on ai_sessions (llm_tokens desc);
+create index if not exists ai_sessions_llm_seconds on ai_sessions (llm_seconds desc);
+
+-- Keyset pagination of a user's sessions and of a session's messages, newest first.
+create index if not exists ai_sessions_user_created on ai_sessions (user_id, created_at desc, id desc);
+create index if not exists ai_messages_session_timestamp on ai_messages (session_id, "timestamp" desc, id desc);
+
+-- The retention job's scan of expired sessions, and its check whether any message
+-- still points at an image.
+create index if not exists ai_sessions_created on ai_sessions (created_at, id);
+create index if not exists ai_messages_image_url on ai_messages (image_url) where image_url is not null;
+
+-- Pre-aggregated triage numbers per UTC day (analytics.py). `version` goes up with
+-- every write, so concurrent workers can compare-and-set.
+create table if not exists ai_analytics_daily (
+    day date primary key,
+    counters jsonb not null,
+    version integer not null default 1
+);
+
+commit;